@@ -1,8 +1,11 @@
 import os
+from dotenv import load_dotenv
+
+# Las variables de .env deben estar cargadas antes de leer Config
+load_dotenv()
 
 class Config:
     PDF_OUTPUT_PATH = os.getenv("PDF_OUTPUT_PATH", "temp_pdfs/")
-    QR_TEMP_PATH = os.getenv("QR_TEMP_PATH", "temp_qr/")
     APP_NAME = "API Generación de PDF con QR"
     VERSION = "1.0.0"
     DATABASE_URL = "sqlite:///facturas.db"
@@ -10,6 +13,95 @@ class Config:
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 1440
 
+    # Pool de render: "process" usa procesos precalentados, "inline" renderiza en el mismo proceso (tests)
+    RENDER_BACKEND = os.getenv("RENDER_BACKEND", "process")
+    RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+    RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", "30"))
+    RENDER_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RENDER_QUEUE_TIMEOUT_SECONDS", "30"))  # espera máxima en la cola del pool (0 = sin límite)
+    RENDER_MAX_JOBS_PER_WORKER = int(os.getenv("RENDER_MAX_JOBS_PER_WORKER", "500"))  # 0 = sin reciclaje
+
+    # API de jobs asíncronos (/jobs)
+    JOBS_MAX_QUEUE = int(os.getenv("JOBS_MAX_QUEUE", "200"))
+    JOBS_CONSUMERS = int(os.getenv("JOBS_CONSUMERS", RENDER_WORKERS))
+    JOBS_MAX_HISTORY = int(os.getenv("JOBS_MAX_HISTORY", "10000"))
+
+    # Lotes (/generar_pdf/batch)
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", RENDER_WORKERS * 2))
+
+    # Control de admisión de /generar_pdf/ y /parse_pdf/ (0 = sin límite)
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", RENDER_WORKERS * 4))
+    ADMISSION_MAX_QUEUED_WORK = int(os.getenv("ADMISSION_MAX_QUEUED_WORK", "5000"))  # detalles + documentos
+
+    # Cliente S3 compartido (app/services/storage.py)
+    S3_REGION = os.getenv("S3_REGION")
+    S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # p. ej. http://localhost:9000 (MinIO)
+    S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+    S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "5"))
+    S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "30"))
+    S3_RETRY_MODE = os.getenv("S3_RETRY_MODE", "standard")  # legacy | standard | adaptive
+    S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+    S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+    S3_MULTIPART_CHUNKSIZE_MB = int(os.getenv("S3_MULTIPART_CHUNKSIZE_MB", "8"))
+    S3_MULTIPART_CONCURRENCY = int(os.getenv("S3_MULTIPART_CONCURRENCY", "4"))
+
+    # Outbox de subidas a S3: PDFs en disco + índice en SQLite, drenado por workers con reintentos
+    OUTBOX_SPOOL_PATH = os.getenv("OUTBOX_SPOOL_PATH", os.path.join(PDF_OUTPUT_PATH, "outbox"))
+    OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "2"))
+    OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "600"))
+    OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+    # Si un proceso muere subiendo, su reclamo vence y otro proceso retoma la subida
+    OUTBOX_CLAIM_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_CLAIM_TIMEOUT_SECONDS", "900"))
+
+    # Cache de render por contenido (0 = nivel desactivado)
+    RENDER_CACHE_DIR = os.getenv("RENDER_CACHE_DIR", os.path.join(PDF_OUTPUT_PATH, "render_cache"))
+    RENDER_CACHE_MEMORY_MB = int(os.getenv("RENDER_CACHE_MEMORY_MB", "64"))
+    RENDER_CACHE_DISK_MB = int(os.getenv("RENDER_CACHE_DISK_MB", "1024"))
+    # Cuánto se recuerda que un PDF cacheado ya está en S3 antes de volver a hacer head_object
+    RENDER_CACHE_UPLOADED_TTL_SECONDS = int(os.getenv("RENDER_CACHE_UPLOADED_TTL_SECONDS", "300"))
+
+    # Cache de validación de buckets S3 (head_bucket), en segundos
+    S3_BUCKET_CACHE_TTL = float(os.getenv("S3_BUCKET_CACHE_TTL", "300"))
+    S3_BUCKET_CACHE_NEGATIVE_TTL = float(os.getenv("S3_BUCKET_CACHE_NEGATIVE_TTL", "30"))
+
+    # Cache de logos decodificados (emisor / afacturar), acotada en MB
+    IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "32"))
+    # Resolución a la que se reducen los logos para su caja en el PDF (0 = resolución original)
+    LOGO_DPI = int(os.getenv("LOGO_DPI", "150"))
+    # Cache de la parte fija del encabezado por emisor, acotada en MB (0 = desactivada)
+    HEADER_CACHE_MB = int(os.getenv("HEADER_CACHE_MB", "16"))
+
+    # Modo factura grande: desde cuántos detalles se renderiza en streaming (0 = nunca)
+    LARGE_INVOICE_MIN_DETALLES = int(os.getenv("LARGE_INVOICE_MIN_DETALLES", "2000"))
+    # Memoria residente máxima del proceso durante un render en modo grande (0 = sin límite)
+    RENDER_MEMORY_BUDGET_MB = int(os.getenv("RENDER_MEMORY_BUDGET_MB", "1024"))
+    # Retry-After del 503 cuando un render excede ese presupuesto
+    RENDER_MEMORY_RETRY_AFTER_SECONDS = int(os.getenv("RENDER_MEMORY_RETRY_AFTER_SECONDS", "30"))
+
+    # Tamaño de los PDF (por despliegue; cada factura puede cambiarlo en caracteristicas.compresion)
+    PDF_COMPRESSION_LEVEL = int(os.getenv("PDF_COMPRESSION_LEVEL", "6"))  # zlib 0-9, 0 = streams sin comprimir
+    PDF_ASCII85 = os.getenv("PDF_ASCII85", "0") == "1"  # streams en ASCII85 (solo para transportes de 7 bits)
+    PDF_OBJECT_STREAMS = os.getenv("PDF_OBJECT_STREAMS", "1") == "1"  # object streams + xref comprimida (PDF 1.5)
+
+    # GET /metrics (formato Prometheus) exige "Authorization: Bearer <token>"; vacío = endpoint desactivado (404)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    # Header Server-Timing con la duración de cada etapa en /generar_pdf/ y /parse_pdf/
+    SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+    # Perfilado bajo demanda de un render (header X-Profile-Token o ?perfil=); sin token queda desactivado
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles/")
+    PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "50"))  # perfiles (.pstats + .collapsed) que se conservan
+    PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "1"))  # intervalo del muestreo de pilas
+
+    # Captura automática de renders lentos (0 = desactivada): forma del payload, etapas y pilas muestreadas
+    SLOW_RENDER_MS = float(os.getenv("SLOW_RENDER_MS", "5000"))
+    SLOW_RENDER_SAMPLE_MS = float(os.getenv("SLOW_RENDER_SAMPLE_MS", "50"))
+    SLOW_RENDER_DIR = os.getenv("SLOW_RENDER_DIR", "renders_lentos/")
+    SLOW_RENDER_MAX_CAPTURES = int(os.getenv("SLOW_RENDER_MAX_CAPTURES", "200"))
+
 # Crear directorios si no existen
 os.makedirs(Config.PDF_OUTPUT_PATH, exist_ok=True)
-os.makedirs(Config.QR_TEMP_PATH, exist_ok=True)
+os.makedirs(Config.OUTBOX_SPOOL_PATH, exist_ok=True)
@@ -7,7 +7,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     logger.warning(f"⚠️ HTTP {exc.status_code}: {exc.detail} en {request.method} {request.url}")
     return JSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail}
+        content={"error": exc.detail},
+        headers=exc.headers,
     )
 
 async def general_exception_handler(request: Request, exc: Exception):
@@ -1,13 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from app.routes.auth_routes import router as auth_router
 from app.routes.routes import router as pdf_router
+from app.routes.job_routes import router as job_router
+from app.routes.monitor_routes import router as monitor_router
+from app.routes.metrics_routes import router as metrics_router
 from app.middlewares import LoggingMiddleware
 from app.exception_handler import http_exception_handler, general_exception_handler
 from app.logging_config import logger
+from app.services.render_executor import render_executor
+from app.services.render_jobs import gestor_jobs
+from app.services.upload_outbox import outbox_uploads
 
-app = FastAPI(title="API para Generación de PDF con QR")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Arranca los workers de render antes de aceptar peticiones
+    await render_executor.iniciar()
+    await gestor_jobs.iniciar()
+    await outbox_uploads.iniciar()
+    yield
+    await outbox_uploads.cerrar()
+    await gestor_jobs.cerrar()
+    render_executor.cerrar()
+
+
+app = FastAPI(title="API para Generación de PDF con QR", lifespan=lifespan)
 
 # Agregar Middleware de Logging
 app.add_middleware(LoggingMiddleware)
@@ -32,6 +52,9 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 # Incluir las rutas
 app.include_router(auth_router)
 app.include_router(pdf_router)
+app.include_router(job_router)
+app.include_router(monitor_router)
+app.include_router(metrics_router)
 
 @app.get("/")
 def root():
@@ -3,11 +3,20 @@ import json
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from app.logging_config import logger
+from app.services.metrics import peticiones_http
+from app.services.server_timing import escribir_header
+
+
+def _ruta(request: Request):
+    """ Plantilla de la ruta (/jobs/{job_id}) para no abrir una serie por cada URL """
+    ruta = request.scope.get("route")
+    return getattr(ruta, "path", "sin_ruta")
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         """ Middleware para registrar todas las peticiones y respuestas """
         start_time = time.time()
+        request.state.inicio = time.perf_counter()
         body = None
 
         # Leer el cuerpo de la petición en métodos POST, PUT y PATCH
@@ -22,7 +31,12 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
         try:
             response = await call_next(request)
+            escribir_header(request, response)
             process_time = time.time() - start_time
+            peticiones_http.observe(
+                time.perf_counter() - request.state.inicio,
+                method=request.method, route=_ruta(request), status=response.status_code,
+            )
 
             logger.info(
                 f"RESPUESTA: {response.status_code} {request.method} {request.url} "
@@ -33,6 +47,10 @@ class LoggingMiddleware(BaseHTTPMiddleware):
 
         except Exception as e:
             process_time = time.time() - start_time
+            peticiones_http.observe(
+                time.perf_counter() - request.state.inicio,
+                method=request.method, route=_ruta(request), status=500,
+            )
             logger.error(
                 f"ERROR: {request.method} {request.url} - {str(e)} "
                 f"( {process_time:.2f}s)", exc_info=True
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, HttpUrl, AnyUrl, Field, field_validator
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Integer, String, Index
 from app.database import Base
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 # -------------------------------
 # Modelo para la base de datos
@@ -12,6 +12,22 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
 
+class UploadOutbox(Base):
+    """PDF pendiente de subir a S3; el archivo vive en el spool local hasta que se sube."""
+    __tablename__ = "upload_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    bucket = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    ruta = Column(String, nullable=False)
+    tamano = Column(Integer, nullable=False)
+    estado = Column(String, nullable=False, default="pendiente")  # pendiente | subiendo | muerto
+    intentos = Column(Integer, nullable=False, default=0)
+    proximo_intento = Column(Float, nullable=False)
+    ultimo_error = Column(String, nullable=True)
+    creado = Column(Float, nullable=False)
+
+    __table_args__ = (Index("ix_upload_outbox_estado_proximo", "estado", "proximo_intento"),)
+
 # -------------------------------
 # Requests básicos
 # -------------------------------
@@ -101,6 +117,12 @@ class ColoresPersonalizados(BaseModel):
     color_negativo: Optional[str] = None
     color_positivo: Optional[str] = None
 
+class Compresion(BaseModel):
+    # Si no se envían, se usan los valores del despliegue (PDF_COMPRESSION_LEVEL, etc.)
+    nivel: Optional[int] = Field(None, ge=0, le=9)
+    ascii85: Optional[bool] = None
+    flujos_objetos: Optional[bool] = None
+
 class Caracteristicas(BaseModel):
     encabezado: EncabezadoCaracteristicas
     totales: Totales
@@ -110,6 +132,10 @@ class Caracteristicas(BaseModel):
     color_fondo: str
     # subsección opcional con colores por sección (solo aplica a plantilla 3)
     color_personalizado_campos: Optional[ColoresPersonalizados] = None
+    # "s3" (por defecto) sube el PDF y responde la URL; "directo" devuelve el PDF en la respuesta
+    entrega: Optional[Literal["s3", "directo"]] = "s3"
+    # tamaño del PDF: nivel de compresión, ASCII85 y object streams
+    compresion: Optional[Compresion] = None
 
 # -------------------------------
 # Receptor
@@ -0,0 +1,63 @@
+# app/routes/job_routes.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from app.models import FacturaRequest
+from app.services.auth import get_current_user
+from app.services.render_jobs import gestor_jobs, ColaLlenaError, UPLOADED, FAILED
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+def _buscar_job(job_id: str, user):
+    job = gestor_jobs.obtener(job_id)
+    # Un usuario solo ve sus propios jobs
+    if job is None or job.usuario != user.username:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+
+@router.post("", status_code=202)
+async def crear_job(
+    request: FacturaRequest,
+    user: dict = Depends(get_current_user),
+):
+    """
+    Encola el render de la factura y devuelve el id del job de inmediato.
+    Si la cola está llena responde 429 con Retry-After.
+    """
+    try:
+        job = gestor_jobs.enviar(request.dict(), usuario=user.username)
+    except ColaLlenaError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"code": 429, "error": str(e)},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return JSONResponse(
+        status_code=202,
+        content={"code": 202, "job_id": job.id, "estado": job.estado},
+    )
+
+
+@router.get("/{job_id}")
+async def estado_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Estado actual del job: queued, rendering, uploading, uploaded o failed."""
+    return _buscar_job(job_id, user).to_dict()
+
+
+@router.get("/{job_id}/result")
+async def resultado_job(job_id: str, user: dict = Depends(get_current_user)):
+    """
+    Resultado final del job con el mismo formato que /generar_pdf/.
+    Responde 409 mientras el job no haya terminado.
+    """
+    job = _buscar_job(job_id, user)
+    if job.estado == UPLOADED:
+        return JSONResponse(status_code=200, content={"code": 200, "url": job.url})
+    if job.estado == FAILED:
+        return JSONResponse(status_code=job.codigo, content={"code": job.codigo, "error": job.error})
+    return JSONResponse(
+        status_code=409,
+        content={"code": 409, "error": f"El job aún no termina (estado: {job.estado})"},
+    )
@@ -0,0 +1,57 @@
+# app/routes/metrics_routes.py
+
+import hmac
+
+import anyio.to_thread
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+from app.config import Config
+from app.services import metrics
+from app.services.admission import control_admision
+from app.services.render_executor import render_executor
+from app.services.render_jobs import gestor_jobs
+from app.services.upload_outbox import outbox_uploads, PENDIENTE, SUBIENDO, MUERTO
+
+router = APIRouter(tags=["Metrics"])
+
+
+def _verificar_token(request: Request):
+    # Prometheus no hace login: se usa un token estático en vez del JWT de la API.
+    # Sin token configurado el endpoint no existe, como cualquier ruta desconocida
+    if not Config.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    esperado = f"Bearer {Config.METRICS_TOKEN}"
+    if not hmac.compare_digest(request.headers.get("authorization", ""), esperado):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+
+
+async def _actualizar_medidores():
+    """Saturación y colas: se leen de cada componente en el momento del scrape."""
+    pool = render_executor.estado()
+    metrics.pool_render_workers.set(pool["workers"], modo=pool["modo"])
+    metrics.pool_render_en_curso.set(pool["en_curso"], modo=pool["modo"])
+
+    limitador = anyio.to_thread.current_default_thread_limiter()
+    metrics.threadpool_en_uso.set(limitador.borrowed_tokens)
+    metrics.threadpool_total.set(limitador.total_tokens)
+
+    metrics.admision_en_vuelo.set(control_admision.en_vuelo)
+    metrics.admision_trabajo.set(control_admision.trabajo)
+    metrics.admision_rechazadas.fijar(control_admision.rechazadas)
+
+    metrics.jobs_en_cola.set(gestor_jobs.en_cola())
+
+    por_estado = (await outbox_uploads.estado())["por_estado"]
+    for estado in (PENDIENTE, SUBIENDO, MUERTO):
+        resumen = por_estado.get(estado, {})
+        metrics.outbox_documentos.set(resumen.get("cantidad", 0), estado=estado)
+        metrics.outbox_bytes.set(resumen.get("bytes", 0), estado=estado)
+        metrics.outbox_antiguedad.set(resumen.get("antiguedad_segundos", 0), estado=estado)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def exponer_metricas(request: Request):
+    """Métricas del proceso en formato de texto de Prometheus."""
+    _verificar_token(request)
+    await _actualizar_medidores()
+    return Response(metrics.registro.texto(), media_type=metrics.CONTENT_TYPE)
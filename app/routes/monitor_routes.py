@@ -0,0 +1,59 @@
+# app/routes/monitor_routes.py
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from app.services.auth import get_current_user
+from app.services.admission import control_admision
+from app.services.bucket_cache import cache_buckets
+from app.services.upload_outbox import outbox_uploads
+from app.services.render_cache import cache_render
+from app.services.renders_lentos import capturas_lentas
+
+router = APIRouter(prefix="/monitor", tags=["Monitor"])
+
+_LOCALHOST = {"127.0.0.1", "::1", "localhost"}
+
+
+def solo_localhost(request: Request):
+    """Las capturas incluyen pilas del código: solo se sirven a quien está en la máquina."""
+    if request.client is None or request.client.host not in _LOCALHOST:
+        raise HTTPException(status_code=403, detail="Solo disponible desde localhost")
+
+
+@router.get("/admision")
+async def estado_admision(user: dict = Depends(get_current_user)):
+    """Renders en vuelo, trabajo pendiente, límites y contadores de admitidas/rechazadas."""
+    return control_admision.estado()
+
+
+@router.get("/buckets")
+async def estado_buckets(user: dict = Depends(get_current_user)):
+    """Buckets validados en cache, su resultado y segundos hasta que venzan."""
+    return cache_buckets.estado()
+
+
+@router.get("/outbox")
+async def estado_outbox(user: dict = Depends(get_current_user)):
+    """Subidas pendientes, en curso y muertas del outbox, con bytes y antigüedad."""
+    return await outbox_uploads.estado()
+
+
+@router.get("/render_cache")
+async def estado_render_cache(user: dict = Depends(get_current_user)):
+    """Aciertos, fallos y expulsiones de la cache de render, y ocupación de cada nivel."""
+    return cache_render.estado()
+
+
+@router.get("/renders_lentos", dependencies=[Depends(solo_localhost)])
+async def listar_renders_lentos(user: dict = Depends(get_current_user)):
+    """Renders que superaron SLOW_RENDER_MS (o el timeout), el más reciente primero."""
+    return await run_in_threadpool(capturas_lentas.listar)
+
+
+@router.get("/renders_lentos/{captura_id}", dependencies=[Depends(solo_localhost)])
+async def obtener_render_lento(captura_id: str, user: dict = Depends(get_current_user)):
+    """Captura completa: forma anonimizada del payload, etapas y pilas muestreadas (formato colapsado)."""
+    captura = await run_in_threadpool(capturas_lentas.obtener, captura_id)
+    if captura is None:
+        raise HTTPException(status_code=404, detail="Captura no encontrada")
+    return captura
@@ -1,37 +1,133 @@
 # app/routes/routes.py
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-from botocore.exceptions import ClientError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from typing import Literal, Optional
+from starlette.concurrency import run_in_threadpool
+from app.config import Config
 from app.models import FacturaRequest, PdfToJsonRequest
-from app.services.pdf_generator import generar_pdf
-from app.services.pdf_tpl1 import upload_pdf_to_s3,s3_client
+from app.services.pdf_generator import generar_pdf_async, etiqueta_plantilla
+from app.services.metrics import etapas_render, medicion_render
+from app.services.server_timing import tiempos_peticion
+from app.services.perfilado import token_perfil
+from app.services.render_executor import RenderTimeoutError
+from app.services.pdf_streaming import PresupuestoMemoriaExcedidoError
+from app.services.admission import control_admision, peso_factura, AdmisionRechazadaError
+from app.services.bucket_cache import cache_buckets
+from app.services.upload_outbox import outbox_uploads
+from app.services.render_cache import cache_render
 from app.services.auth import get_current_user
 from app.services.pdf_parser import pdf_to_json_rut
 
+import asyncio
+import json
 import os
+import time
 
 router = APIRouter()
 
+# Tamaño de cada trozo al devolver el PDF en modo de entrega "directo"
+_CHUNK_PDF = 64 * 1024
+
+
+def _trozos_pdf(pdf_bytes: bytes):
+    vista = memoryview(pdf_bytes)
+    for inicio in range(0, len(vista), _CHUNK_PDF):
+        yield vista[inicio:inicio + _CHUNK_PDF]
+
+
+async def _ya_en_s3(result):
+    """Un PDF servido desde la cache de render puede estar ya subido en la misma key."""
+    return bool(result.get("desde_cache")) and await cache_render.ya_subido(
+        result["bucket"], result["key"], result["pdf_bytes"]
+    )
+
+
+def _respuesta_pdf_directa(result):
+    """Devuelve el PDF como application/pdf sin pasar por S3."""
+    pdf_bytes = result["pdf_bytes"]
+    return StreamingResponse(
+        _trozos_pdf(pdf_bytes),
+        media_type="application/pdf",
+        headers={
+            "Content-Length": str(len(pdf_bytes)),
+            "Content-Disposition": f'inline; filename="{result["filename"]}"',
+        },
+    )
+
+
+def _con_perfil(respuesta, result):
+    """Si el render se perfiló, indica en X-Profile el nombre base de los archivos en PROFILE_DIR."""
+    if result.get("perfil"):
+        respuesta.headers["X-Profile"] = result["perfil"]
+    return respuesta
+
+
+def _desglose_render(factura, result, tiempos):
+    metricas = result.get("metricas") or {}
+    return {
+        "plantilla": metricas.get("plantilla"),
+        "paginas": metricas.get("paginas"),
+        "filas": len(factura.get("detalles") or []),
+        "bytes": len(result["pdf_bytes"]),
+        "desde_cache": bool(result.get("desde_cache")),
+        "etapas_ms": tiempos.milisegundos(),
+    }
+
 
 @router.post("/generar_pdf/", status_code=200)
 async def generar_pdf_endpoint(
     request: FacturaRequest,
-    background_tasks: BackgroundTasks,
+    http_request: Request,
+    entrega: Optional[Literal["s3", "directo"]] = Query(
+        None, description='"directo" devuelve el PDF en la respuesta sin subirlo a S3'
+    ),
+    debug: bool = Query(False, description="Agrega al JSON el desglose de tiempos, páginas, filas y bytes"),
     user: dict = Depends(get_current_user),
 ):
     """
-    Genera un PDF de la factura, lo envía YA al cliente en un JSON con la URL
-    y sube el PDF a S3 en background.
+    Genera un PDF de la factura, lo deja en el outbox de subidas (disco + SQLite)
+    y responde YA con la URL; los workers del outbox lo suben a S3 con reintentos.
+
+    Con entrega "directo" (query o caracteristicas.entrega) responde el PDF
+    como application/pdf, sin validar bucket ni subir a S3.
+
+    Toda respuesta lleva Server-Timing con la duración de cada etapa; con
+    debug=true la respuesta JSON incluye además el desglose (con entrega
+    "directo" el cuerpo es el PDF y el desglose queda solo en el header).
+
+    Con el header X-Profile-Token (o ?perfil=) igual a PROFILE_TOKEN el render
+    se perfila y X-Profile trae el nombre de los archivos en PROFILE_DIR.
     """
+    tiempos = tiempos_peticion(http_request)
     try:
-        # 1) Genera el PDF (bytes + metadatos S3)
-        result = generar_pdf(request.dict())
-        bucket = result["bucket"]
+        perfilar = token_perfil(http_request)
+    except PermissionError as pe:
+        return JSONResponse(status_code=403, content={"code": 403, "error": str(pe)})
+    try:
+        # 1) Genera el PDF (bytes + metadatos S3) en el pool de render,
+        #    si el control de admisión deja pasar la petición
+        factura = request.dict()
+        # Lectura del cuerpo + parseo + validación pydantic, desde que entró al middleware
+        etapas_render.observe(
+            tiempos.marcar("validacion"), plantilla=etiqueta_plantilla(factura), etapa="validacion"
+        )
         try:
-            s3_client.head_bucket(Bucket=bucket)
-        except ClientError as err:
-            msg = err.response.get("Error",{}).get("Message", str(err))
+            async with control_admision.admitir(peso_factura(factura)):
+                result = await generar_pdf_async(factura, perfilar=perfilar)
+        finally:
+            # Incluye la espera en el pool y el ida y vuelta al worker (también si falla)
+            tiempos.marcar("render")
+        tiempos.agregar_render(result)
+
+        if (entrega or request.caracteristicas.entrega) == "directo":
+            return _con_perfil(_respuesta_pdf_directa(result), result)
+
+        bucket = result["bucket"]
+        msg = await cache_buckets.validar(bucket)
+        tiempos.marcar("head_bucket")
+        if msg:
             return JSONResponse(
                 status_code=400,
                 content={"code":400, "error": f"S3 bucket inválido o innaccesible: {msg}"}
@@ -39,25 +135,47 @@ async def generar_pdf_endpoint(
             
 
 
-        # 2) Programa la subida en background
-        background_tasks.add_task(
-            upload_pdf_to_s3,
-            result["pdf_bytes"],
-            result["bucket"],
-            result["key"],
-        )
+        # 2) Persiste la subida en el outbox (sobrevive a fallos de S3 y reinicios),
+        #    salvo que sea un PDF de la cache que ya está en S3
+        if not await _ya_en_s3(result):
+            await outbox_uploads.encolar(
+                result["pdf_bytes"],
+                result["bucket"],
+                result["key"],
+            )
+        tiempos.marcar("outbox")
 
         # 3) Construye la URL pública (sin esperar a la subida)
         region = os.getenv("S3_REGION")
         url = f"https://{result['bucket']}/{result['key']}"
 
         # 4) Responde con JSON y HTTP 200
-        return JSONResponse(
+        content = {"code": 200, "url": url}
+        if debug:
+            content["debug"] = _desglose_render(factura, result, tiempos)
+        return _con_perfil(JSONResponse(
             status_code=200,
-            content={"code": 200, "url": url}
-        )
+            content=content
+        ), result)
 
 
+    except AdmisionRechazadaError as ae:
+        return JSONResponse(
+            status_code=429,
+            content={"code": 429, "error": str(ae)},
+            headers={"Retry-After": str(ae.retry_after)},
+        )
+    except PresupuestoMemoriaExcedidoError as me:
+        return JSONResponse(
+            status_code=503,
+            content={"code": 503, "error": str(me)},
+            headers={"Retry-After": str(me.retry_after)},
+        )
+    except RenderTimeoutError as te:
+        return JSONResponse(
+            status_code=504,
+            content={"code": 504, "error": str(te)}
+        )
     except ValueError as ve:
         return JSONResponse(
             status_code=400,
@@ -69,17 +187,155 @@ async def generar_pdf_endpoint(
             content={"code":500, "error": f"Error interno al generar el pdf: {e}"}            
         )
 
+def _leer_lote(cuerpo: bytes, content_type: str):
+    """
+    Itera los documentos del lote como (indice, item). Acepta un arreglo JSON
+    o NDJSON (un FacturaRequest por línea; una línea inválida no invalida el lote).
+    """
+    if "ndjson" in content_type:
+        lineas = (linea for linea in cuerpo.split(b"\n") if linea.strip())
+        yield from enumerate(lineas)
+    else:
+        datos = json.loads(cuerpo)
+        if not isinstance(datos, list):
+            raise ValueError("El cuerpo debe ser un arreglo JSON de facturas o NDJSON")
+        yield from enumerate(datos)
+
+
+async def _renderizar_item(indice, factura):
+    """Renderiza un documento del lote y devuelve su línea de resultado."""
+    try:
+        # Cada documento pasa por el mismo control de admisión que /generar_pdf/
+        async with control_admision.admitir(peso_factura(factura)):
+            result = await generar_pdf_async(factura)
+        bucket = result["bucket"]
+        # La cache comparte un único head_bucket por bucket entre todo el lote
+        error_bucket = await cache_buckets.validar(bucket)
+        if error_bucket:
+            return {"index": indice, "code": 400, "error": f"S3 bucket inválido o innaccesible: {error_bucket}"}
+
+        if not await _ya_en_s3(result):
+            await outbox_uploads.encolar(result["pdf_bytes"], bucket, result["key"])
+
+        return {"index": indice, "code": 200, "url": f"https://{bucket}/{result['key']}", "key": result["key"]}
+    except AdmisionRechazadaError as ae:
+        return {"index": indice, "code": 429, "error": str(ae), "retry_after": ae.retry_after}
+    except PresupuestoMemoriaExcedidoError as me:
+        return {"index": indice, "code": 503, "error": str(me), "retry_after": me.retry_after}
+    except RenderTimeoutError as te:
+        return {"index": indice, "code": 504, "error": str(te)}
+    except ValueError as ve:
+        return {"index": indice, "code": 400, "error": str(ve)}
+    except Exception as e:
+        return {"index": indice, "code": 500, "error": f"Error interno al generar el pdf: {e}"}
+
+
+async def _procesar_lote(cuerpo: bytes, content_type: str):
+    """
+    Reparte los documentos en el pool de render (con un máximo de
+    BATCH_MAX_CONCURRENCY en vuelo) y emite una línea NDJSON por documento
+    a medida que cada uno termina.
+    """
+    resultados = asyncio.Queue()
+    semaforo = asyncio.Semaphore(Config.BATCH_MAX_CONCURRENCY)
+    tareas = []
+
+    async def renderizar(indice, factura):
+        try:
+            resultados.put_nowait(await _renderizar_item(indice, factura))
+        finally:
+            semaforo.release()
+
+    async def alimentar():
+        try:
+            for indice, item in _leer_lote(cuerpo, content_type):
+                if indice >= Config.BATCH_MAX_ITEMS:
+                    resultados.put_nowait({"index": indice, "code": 413, "error": f"El lote excede el máximo de {Config.BATCH_MAX_ITEMS} documentos"})
+                    continue
+                try:
+                    inicio = time.perf_counter()
+                    datos = json.loads(item) if isinstance(item, (bytes, str)) else item
+                    factura = FacturaRequest(**datos).dict()
+                    etapas_render.observe(
+                        time.perf_counter() - inicio, plantilla=etiqueta_plantilla(factura), etapa="validacion"
+                    )
+                except (ValueError, TypeError) as e:
+                    errores = e.errors(include_input=False) if isinstance(e, ValidationError) else str(e)
+                    resultados.put_nowait({"index": indice, "code": 422, "error": errores})
+                    continue
+                await semaforo.acquire()
+                tareas.append(asyncio.create_task(renderizar(indice, factura)))
+            await asyncio.gather(*tareas)
+        except ValueError as ve:
+            resultados.put_nowait({"index": None, "code": 400, "error": str(ve)})
+        finally:
+            resultados.put_nowait(None)
+
+    productor = asyncio.create_task(alimentar())
+    try:
+        while (linea := await resultados.get()) is not None:
+            yield json.dumps(linea, ensure_ascii=False, default=str) + "\n"
+    finally:
+        # Si el cliente corta la conexión no seguimos renderizando el resto del lote
+        productor.cancel()
+        for tarea in tareas:
+            tarea.cancel()
+
+
+@router.post("/generar_pdf/batch")
+async def generar_pdf_batch_endpoint(
+    http_request: Request,
+    user: dict = Depends(get_current_user),
+):
+    """
+    Genera muchas facturas en una sola petición (arreglo JSON o NDJSON).
+    La autenticación y la validación de buckets se hacen una vez por lote;
+    la respuesta es NDJSON con una línea {index, code, url|error} por documento
+    (code 429 con retry_after si el control de admisión rechaza ese documento).
+    """
+    # El cuerpo se lee antes de empezar a responder: LoggingMiddleware
+    # (BaseHTTPMiddleware) no permite leerlo una vez iniciado el streaming.
+    cuerpo = await http_request.body()
+    content_type = http_request.headers.get("content-type", "")
+    return StreamingResponse(_procesar_lote(cuerpo, content_type), media_type="application/x-ndjson")
+
+
+def _parsear_rut(pdf_url):
+    """pdf_to_json_rut midiendo descarga, extracción y parseo (corre en el thread-pool)."""
+    with medicion_render() as medicion:
+        datos = pdf_to_json_rut(pdf_url)
+    return datos, medicion
+
+
 @router.post("/parse_pdf/", response_model=dict)
 async def convertir_pdf_a_json(
     payload: PdfToJsonRequest,
+    http_request: Request,
+    debug: bool = Query(False, description="Agrega al JSON el desglose de tiempos, páginas, campos y bytes"),
     user: dict = Depends(get_current_user),
 ):
     """
     Recibe en el body una URL pública a un PDF (RUT), lo descarga, lo parsea
     y devuelve un JSON con los campos extraídos.
     """
+    tiempos = tiempos_peticion(http_request)
+    tiempos.marcar("validacion")
     try:
-        resultado = pdf_to_json_rut(payload.pdf_url)
+        # Descarga y parseo fuera del event loop, con el mismo control de admisión
+        try:
+            async with control_admision.admitir():
+                resultado, medicion = await run_in_threadpool(_parsear_rut, payload.pdf_url)
+        finally:
+            tiempos.marcar("parse")
+        for etapa, segundos in medicion.etapas.items():
+            tiempos.agregar(f"parse.{etapa}", segundos)
+        if debug and resultado:
+            resultado["debug"] = {
+                "paginas": medicion.datos.get("paginas"),
+                "campos": len(resultado),
+                "bytes": medicion.datos.get("bytes"),
+                "etapas_ms": tiempos.milisegundos(),
+            }
         if not resultado:
             # Si no se extrajo ningún campo, devolvemos 422
             raise HTTPException(
@@ -88,6 +344,12 @@ async def convertir_pdf_a_json(
             )
         return resultado
 
+    except AdmisionRechazadaError as ae:
+        raise HTTPException(
+            status_code=429,
+            detail=str(ae),
+            headers={"Retry-After": str(ae.retry_after)},
+        )
     except HTTPException:
         # Propagamos errores HTTP específicos
         raise
@@ -0,0 +1,92 @@
+# app/services/admission.py
+
+import math
+import time
+from contextlib import asynccontextmanager
+
+from app.config import Config
+
+
+class AdmisionRechazadaError(Exception):
+    """El servicio está saturado; el cliente debe reintentar pasados `retry_after` segundos."""
+
+    def __init__(self, retry_after):
+        super().__init__("Servicio saturado, reintente más tarde")
+        self.retry_after = retry_after
+
+
+def peso_factura(factura):
+    """
+    Trabajo estimado de un render: una unidad por documento más una por cada
+    línea (detalles de factura o conceptos de nómina).
+    """
+    return 1 + sum(
+        len(factura.get(campo) or [])
+        for campo in ("detalles", "devengos", "deducciones", "aportes_empleador", "prestaciones_sociales")
+    )
+
+
+class ControlAdmision:
+    """
+    Control de admisión para los endpoints de render. Lleva la cuenta de
+    peticiones en vuelo y del trabajo pendiente (suma de pesos); si se supera
+    alguno de los límites rechaza al instante con el tiempo estimado de espera,
+    en lugar de encolar y degradar la latencia de todos.
+    """
+
+    def __init__(self, max_en_vuelo, max_trabajo, workers):
+        self.max_en_vuelo = max_en_vuelo
+        self.max_trabajo = max_trabajo
+        self.workers = max(1, workers)
+        self.en_vuelo = 0
+        self.trabajo = 0
+        self.admitidas = 0
+        self.rechazadas = 0
+        self._seg_por_unidad = 0.05  # EWMA del tiempo de render por unidad de trabajo
+
+    def retry_after(self):
+        return max(1, math.ceil(self.trabajo * self._seg_por_unidad / self.workers))
+
+    def _saturado(self, peso):
+        if self.max_en_vuelo and self.en_vuelo >= self.max_en_vuelo:
+            return True
+        # Un documento grande se admite siempre que no haya nada más en curso
+        return bool(self.max_trabajo) and self.en_vuelo > 0 and self.trabajo + peso > self.max_trabajo
+
+    @asynccontextmanager
+    async def admitir(self, peso=1):
+        """Reserva capacidad para `peso` unidades o lanza AdmisionRechazadaError."""
+        if self._saturado(peso):
+            self.rechazadas += 1
+            raise AdmisionRechazadaError(self.retry_after())
+
+        self.admitidas += 1
+        self.en_vuelo += 1
+        self.trabajo += peso
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            self.en_vuelo -= 1
+            self.trabajo -= peso
+            duracion = time.monotonic() - inicio
+            self._seg_por_unidad = 0.8 * self._seg_por_unidad + 0.2 * (duracion / peso)
+
+    def estado(self):
+        return {
+            "en_vuelo": self.en_vuelo,
+            "max_en_vuelo": self.max_en_vuelo,
+            "trabajo_pendiente": self.trabajo,
+            "max_trabajo_pendiente": self.max_trabajo,
+            "segundos_por_unidad": round(self._seg_por_unidad, 4),
+            "retry_after_estimado": self.retry_after(),
+            "admitidas": self.admitidas,
+            "rechazadas": self.rechazadas,
+        }
+
+
+control_admision = ControlAdmision(
+    max_en_vuelo=Config.ADMISSION_MAX_IN_FLIGHT,
+    max_trabajo=Config.ADMISSION_MAX_QUEUED_WORK,
+    workers=Config.RENDER_WORKERS,
+)
@@ -0,0 +1,136 @@
+# app/services/bucket_cache.py
+
+import asyncio
+import logging
+import time
+
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import BotoCoreError, ClientError
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+from app.services import metrics
+from app.services.storage import upload_pdf_to_s3, get_s3_client
+
+logger = logging.getLogger("fastapi_app")
+
+# Errores de subida que indican que la validación cacheada del bucket ya no sirve
+_CODIGOS_INVALIDAN = {"NoSuchBucket", "AccessDenied", "AllAccessDisabled", "InvalidBucketName"}
+
+
+def _mensaje_error(err):
+    return err.response.get("Error", {}).get("Message", str(err))
+
+
+def _codigo_error(err):
+    """Código de S3 del error; upload_fileobj envuelve el ClientError en S3UploadFailedError."""
+    actual = err
+    while actual is not None:
+        if isinstance(actual, ClientError):
+            return actual.response.get("Error", {}).get("Code")
+        actual = actual.__cause__ or actual.__context__
+    texto = str(err)
+    return next((codigo for codigo in _CODIGOS_INVALIDAN if f"({codigo})" in texto), None)
+
+
+class CacheBuckets:
+    """
+    Cache con TTL del resultado de head_bucket por bucket.
+
+    - Entrada válida (positiva o negativa) dentro de su TTL: se responde sin ir a S3.
+    - Entrada positiva vencida: se sigue aceptando y se refresca en segundo plano.
+    - Sin entrada o negativa vencida: se consulta a S3 (una sola consulta
+      compartida entre todas las peticiones concurrentes del mismo bucket).
+    """
+
+    def __init__(self, ttl_valido, ttl_invalido):
+        self.ttl_valido = ttl_valido
+        self.ttl_invalido = ttl_invalido
+        self._entradas = {}  # bucket -> (mensaje de error o None, expira)
+        self._consultas = {}  # bucket -> tarea de head_bucket en curso
+        self.aciertos = 0
+        self.fallos = 0
+
+    async def validar(self, bucket):
+        """Devuelve None si el bucket es accesible, o el mensaje de error de S3."""
+        entrada = self._entradas.get(bucket)
+        if entrada is not None:
+            error, expira = entrada
+            if time.monotonic() < expira:
+                self.aciertos += 1
+                return error
+            if error is None:
+                self.aciertos += 1
+                self._consultar(bucket)
+                return None
+        self.fallos += 1
+        return await asyncio.shield(self._consultar(bucket))
+
+    def invalidar(self, bucket):
+        self._entradas.pop(bucket, None)
+
+    def registrar_error_subida(self, bucket, err):
+        if _codigo_error(err) in _CODIGOS_INVALIDAN:
+            logger.warning(f"🪣 Bucket {bucket} invalidado en cache tras error de subida: {err}")
+            self.invalidar(bucket)
+
+    def _consultar(self, bucket):
+        tarea = self._consultas.get(bucket)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._head_bucket(bucket))
+            self._consultas[bucket] = tarea
+            tarea.add_done_callback(lambda t: self._fin_consulta(bucket, t))
+        return tarea
+
+    def _fin_consulta(self, bucket, tarea):
+        self._consultas.pop(bucket, None)
+        # Los refrescos en segundo plano nadie los espera: se registra el fallo aquí
+        if not tarea.cancelled() and tarea.exception() is not None:
+            logger.error(f"⚠️ No se pudo validar el bucket {bucket}: {tarea.exception()}")
+
+    async def _head_bucket(self, bucket):
+        inicio = time.perf_counter()
+        try:
+            await run_in_threadpool(get_s3_client().head_bucket, Bucket=bucket)
+            error, ttl = None, self.ttl_valido
+        except ClientError as err:
+            error, ttl = _mensaje_error(err), self.ttl_invalido
+        except BotoCoreError as err:
+            # Sin respuesta de S3 (conexión, credenciales, timeout): negativo con el TTL
+            # corto, en vez de un 500 en cada render mientras dure el problema
+            logger.warning(f"⚠️ head_bucket de {bucket} sin respuesta de S3: {err}")
+            error, ttl = str(err), self.ttl_invalido
+        metrics.head_bucket_s3.observe(time.perf_counter() - inicio, resultado="ok" if error is None else "error")
+        self._entradas[bucket] = (error, time.monotonic() + ttl)
+        return error
+
+    def estado(self):
+        ahora = time.monotonic()
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "buckets": {
+                bucket: {"valido": error is None, "error": error, "expira_en": round(expira - ahora, 1)}
+                for bucket, (error, expira) in self._entradas.items()
+            },
+        }
+
+
+cache_buckets = CacheBuckets(
+    ttl_valido=Config.S3_BUCKET_CACHE_TTL,
+    ttl_invalido=Config.S3_BUCKET_CACHE_NEGATIVE_TTL,
+)
+
+
+async def subir_pdf(pdf_bytes: bytes, bucket: str, key: str):
+    """upload_pdf_to_s3 que invalida el bucket en cache si S3 lo rechaza."""
+    inicio = time.perf_counter()
+    try:
+        await upload_pdf_to_s3(pdf_bytes, bucket, key)
+    except Exception as err:
+        metrics.subidas_s3.observe(time.perf_counter() - inicio, origen="jobs", resultado="error")
+        metrics.fallos_subida_s3.inc(origen="jobs")
+        if isinstance(err, (ClientError, S3UploadFailedError)):
+            cache_buckets.registrar_error_subida(bucket, err)
+        raise
+    metrics.subidas_s3.observe(time.perf_counter() - inicio, origen="jobs", resultado="ok")
@@ -0,0 +1,218 @@
+# app/services/encabezado_cache.py
+#
+# Parte fija del encabezado de cada emisor (razón social, logo e info fija).
+# Sus medidas se cachean por proceso y por emisor; su contenido se dibuja
+# como form XObject (usar_form): una vez por documento, y las páginas
+# siguientes solo lo referencian. Cada página arma únicamente las celdas
+# variables: QR y título / número del documento.
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from reportlab.platypus import Flowable, Table
+from reportlab.platypus.tables import LINECOMMANDS
+
+from app.config import Config
+from app.services.pdf_forms import usar_form
+from app.services.pdf_styles import estilo_tabla
+
+MB = 1024 * 1024
+
+CAMPOS_EMISOR = ("razon_social", "documento", "actividad_economica", "regimen", "responsable_iva", "tarifa_ica")
+
+# Comandos de tabla que dibujan líneas o fondos: los dibuja la tabla de celdas
+# variables, el form de las fijas solo lleva su contenido
+_COMANDOS_DE_TABLA = set(LINECOMMANDS) | {"BACKGROUND", "ROWBACKGROUNDS", "COLBACKGROUNDS"}
+
+# Margen del BBox de los forms alrededor del bloque (puntos)
+_HOLGURA = 50
+
+# Tamaño contable de una entrada (solo medidas)
+_TAMANO_MEDIDA = 64
+
+
+def clave_emisor(factura, *extra):
+    """
+    Hash de todo lo que define el encabezado fijo: campos del emisor, logo y
+    lo que agregue la plantilla (su nombre, colores). None si no se debe
+    cachear: cache desactivada o logo por URL (su contenido puede cambiar).
+    """
+    emisor = factura.get("emisor", {})
+    logo = emisor.get("logo") or ""
+    if not Config.HEADER_CACHE_MB or logo.startswith("http"):
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr([emisor.get(campo) for campo in CAMPOS_EMISOR] + list(extra)).encode())
+    h.update(logo.encode("ascii", "ignore"))
+    return h.hexdigest()
+
+
+def _nombre_form(clave):
+    """Nombre del form XObject de un bloque fijo: estable por clave dentro de cada documento."""
+    return "encabezado_" + hashlib.blake2b(repr(clave).encode(), digest_size=12).hexdigest()
+
+
+def _caja(ancho, alto):
+    # El form recorta a su BBox: holgura para los trazos que salen del bloque
+    return (-_HOLGURA, -_HOLGURA, ancho + _HOLGURA, alto + _HOLGURA)
+
+
+class CacheEncabezados:
+    """
+    Cache de proceso de medidas de encabezados por clave, con
+    expulsión LRU por tamaño en bytes. Si dos renders piden la misma clave a
+    la vez ambos la calculan y se guarda la primera, como en CacheImagenes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (valor, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, clave, calcular):
+        """Valor guardado para `clave`; si no está, calcular() -> (valor, bytes) y se guarda."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[0]
+            self.fallos += 1
+        entrada = calcular()
+        self._guardar(clave, entrada)
+        return entrada[0]
+
+    def _guardar(self, clave, entrada):
+        tamano = entrada[1]
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                return
+            self._entradas[clave] = entrada
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, tam_viejo) = self._entradas.popitem(last=False)
+                self._bytes -= tam_viejo
+                self.expulsiones += 1
+
+    def estado(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+            }
+
+
+cache_encabezados = CacheEncabezados(max_bytes=Config.HEADER_CACHE_MB * MB)
+
+
+class BloqueEmisor(Flowable):
+    """
+    Flowable fijo por emisor (p. ej. la tabla de razón social): su medida se
+    calcula una vez por clave y ancho disponible; su contenido se dibuja como
+    form XObject, construido una sola vez por documento.
+    """
+
+    def __init__(self, clave, construir):
+        super().__init__()
+        self.clave = clave
+        self.construir = construir
+
+    def wrap(self, availWidth, availHeight):
+        def medir():
+            flowable = self.construir()
+            ancho, alto = flowable.wrap(availWidth, availHeight)
+            return (ancho, alto, flowable.hAlign), _TAMANO_MEDIDA
+
+        clave = (self.clave, "bloque", availWidth)
+        self.width, self.height, self.hAlign = cache_encabezados.obtener(clave, medir)
+        self._availWidth = availWidth
+        self._form = _nombre_form(clave)
+        return self.width, self.height
+
+    def draw(self):
+        def dibujar(lienzo):
+            flowable = self.construir()
+            flowable.wrapOn(lienzo, self._availWidth, self.height)
+            flowable.drawOn(lienzo, 0, 0)
+
+        usar_form(self.canv, self._form, dibujar, caja=_caja(self.width, self.height))
+
+
+class FilaConCeldasFijas(Flowable):
+    """
+    Tabla de una fila en la que las celdas de `construir_fijas()` ({índice:
+    contenido}) dependen solo del emisor. La fila mide lo que mida la más
+    alta de las dos mitades: la tabla de celdas fijas (medida una vez por
+    clave) y la de celdas variables. La tabla de cada documento lleva las
+    variables y las líneas, con ese alto; las fijas se dibujan encima como
+    form XObject con el mismo alto, así la geometría es la de la tabla completa.
+    """
+
+    def __init__(self, clave, celdas, construir_fijas, colWidths, estilo):
+        super().__init__()
+        self.clave = clave
+        self.celdas = celdas  # None en las posiciones de las celdas fijas
+        self.construir_fijas = construir_fijas
+        self.colWidths = list(colWidths)
+        self.estilo = estilo
+
+    def _tabla(self, fila, estilo, alto_fila=None):
+        tabla = Table([fila], colWidths=self.colWidths, rowHeights=[alto_fila] if alto_fila else None)
+        tabla.setStyle(estilo_tabla(estilo))
+        return tabla
+
+    def _tabla_fijas(self, alto_fila=None):
+        fijas = self.construir_fijas()
+        fila = [fijas.get(i, []) for i in range(len(self.celdas))]
+        return self._tabla(fila, [c for c in self.estilo if c[0] not in _COMANDOS_DE_TABLA], alto_fila)
+
+    def wrap(self, availWidth, availHeight):
+        clave = (self.clave, "fijas", tuple(self.colWidths), repr(self.estilo))
+        alto_fijas = cache_encabezados.obtener(
+            clave, lambda: (self._tabla_fijas().wrap(availWidth, availHeight)[1], _TAMANO_MEDIDA)
+        )
+
+        variables = [[] if celda is None else celda for celda in self.celdas]
+        alto_variables = self._tabla(variables, self.estilo).wrap(availWidth, availHeight)[1]
+        self._alto_fila = max(alto_fijas, alto_variables)
+        self._tabla_variables = self._tabla(variables, self.estilo, self._alto_fila)
+        self.hAlign = self._tabla_variables.hAlign
+        self.width, self.height = self._tabla_variables.wrap(availWidth, availHeight)
+        self._form = _nombre_form(clave + (self._alto_fila,))
+        return self.width, self.height
+
+    def draw(self):
+        self._tabla_variables.drawOn(self.canv, 0, 0)
+
+        def dibujar(lienzo):
+            tabla = self._tabla_fijas(self._alto_fila)
+            tabla.wrapOn(lienzo, self.width, self.height)
+            tabla.drawOn(lienzo, 0, 0)
+
+        usar_form(self.canv, self._form, dibujar, caja=_caja(self.width, self.height))
+
+
+def bloque_emisor(clave, construir):
+    """BloqueEmisor cacheado, o el flowable de construir() tal cual si la clave es None."""
+    return BloqueEmisor(clave, construir) if clave else construir()
+
+
+def fila_encabezado(clave, celdas, construir_fijas, colWidths, estilo):
+    """FilaConCeldasFijas, o la Table completa equivalente si la clave es None."""
+    if clave:
+        return FilaConCeldasFijas(clave, celdas, construir_fijas, colWidths, estilo)
+    fijas = construir_fijas()
+    tabla = Table([[fijas.get(i, celda) for i, celda in enumerate(celdas)]], colWidths=colWidths)
+    tabla.setStyle(estilo_tabla(estilo))
+    return tabla
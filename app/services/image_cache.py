@@ -0,0 +1,159 @@
+# app/services/image_cache.py
+
+import base64
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image as PILImage
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Image
+
+from app.config import Config
+
+MB = 1024 * 1024
+
+# Segmentos JPEG que solo llevan metadatos: APP1 (EXIF/XMP), APP13 (IPTC/Photoshop) y COM
+_JPEG_METADATOS = {0xE1, 0xED, 0xFE}
+
+
+class ImagenLogo(Image):
+    """Image de platypus que reutiliza un ImageReader ya decodificado en vez de parsear bytes."""
+
+    def __init__(self, lector, width=None, height=None, **kwargs):
+        self._img = lector
+        super().__init__(BytesIO(), width=width, height=height, **kwargs)
+
+
+def jpeg_sin_metadatos(datos):
+    """Copia del JPEG sin segmentos de metadatos; los datos DCT no se tocan ni se recodifican."""
+    salida = bytearray(datos[:2])
+    i = 2
+    while i + 4 <= len(datos) and datos[i] == 0xFF:
+        marcador = datos[i + 1]
+        if marcador == 0xFF:  # bytes de relleno entre segmentos
+            i += 1
+            continue
+        if marcador == 0xDA:  # SOS: desde aquí son los datos comprimidos
+            return bytes(salida + datos[i:])
+        fin = i + 2 + int.from_bytes(datos[i + 2:i + 4], "big")
+        if marcador not in _JPEG_METADATOS:
+            salida += datos[i:fin]
+        i = fin
+    return datos  # estructura inesperada: se deja como vino
+
+
+def reducir_a_caja(imagen, caja, dpi):
+    """
+    Imagen PIL reducida a la resolución con la que se dibuja en `caja` (ancho,
+    alto en puntos) a `dpi`, sin ampliar y sin metadatos. Cada eje se ajusta
+    por separado porque el logo se estira a la caja al dibujarlo.
+    """
+    imagen.load()
+    if imagen.mode not in ("RGB", "RGBA", "L", "LA", "CMYK"):
+        transparente = "transparency" in imagen.info or imagen.mode.endswith("A")
+        imagen = imagen.convert("RGBA" if transparente else "RGB")
+    if caja and dpi:
+        ancho = min(imagen.width, max(1, math.ceil(caja[0] / 72 * dpi)))
+        alto = min(imagen.height, max(1, math.ceil(caja[1] / 72 * dpi)))
+        if (ancho, alto) != imagen.size:
+            imagen = imagen.resize((ancho, alto), PILImage.LANCZOS)
+    imagen.info = {}
+    return imagen
+
+
+class CacheImagenes:
+    """
+    Cache de proceso de logos en base64 (emisor, afacturar), por hash del
+    texto y caja de destino. Guarda el ImageReader ya normalizado: los PNG y
+    demás formatos se reducen a la caja en que se dibujan a `dpi`, y los JPEG
+    pasan tal cual como DCT, solo sin metadatos. Los datos RGB/alfa quedan
+    calculados y se expulsa por tamaño en bytes (LRU). Los logos inválidos se
+    recuerdan también para no volver a decodificarlos.
+    """
+
+    def __init__(self, max_bytes, dpi):
+        self.max_bytes = max_bytes
+        self.dpi = dpi
+        self._entradas = OrderedDict()  # hash -> (ImageReader | mensaje de error, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def lector(self, logo_b64, caja=None):
+        """
+        ImageReader listo para drawImage/ImagenLogo en `caja` (ancho, alto en
+        puntos; None = resolución original); ValueError si el logo no es una
+        imagen válida.
+        """
+        clave = hashlib.blake2b(logo_b64.encode("ascii", "ignore"), digest_size=16).digest() + repr(caja).encode()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+            else:
+                self.fallos += 1
+        if entrada is None:
+            entrada = self._decodificar(logo_b64, caja)
+            self._guardar(clave, entrada)
+
+        resultado = entrada[0]
+        if isinstance(resultado, str):
+            raise ValueError(resultado)
+        return resultado
+
+    def _decodificar(self, logo_b64, caja):
+        try:
+            datos = base64.b64decode(logo_b64)
+            # Validar que sea una imagen válida, no un PDF u otro formato
+            if datos.startswith(b"%PDF"):
+                raise ValueError("el logo es un PDF, no una imagen válida")
+            imagen = PILImage.open(BytesIO(datos))
+            if imagen.format == "JPEG":
+                datos = jpeg_sin_metadatos(datos)
+                lector = ImageReader(BytesIO(datos))
+            else:
+                lector = ImageReader(reducir_a_caja(imagen, caja, self.dpi))
+            # Se decodifica aquí una sola vez: drawImage reutiliza estos datos en cada página
+            rgb = lector.getRGBData()
+            tamano = len(datos) + len(rgb)
+            if lector._dataA is not None:
+                tamano += len(lector._dataA.getRGBData())
+            return lector, tamano
+        except ValueError as e:
+            return str(e), 64
+        except Exception as e:
+            return f"logo inválido: {e}", 64
+
+    def _guardar(self, clave, entrada):
+        tamano = entrada[1]
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._entradas:
+                return
+            self._entradas[clave] = entrada
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, tam_viejo) = self._entradas.popitem(last=False)
+                self._bytes -= tam_viejo
+                self.expulsiones += 1
+
+    def estado(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones,
+            }
+
+
+cache_imagenes = CacheImagenes(max_bytes=Config.IMAGE_CACHE_MB * MB, dpi=Config.LOGO_DPI)
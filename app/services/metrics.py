@@ -0,0 +1,274 @@
+# app/services/metrics.py
+#
+# Métricas del servicio en formato de texto de Prometheus, sin dependencias:
+# contadores, medidores e histogramas con etiquetas, en un registro de
+# proceso que expone GET /metrics. Con varios procesos de uvicorn cada uno
+# tiene su propio registro (se agregan en Prometheus por instancia).
+#
+# También define la medición por etapas de un render (MedicionRender): corre
+# dentro del worker de render y viaja de vuelta en result["metricas"], donde
+# el proceso principal la vuelca a los histogramas.
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_PAGINAS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+BUCKETS_BYTES = tuple(kb * 1024 for kb in (16, 32, 64, 128, 256, 512, 1024, 2048, 5120, 10240, 51200))
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}  # valores de etiquetas (tupla) -> valor
+        self._lock = threading.Lock()
+
+    def _clave(self, etiquetas):
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"{self.nombre}: etiquetas {sorted(etiquetas)}, se esperaban {list(self.etiquetas)}")
+        return tuple(str(etiquetas[e]) for e in self.etiquetas)
+
+    def _etiquetas_texto(self, clave, extra=()):
+        pares = list(zip(self.etiquetas, clave)) + list(extra)
+        if not pares:
+            return ""
+        return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+    def _lineas(self):
+        raise NotImplementedError
+
+    def texto(self):
+        with self._lock:
+            lineas = self._lineas()
+        return "\n".join([f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"] + lineas)
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def fijar(self, valor, **etiquetas):
+        """Copia un total que ya lleva otro componente (p. ej. ControlAdmision.rechazadas)."""
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    def _lineas(self):
+        return [f"{self.nombre}{self._etiquetas_texto(k)} {_numero(v)}" for k, v in sorted(self._valores.items())]
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def set(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = valor
+
+    def _lineas(self):
+        return [f"{self.nombre}{self._etiquetas_texto(k)} {_numero(v)}" for k, v in sorted(self._valores.items())]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self._lock:
+            serie = self._valores.get(clave)
+            if serie is None:
+                serie = self._valores[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def _lineas(self):
+        lineas = []
+        for clave, (conteos, suma, total) in sorted(self._valores.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = self._etiquetas_texto(clave, [("le", _numero(float(limite)))])
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{self._etiquetas_texto(clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{self._etiquetas_texto(clave)} {total}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+
+    def _agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Medidor(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def texto(self):
+        return "\n".join(m.texto() for m in self._metricas) + "\n"
+
+
+registro = Registro()
+
+# --- HTTP ---
+peticiones_http = registro.histograma(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP por ruta y status",
+    ("method", "route", "status"),
+)
+
+# --- Render ---
+etapas_render = registro.histograma(
+    "pdf_render_stage_seconds",
+    "Tiempo por etapa del render (validacion, construccion, build, serializacion) por plantilla",
+    ("plantilla", "etapa"),
+)
+cpu_render = registro.contador(
+    "pdf_render_cpu_seconds_total", "CPU consumida por los renders, por plantilla", ("plantilla",)
+)
+renders = registro.contador(
+    "pdf_renders_total", "Renders por plantilla y resultado (ok, cache, timeout, error)", ("plantilla", "resultado")
+)
+paginas_pdf = registro.histograma("pdf_pages", "Páginas por documento", ("plantilla",), BUCKETS_PAGINAS)
+bytes_pdf = registro.histograma("pdf_size_bytes", "Tamaño del PDF generado en bytes", ("plantilla",), BUCKETS_BYTES)
+
+# --- S3 ---
+subidas_s3 = registro.histograma(
+    "s3_upload_duration_seconds", "Latencia de subidas a S3 por origen y resultado", ("origen", "resultado")
+)
+fallos_subida_s3 = registro.contador("s3_upload_failures_total", "Subidas a S3 fallidas por origen", ("origen",))
+head_bucket_s3 = registro.histograma(
+    "s3_head_bucket_duration_seconds", "Latencia de head_bucket al validar buckets", ("resultado",)
+)
+
+# --- Saturación y colas (se actualizan al leer /metrics) ---
+pool_render_workers = registro.medidor("render_pool_workers", "Workers del pool de render", ("modo",))
+pool_render_en_curso = registro.medidor(
+    "render_pool_in_flight", "Renders enviados al pool y no terminados (los que superan los workers esperan)", ("modo",)
+)
+threadpool_en_uso = registro.medidor("threadpool_tokens_in_use", "Hilos del thread-pool de anyio en uso")
+threadpool_total = registro.medidor("threadpool_tokens_total", "Tamaño del thread-pool de anyio")
+admision_en_vuelo = registro.medidor("admission_in_flight", "Peticiones de render admitidas en curso")
+admision_trabajo = registro.medidor("admission_queued_work", "Trabajo pendiente admitido (documentos + líneas)")
+admision_rechazadas = registro.contador("admission_rejected_total", "Peticiones rechazadas con 429 por saturación")
+jobs_en_cola = registro.medidor("render_jobs_queued", "Jobs asíncronos esperando consumidor")
+outbox_documentos = registro.medidor("outbox_uploads", "Subidas del outbox por estado", ("estado",))
+outbox_bytes = registro.medidor("outbox_bytes", "Bytes en el outbox por estado", ("estado",))
+outbox_antiguedad = registro.medidor(
+    "outbox_oldest_age_seconds", "Antigüedad de la subida más vieja del outbox por estado", ("estado",)
+)
+
+
+# --- Medición por etapas de un render ---
+
+_medicion = contextvars.ContextVar("medicion_render", default=None)
+
+
+class MedicionRender:
+    """
+    Tiempos por etapa de un render y datos sueltos (páginas). Los tiempos son
+    exclusivos: mientras corre una etapa anidada no avanza la que la contiene.
+    """
+
+    def __init__(self):
+        self.etapas = {}
+        self.datos = {}
+        self._pila = []  # [[nombre, inicio del tramo actual]]
+
+    def _sumar(self, nombre, segundos):
+        self.etapas[nombre] = self.etapas.get(nombre, 0.0) + segundos
+
+    @contextmanager
+    def etapa(self, nombre):
+        ahora = time.perf_counter()
+        if self._pila:
+            self._sumar(self._pila[-1][0], ahora - self._pila[-1][1])
+        self._pila.append([nombre, ahora])
+        try:
+            yield
+        finally:
+            ahora = time.perf_counter()
+            actual, inicio = self._pila.pop()
+            self._sumar(actual, ahora - inicio)
+            if self._pila:
+                self._pila[-1][1] = ahora
+
+
+@contextmanager
+def medicion_render():
+    """Activa una MedicionRender para el código que corre dentro (en el mismo hilo/proceso)."""
+    medicion = MedicionRender()
+    token = _medicion.set(medicion)
+    try:
+        yield medicion
+    finally:
+        _medicion.reset(token)
+
+
+@contextmanager
+def medir_etapa(nombre):
+    """Suma el tiempo del bloque a la etapa `nombre` del render en curso; sin medición activa no hace nada."""
+    medicion = _medicion.get()
+    if medicion is None:
+        yield
+        return
+    with medicion.etapa(nombre):
+        yield
+
+
+def anotar(**datos):
+    """Guarda datos del render en curso (p. ej. paginas=12)."""
+    medicion = _medicion.get()
+    if medicion is not None:
+        medicion.datos.update(datos)
+
+
+def registrar_render(plantilla, result):
+    """Vuelca a los histogramas lo medido en el worker (result["metricas"])."""
+    metricas = result.get("metricas") or {}
+    for etapa, segundos in metricas.get("etapas", {}).items():
+        etapas_render.observe(segundos, plantilla=plantilla, etapa=etapa)
+    cpu_render.inc(metricas.get("cpu_segundos", 0.0), plantilla=plantilla)
+    if "paginas" in metricas:
+        paginas_pdf.observe(metricas["paginas"], plantilla=plantilla)
+    bytes_pdf.observe(len(result["pdf_bytes"]), plantilla=plantilla)
+    renders.inc(plantilla=plantilla, resultado="ok")
@@ -0,0 +1,266 @@
+# app/services/pdf_compresion.py
+#
+# Ajustes de tamaño sobre el PDF ya generado por ReportLab, en una sola
+# pasada: nivel de compresión de los streams, ASCII85 opcional y object
+# streams con xref comprimida (PDF 1.5). La deduplicación de recursos ya la
+# hace ReportLab dentro de cada documento (imágenes por digest, fuentes por
+# nombre, contenido fijo como form XObject), así que aquí no se repite.
+
+import base64
+import logging
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+
+from reportlab import rl_config
+
+from app.config import Config
+
+logger = logging.getLogger("fastapi_app")
+
+NIVEL_REPORTLAB = 6  # zlib.compress() sin nivel explícito, como comprime ReportLab
+MAX_OBJETOS_POR_STREAM = 200
+
+_RE_FILTRO = re.compile(rb"/Filter (?:\[ ?((?:/\w+ ?)*)\]|(/\w+))")
+_RE_LARGO = re.compile(rb"/Length (\d+)")
+
+
+_lock_a85 = threading.Lock()
+_renders_binarios = 0
+_use_a85_previo = None
+
+
+@contextmanager
+def streams_binarios():
+    """
+    ReportLab emite los streams en binario mientras dura el render; el
+    ASCII85, si se pide, lo agrega compactar_pdf. ReportLab no tiene una
+    opción por canvas (lee rl_config.useA85 al crear páginas, forms e
+    imágenes), así que se ajusta solo mientras haya renders en curso en el
+    proceso y se restaura al terminar el último.
+    """
+    global _renders_binarios, _use_a85_previo
+    with _lock_a85:
+        if _renders_binarios == 0:
+            _use_a85_previo = rl_config.useA85
+            rl_config.useA85 = 0
+        _renders_binarios += 1
+    try:
+        yield
+    finally:
+        with _lock_a85:
+            _renders_binarios -= 1
+            if _renders_binarios == 0:
+                rl_config.useA85 = _use_a85_previo
+
+
+def opciones_compresion(factura):
+    """Opciones del despliegue (Config) con lo que pida la factura en caracteristicas.compresion."""
+    opciones = {
+        "nivel": Config.PDF_COMPRESSION_LEVEL,
+        "ascii85": Config.PDF_ASCII85,
+        "flujos_objetos": Config.PDF_OBJECT_STREAMS,
+    }
+    pedidas = factura.get("caracteristicas", {}).get("compresion") or {}
+    opciones.update({k: v for k, v in pedidas.items() if k in opciones and v is not None})
+    return opciones
+
+
+def compactar_pdf(pdf_bytes, nivel=NIVEL_REPORTLAB, ascii85=False, flujos_objetos=True):
+    """
+    Reescribe un PDF de ReportLab según las opciones. Si el archivo no tiene
+    la estructura esperada (p. ej. cifrado) se devuelve sin cambios.
+    """
+    if nivel == NIVEL_REPORTLAB and not ascii85 and not flujos_objetos:
+        return pdf_bytes
+    try:
+        encabezado, objetos, trailer = _leer_pdf(pdf_bytes)
+    except ValueError as e:
+        logger.warning(f"⚠️ PDF sin compactar: {e}")
+        return pdf_bytes
+
+    for num, (dic, datos) in objetos.items():
+        if datos is not None:
+            objetos[num] = _recodificar(dic, datos, nivel, ascii85)
+
+    if flujos_objetos:
+        return _escribir_con_object_streams(encabezado, objetos, trailer, nivel, ascii85)
+    return _escribir_clasico(encabezado, objetos, trailer)
+
+
+def _leer_pdf(pdf_bytes):
+    """Objetos de un PDF de ReportLab: {número: (diccionario, datos del stream o None)}."""
+    m = re.search(rb"startxref\s+(\d+)\s+%%EOF\s*$", pdf_bytes)
+    if not m:
+        raise ValueError("no se encontró startxref")
+    inicio_xref = int(m.group(1))
+    fin_xref = pdf_bytes.find(b"trailer", inicio_xref)
+    if not pdf_bytes.startswith(b"xref", inicio_xref) or fin_xref < 0:
+        raise ValueError("tabla xref inesperada")
+    trailer = pdf_bytes[fin_xref:m.start()]
+    if b"/Encrypt" in trailer:
+        raise ValueError("PDF cifrado")
+
+    entradas = re.findall(rb"(\d{10}) (\d{5}) ([nf])", pdf_bytes[inicio_xref:fin_xref])
+    offsets = sorted((int(off), num) for num, (off, gen, tipo) in enumerate(entradas) if tipo == b"n")
+    if any(gen != b"00000" for _, gen, tipo in entradas if tipo == b"n"):
+        raise ValueError("objetos con generación distinta de 0")
+
+    objetos = {}
+    for i, (offset, num) in enumerate(offsets):
+        fin = offsets[i + 1][0] if i + 1 < len(offsets) else inicio_xref
+        bloque = pdf_bytes[offset:fin]
+        prefijo = b"%d 0 obj\n" % num
+        if not bloque.startswith(prefijo) or b"endobj" not in bloque:
+            raise ValueError(f"objeto {num} inesperado")
+        cuerpo = bloque[len(prefijo):bloque.rindex(b"endobj")]
+        objetos[num] = _separar_stream(num, cuerpo)
+
+    return pdf_bytes[:offsets[0][0]], objetos, _leer_trailer(trailer)
+
+
+def _separar_stream(num, cuerpo):
+    fin_dic = cuerpo.find(b">>\nstream\n")
+    if fin_dic < 0:
+        return cuerpo.rstrip(), None
+    dic = cuerpo[:fin_dic + 2]
+    largo = _RE_LARGO.search(dic)
+    inicio = fin_dic + len(b">>\nstream\n")
+    if not largo or cuerpo[inicio + int(largo.group(1)):].strip() != b"endstream":
+        raise ValueError(f"stream {num} con largo inesperado")
+    return dic, cuerpo[inicio:inicio + int(largo.group(1))]
+
+
+def _leer_trailer(trailer):
+    root = re.search(rb"/Root (\d+) 0 R", trailer)
+    info = re.search(rb"/Info (\d+) 0 R", trailer)
+    ident = re.search(rb"/ID\s*\[\s*(<[0-9a-fA-F]*>)\s*(<[0-9a-fA-F]*>)\s*\]", trailer)
+    if not root:
+        raise ValueError("trailer sin /Root")
+    return {
+        "Root": int(root.group(1)),
+        "Info": int(info.group(1)) if info else None,
+        "ID": b"[" + ident.group(1) + ident.group(2) + b"]" if ident else None,
+    }
+
+
+def _recodificar(dic, datos, nivel, ascii85):
+    """Quita/pone ASCII85 y recomprime con `nivel` los streams Flate; nivel 0 los deja sin comprimir."""
+    m = _RE_FILTRO.search(dic)
+    filtros = re.findall(rb"/(\w+)", m.group(0)[len(b"/Filter"):]) if m else []
+
+    if filtros[:1] == [b"ASCII85Decode"]:
+        datos = base64.a85decode(datos.strip(), adobe=True)
+        filtros.pop(0)
+    if nivel != NIVEL_REPORTLAB and filtros[:1] == [b"FlateDecode"] and b"/DecodeParms" not in dic:
+        datos = zlib.decompress(datos)
+        if nivel:
+            datos = zlib.compress(datos, nivel)
+        else:
+            filtros.pop(0)
+    if ascii85:
+        datos, filtros = _a85(datos), [b"ASCII85Decode"] + filtros
+
+    nuevo = _filtro_pdf(filtros)
+    if m:
+        dic = dic[:m.start()] + nuevo + dic[m.end():]
+    elif nuevo:
+        dic = dic[:-2].rstrip() + b" " + nuevo + b"\n>>"
+    dic = _RE_LARGO.sub(b"/Length %d" % len(datos), dic, count=1)
+    return dic, datos
+
+
+def _a85(datos):
+    return base64.a85encode(datos, wrapcol=76) + b"~>"
+
+
+def _filtro_pdf(filtros):
+    if not filtros:
+        return b""
+    if len(filtros) == 1:
+        return b"/Filter /" + filtros[0]
+    return b"/Filter [ " + b" ".join(b"/" + f for f in filtros) + b" ]"
+
+
+def _objeto(num, dic, datos=None):
+    if datos is None:
+        return b"%d 0 obj\n%s\nendobj\n" % (num, dic)
+    return b"%d 0 obj\n%s\nstream\n%s\nendstream\nendobj\n" % (num, dic, datos)
+
+
+def _trailer_dict(trailer, size, extra=b""):
+    partes = [b"/Size %d" % size, b"/Root %d 0 R" % trailer["Root"]]
+    if trailer["Info"] is not None:
+        partes.append(b"/Info %d 0 R" % trailer["Info"])
+    if trailer["ID"] is not None:
+        partes.append(b"/ID " + trailer["ID"])
+    return b"<<\n" + extra + b" ".join(partes) + b"\n>>"
+
+
+def _escribir_clasico(encabezado, objetos, trailer):
+    salida = bytearray(encabezado)
+    offsets = {}
+    for num in sorted(objetos):
+        offsets[num] = len(salida)
+        salida += _objeto(num, *objetos[num])
+
+    inicio_xref = len(salida)
+    size = max(objetos) + 1
+    salida += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for num in range(1, size):
+        salida += b"%010d 00000 n \n" % offsets[num] if num in offsets else b"0000000000 65535 f \n"
+    salida += b"trailer\n" + _trailer_dict(trailer, size) + b"\nstartxref\n%d\n%%%%EOF\n" % inicio_xref
+    return bytes(salida)
+
+
+def _escribir_con_object_streams(encabezado, objetos, trailer, nivel, ascii85):
+    """Objetos sin stream agrupados en /ObjStm y xref como stream comprimido (PDF 1.5)."""
+    def codificar(datos):
+        filtros = []
+        if nivel:
+            datos, filtros = zlib.compress(datos, nivel), [b"FlateDecode"]
+        if ascii85:
+            datos, filtros = _a85(datos), [b"ASCII85Decode"] + filtros
+        return datos, _filtro_pdf(filtros)
+
+    salida = bytearray(re.sub(rb"^%PDF-1\.[0-4]", b"%PDF-1.5", encabezado))
+    entradas = {}  # número -> (tipo, campo 2, campo 3) de la xref
+    siguiente = max(objetos) + 1
+
+    sueltos = sorted(num for num, (_, datos) in objetos.items() if datos is None)
+    for i in range(0, len(sueltos), MAX_OBJETOS_POR_STREAM):
+        grupo = sueltos[i:i + MAX_OBJETOS_POR_STREAM]
+        cuerpos, indice, posicion = [], [], 0
+        for n, num in enumerate(grupo):
+            cuerpo = objetos[num][0] + b"\n"
+            indice.append(b"%d %d" % (num, posicion))
+            cuerpos.append(cuerpo)
+            posicion += len(cuerpo)
+            entradas[num] = (2, siguiente, n)
+        cabecera = b" ".join(indice) + b"\n"
+        datos, filtro = codificar(cabecera + b"".join(cuerpos))
+        dic = b"<<\n/Type /ObjStm /N %d /First %d %s /Length %d\n>>" % (len(grupo), len(cabecera), filtro, len(datos))
+        entradas[siguiente] = (1, len(salida), 0)
+        salida += _objeto(siguiente, dic, datos)
+        siguiente += 1
+
+    for num in sorted(num for num, (_, datos) in objetos.items() if datos is not None):
+        entradas[num] = (1, len(salida), 0)
+        salida += _objeto(num, *objetos[num])
+
+    num_xref = siguiente
+    entradas[num_xref] = (1, len(salida), 0)
+    size = num_xref + 1
+    filas = bytearray(b"\x00\x00\x00\x00\x00\xff\xff")  # objeto 0: libre
+    for num in range(1, size):
+        tipo, campo2, campo3 = entradas.get(num, (0, 0, 0))
+        filas += bytes([tipo]) + campo2.to_bytes(4, "big") + campo3.to_bytes(2, "big")
+    datos, filtro = codificar(bytes(filas))
+    dic = _trailer_dict(
+        trailer, size, extra=b"/Type /XRef /W [ 1 4 2 ] %s /Length %d " % (filtro, len(datos))
+    )
+    inicio_xref = len(salida)
+    salida += _objeto(num_xref, dic, datos)
+    salida += b"startxref\n%d\n%%%%EOF\n" % inicio_xref
+    return bytes(salida)
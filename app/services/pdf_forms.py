@@ -0,0 +1,15 @@
+# app/services/pdf_forms.py
+
+
+def usar_form(canvas, nombre, dibujar, caja=None):
+    """
+    Dibuja contenido fijo de página como form XObject: se define la primera vez
+    en el documento (dibujar(canvas)) y en las páginas siguientes solo se
+    referencia, sin volver a generar sus operaciones. `caja` (x0, y0, x1, y1)
+    es el BBox del form; por defecto, la página.
+    """
+    if not canvas.hasForm(nombre):
+        canvas.beginForm(nombre, *(caja or ()))
+        dibujar(canvas)
+        canvas.endForm()
+    canvas.doForm(nombre)
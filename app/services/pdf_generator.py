@@ -1,22 +1,150 @@
-from .pdf_tpl1 import generar_pdf as generar_pdf_tpl1
-from .pdf_tpl2 import generar_pdf as generar_pdf_tpl2
-from .pdf_tpl3 import generar_pdf as generar_pdf_tpl3
+from .pdf_tpl1 import generar_pdf as generar_pdf_tpl1, VERSION_PLANTILLA as VERSION_TPL1
+from .pdf_tpl2 import generar_pdf as generar_pdf_tpl2, VERSION_PLANTILLA as VERSION_TPL2
+from .pdf_tpl3 import generar_pdf as generar_pdf_tpl3, VERSION_PLANTILLA as VERSION_TPL3
+import asyncio
+import logging
+import time
 
-def generar_pdf(factura):
-    # 1) Extraemos el valor de plantilla desde caracteristicas.plantilla (por defecto = 1)
+from .render_executor import render_executor, RenderTimeoutError
+from .render_cache import cache_render, clave_render
+from .pdf_compresion import compactar_pdf, opciones_compresion, streams_binarios
+from .metrics import medicion_render, medir_etapa, registrar_render, renders
+from .perfilado import perfilar_render
+from .renders_lentos import capturas_lentas, muestrear_render
+from app.config import Config
+
+logger = logging.getLogger("fastapi_app")
+
+VERSIONES_PLANTILLA = {1: VERSION_TPL1, 2: VERSION_TPL2, 3: VERSION_TPL3}
+
+# Renders en curso por clave: las peticiones idénticas concurrentes esperan el mismo
+_renders_en_vuelo = {}
+
+def _numero_plantilla(factura):
     plantilla = factura.get("caracteristicas", {}).get("plantilla", 1)
     try:
-        plantilla = int(plantilla)
+        return int(plantilla)
     except (TypeError, ValueError):
-        plantilla = 1
-
-    # 2) Despacho EXACTO a cada módulo
-    if plantilla == 1:
-        return generar_pdf_tpl1(factura)
-    elif plantilla == 2:
-        return generar_pdf_tpl2(factura)
-    elif plantilla == 3:
-        return generar_pdf_tpl3(factura)
-    else:
-        raise ValueError(f"Plantilla desconocida: {plantilla}. Solo se admite 1 o 2.")
-    
\ No newline at end of file
+        return 1
+
+def etiqueta_plantilla(factura):
+    """Plantilla para las métricas: 1-3, u "otra" para no crear series con valores arbitrarios."""
+    plantilla = _numero_plantilla(factura)
+    return str(plantilla) if plantilla in VERSIONES_PLANTILLA else "otra"
+
+def generar_pdf(factura):
+    # 1) Extraemos el valor de plantilla desde caracteristicas.plantilla (por defecto = 1)
+    plantilla = _numero_plantilla(factura)
+
+    # Tiempos por etapa: lo que la plantilla no marca como build/serializacion
+    # es construcción de flowables; viajan al proceso principal en result["metricas"]
+    cpu_inicio = time.thread_time()
+    with muestrear_render() as pilas, medicion_render() as medicion, medicion.etapa("construccion"):
+        # 2) Despacho EXACTO a cada módulo
+        with streams_binarios():
+            if plantilla == 1:
+                result = generar_pdf_tpl1(factura)
+            elif plantilla == 2:
+                result = generar_pdf_tpl2(factura)
+            elif plantilla == 3:
+                result = generar_pdf_tpl3(factura)
+            else:
+                raise ValueError(f"Plantilla desconocida: {plantilla}. Solo se admite 1 o 2.")
+
+        # 3) Ajustes de tamaño del archivo (compresión, object streams)
+        with medir_etapa("serializacion"):
+            result["pdf_bytes"] = compactar_pdf(result["pdf_bytes"], **opciones_compresion(factura))
+
+    result["metricas"] = {
+        "plantilla": plantilla,
+        "etapas": medicion.etapas,
+        "cpu_segundos": time.thread_time() - cpu_inicio,
+        **medicion.datos,
+    }
+    # Render lento: las pilas muestreadas viajan para que el proceso principal guarde la captura
+    if pilas is not None and sum(medicion.etapas.values()) * 1000 >= Config.SLOW_RENDER_MS:
+        result["metricas"]["pilas"] = dict(pilas)
+    return result
+
+async def _renderizar(factura, perfilar=False):
+    """Render en el pool con sus métricas (etapas, páginas, bytes, resultado) por plantilla."""
+    plantilla = etiqueta_plantilla(factura)
+    inicio = time.perf_counter()
+    try:
+        if perfilar:
+            result = await render_executor.ejecutar(
+                perfilar_render, generar_pdf, factura, Config.PROFILE_DIR, Config.PROFILE_SAMPLE_MS / 1000,
+                Config.PROFILE_MAX_CAPTURES, render_executor.modo == "process",
+            )
+            # Los tiempos bajo cProfile no son representativos: fuera de los histogramas
+            result["metricas"].pop("pilas", None)
+            renders.inc(plantilla=plantilla, resultado="perfilado")
+            return result
+        result = await render_executor.ejecutar(generar_pdf, factura)
+    except RenderTimeoutError:
+        renders.inc(plantilla=plantilla, resultado="timeout")
+        if Config.SLOW_RENDER_MS:
+            _capturar_lento(factura, "timeout", time.perf_counter() - inicio)
+        raise
+    except Exception:
+        renders.inc(plantilla=plantilla, resultado="error")
+        raise
+    pilas = result["metricas"].pop("pilas", None)
+    if pilas is not None:
+        _capturar_lento(factura, "lento", time.perf_counter() - inicio, result["metricas"], pilas, result["pdf_bytes"])
+    registrar_render(plantilla, result)
+    return result
+
+def _capturar_lento(factura, resultado, latencia, *datos):
+    # Sin esperar: la escritura a disco no debe sumar latencia a una respuesta que ya es lenta
+    futuro = asyncio.get_running_loop().run_in_executor(
+        None, capturas_lentas.guardar, factura, resultado, latencia, *datos
+    )
+    futuro.add_done_callback(_registrar_error_captura)
+
+def _registrar_error_captura(futuro):
+    # Nadie espera el futuro: sin esto un error de guardar() se perdería en silencio
+    if not futuro.cancelled() and futuro.exception() is not None:
+        logger.error("⚠️ Falló la captura de render lento", exc_info=futuro.exception())
+
+async def _renderizar_y_cachear(factura, clave):
+    result = await _renderizar(factura)
+    if clave:
+        await cache_render.guardar(clave, result)
+    return result
+
+async def generar_pdf_async(factura, perfilar=False):
+    """
+    Envía el render al pool de procesos (o lo ejecuta en proceso si
+    RENDER_BACKEND=inline) sin bloquear el event loop.
+
+    Un payload idéntico a uno ya renderizado (misma versión de plantilla) se
+    sirve desde la cache de render con "desde_cache": True, y si ese mismo
+    payload se está renderizando en este momento se espera a ese render en
+    lugar de lanzar otro.
+
+    Con perfilar=True el render se hace siempre (sin cache) bajo el profiler
+    y result["perfil"] trae el nombre base de los archivos en PROFILE_DIR.
+    """
+    if perfilar:
+        return await _renderizar(factura, perfilar=True)
+    version = VERSIONES_PLANTILLA.get(_numero_plantilla(factura))
+    clave = clave_render(factura, version) if version else None
+    if clave is None:
+        return await _renderizar(factura)
+
+    result = await cache_render.obtener(clave)
+    if result is not None:
+        renders.inc(plantilla=etiqueta_plantilla(factura), resultado="cache")
+        return result
+
+    tarea = _renders_en_vuelo.get(clave)
+    if tarea is not None:
+        cache_render.contadores["coalescidos"] += 1
+        return dict(await asyncio.shield(tarea))
+
+    tarea = asyncio.ensure_future(_renderizar_y_cachear(factura, clave))
+    _renders_en_vuelo[clave] = tarea
+    tarea.add_done_callback(lambda _: _renders_en_vuelo.pop(clave, None))
+    # shield: si el cliente que lo lanzó se desconecta, el render sigue para los demás
+    return dict(await asyncio.shield(tarea))
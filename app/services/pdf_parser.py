@@ -6,6 +6,8 @@ from io import BytesIO
 import pdfplumber
 import requests
 
+from app.services.metrics import anotar, medir_etapa
+
 
 def fetch_pdf_bytes(pdf_url) -> BytesIO:
     """
@@ -27,6 +29,7 @@ def extract_text_from_pdf(file_stream: BytesIO) -> str:
     de la primera página (donde está la información del RUT).
     """
     with pdfplumber.open(file_stream) as pdf:
+        anotar(paginas=len(pdf.pages))
         page = pdf.pages[0]
         texto = page.extract_text() or ""
     return texto
@@ -230,7 +233,11 @@ def pdf_to_json_rut(pdf_url: str) -> dict:
     Toma la URL pública de un PDF (RUT), lo descarga, extrae texto y parsea campos.
     Retorna un diccionario con todos los datos encontrados.
     """
-    fichero = fetch_pdf_bytes(pdf_url)
-    texto = extract_text_from_pdf(fichero)
-    datos = parse_rut_text(texto)
+    with medir_etapa("descarga"):
+        fichero = fetch_pdf_bytes(pdf_url)
+    anotar(bytes=fichero.getbuffer().nbytes)
+    with medir_etapa("extraccion"):
+        texto = extract_text_from_pdf(fichero)
+    with medir_etapa("parseo"):
+        datos = parse_rut_text(texto)
     return datos
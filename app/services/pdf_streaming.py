@@ -0,0 +1,207 @@
+# app/services/pdf_streaming.py
+#
+# Piezas para renderizar documentos muy largos con memoria acotada: los
+# flowables se generan a medida que platypus los consume, cada página se
+# cierra (y comprime) apenas termina, y el render se corta si el proceso
+# supera el presupuesto de memoria configurado.
+
+import os
+from collections import deque
+
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFBase85Encode, PDFName, PDFStream, PDFZCompress
+from reportlab.pdfgen import canvas as canvas_module
+from reportlab import rl_config
+
+from app.config import Config
+from app.services.metrics import anotar, medir_etapa
+
+
+def _form_pagina(numero):
+    return f"pagina_{numero}"
+
+
+class PresupuestoMemoriaExcedidoError(Exception):
+    """
+    El render superó el presupuesto de memoria configurado. No es un error
+    del payload: se responde 503 con Retry-After para reintentar cuando el
+    worker tenga memoria libre.
+    """
+
+    retry_after = Config.RENDER_MEMORY_RETRY_AFTER_SECONDS
+
+
+def rss_mb():
+    """Memoria residente actual del proceso en MB, o None si no se puede leer (sin /proc)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PresupuestoMemoria:
+    """
+    Corta el render si la memoria residente del proceso supera `max_mb`
+    (0 = sin límite). Sin forma de leer la memoria actual no se aplica: el
+    pico de ru_maxrss nunca baja y haría fallar todos los renders siguientes.
+    """
+
+    def __init__(self, max_mb):
+        self.max_mb = max_mb
+        self.pico_mb = 0.0
+
+    def verificar(self):
+        actual = rss_mb()
+        if actual is None:
+            return
+        self.pico_mb = max(self.pico_mb, actual)
+        if self.max_mb and actual > self.max_mb:
+            raise PresupuestoMemoriaExcedidoError(
+                f"El documento excede el presupuesto de memoria de render "
+                f"({actual:.0f} MB > {self.max_mb} MB)"
+            )
+
+
+class ColaFlowables:
+    """
+    Lista perezosa de flowables para doc.build(): solo materializa lo que
+    platypus va consumiendo, así los flowables de páginas ya dibujadas se
+    liberan enseguida. Soporta lo que usa BaseDocTemplate: len(), [0], [:n],
+    del [0] / [:n], insert(0, f) y cola[0:0] = partes.
+    """
+
+    def __init__(self, flowables):
+        self._pendientes = deque()
+        self._fuente = iter(flowables)
+
+    def _llenar(self, n):
+        while len(self._pendientes) < n:
+            siguiente = next(self._fuente, None)
+            if siguiente is None:
+                return
+            self._pendientes.append(siguiente)
+
+    def _materializar(self):
+        self._pendientes.extend(self._fuente)
+
+    def __len__(self):
+        # Solo cuenta lo ya generado: basta con que sea > 0 mientras quede algo
+        self._llenar(1)
+        return len(self._pendientes)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            if indice.stop is None or indice.stop < 0:
+                self._materializar()
+            else:
+                self._llenar(indice.stop)
+            return list(self._pendientes)[indice]
+        if indice < 0:
+            self._materializar()
+        else:
+            self._llenar(indice + 1)
+        return self._pendientes[indice]
+
+    def __setitem__(self, indice, valor):
+        if isinstance(indice, slice) and indice.start in (0, None) and indice.stop == 0:
+            self._pendientes.extendleft(reversed(list(valor)))
+            return
+        if isinstance(indice, slice):
+            self._materializar()
+            pendientes = list(self._pendientes)
+            pendientes[indice] = valor
+            self._pendientes = deque(pendientes)
+            return
+        self._llenar(indice + 1)
+        self._pendientes[indice] = valor
+
+    def __delitem__(self, indice):
+        if isinstance(indice, slice) and indice.start in (0, None) and indice.step is None \
+                and indice.stop is not None and indice.stop >= 0:
+            self._llenar(indice.stop)
+            for _ in range(min(indice.stop, len(self._pendientes))):
+                self._pendientes.popleft()
+            return
+        if isinstance(indice, slice):
+            self._materializar()
+            pendientes = list(self._pendientes)
+            del pendientes[indice]
+            self._pendientes = deque(pendientes)
+            return
+        if indice == 0:
+            self._llenar(1)
+            self._pendientes.popleft()
+            return
+        self._materializar()
+        del self._pendientes[indice]
+
+    def insert(self, indice, valor):
+        if indice == 0:
+            self._pendientes.appendleft(valor)
+            return
+        self._llenar(indice)
+        self._pendientes.insert(indice, valor)
+
+
+class CanvasPaginado(canvas_module.Canvas):
+    """
+    Canvas con "Página X de N" que cierra cada página al terminarla en vez de
+    guardar una copia del estado por página hasta save(). Cada página
+    referencia su propio form XObject (pagina_X), que se define al final,
+    cuando ya se conoce el total, con el texto completo alineado a la derecha.
+    Con compresión activa, el contenido de cada página se comprime enseguida
+    y se descarta el texto sin comprimir.
+    """
+
+    fuente = "Helvetica"
+    tamano_fuente = 6
+    margen_derecho = 28
+    y_texto = 30
+
+    def __init__(self, *args, color_texto=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.color_texto = color_texto
+
+    def showPage(self):
+        self.draw_page_number()
+        super().showPage()
+        self._comprimir_ultima_pagina()
+
+    def save(self):
+        total_paginas = self._pageNumber - 1
+        anotar(paginas=total_paginas)
+        with medir_etapa("serializacion"):
+            self._definir_numeros(total_paginas)
+            super().save()
+
+    def draw_page_number(self):
+        self.doForm(_form_pagina(self._pageNumber))
+
+    def _definir_numeros(self, total_paginas):
+        x = self._pagesize[0] - self.margen_derecho
+        for pagina in range(1, total_paginas + 1):
+            self.beginForm(_form_pagina(pagina))
+            self.setFont(self.fuente, self.tamano_fuente)
+            if self.color_texto is not None:
+                self.setFillColor(self.color_texto)
+            self.drawRightString(x, self.y_texto, f"Página {pagina} de {total_paginas}")
+            self.endForm()
+
+    def _comprimir_ultima_pagina(self):
+        # Usa internos de ReportLab (Pages.pages, PDFPage.stream): la versión está fijada en requirements.txt
+        pagina = self._doc.Pages.pages[-1]
+        if not pagina.compression or not pagina.stream:
+            return
+        # Mismos filtros que aplicaría PDFPage.check_format en save()
+        filtros = [PDFBase85Encode, PDFZCompress] if rl_config.useA85 else [PDFZCompress]
+        datos = pagina.stream
+        for filtro in reversed(filtros):
+            datos = filtro.encode(datos)
+        contenido = PDFStream(content=datos)
+        contenido.dictionary["Filter"] = PDFArray([PDFName(f.pdfname) for f in filtros])
+        contenido.__Comment__ = "page stream"
+        pagina.Contents = contenido
+        pagina.stream = None
@@ -0,0 +1,52 @@
+# app/services/pdf_styles.py
+
+from functools import lru_cache
+
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import TableStyle
+
+# Los estilos se comparten entre renders: ni Paragraph ni Table.setStyle los
+# modifican, así que nadie debe alterarlos después de crearlos.
+
+
+@lru_cache(maxsize=1)
+def hoja_estilos():
+    """getSampleStyleSheet() armado una sola vez por proceso."""
+    return getSampleStyleSheet()
+
+
+def _congelar(valor):
+    """Listas -> tuplas (recursivo) para poder usar el valor como clave de cache."""
+    if isinstance(valor, (list, tuple)):
+        return tuple(_congelar(v) for v in valor)
+    return valor
+
+
+@lru_cache(maxsize=2048)
+def _estilo_parrafo(name, parent, atributos):
+    return ParagraphStyle(name=name, parent=parent, **dict(atributos))
+
+
+def estilo_parrafo(name, parent=None, **atributos):
+    """
+    ParagraphStyle cacheado por (nombre, padre, atributos). Los colores por
+    petición (caracteristicas) forman parte de la clave, con expulsión LRU.
+    """
+    try:
+        return _estilo_parrafo(name, parent, tuple(sorted(atributos.items())))
+    except TypeError:
+        # Algún atributo no es hashable: se construye sin cache
+        return ParagraphStyle(name=name, parent=parent, **atributos)
+
+
+@lru_cache(maxsize=2048)
+def _estilo_tabla(comandos):
+    return TableStyle(comandos)
+
+
+def estilo_tabla(comandos):
+    """TableStyle cacheado por su lista de comandos (incluidos los colores)."""
+    try:
+        return _estilo_tabla(_congelar(comandos))
+    except TypeError:
+        return TableStyle(comandos)
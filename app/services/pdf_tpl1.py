@@ -2,29 +2,32 @@ from datetime import datetime
 from urllib.parse import urlparse
 from fastapi import HTTPException
 from reportlab.lib import pagesizes
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, PageBreak
 from reportlab.lib import colors
 from reportlab.lib.colors import Color
+from functools import lru_cache
 from io import BytesIO
-from starlette.concurrency import run_in_threadpool
-from reportlab.lib.utils import ImageReader
-import boto3
-import base64
+import logging
 import os
-from app.services.qr_generator import generar_qr
-from reportlab.pdfgen import canvas as canvas_module
+from app.services.qr_generator import CodigoQR
+from app.services.pdf_styles import hoja_estilos, estilo_parrafo, estilo_tabla
+from app.services.image_cache import cache_imagenes, ImagenLogo
+from app.services.pdf_forms import usar_form
+from app.services.metrics import medir_etapa
+from app.services.encabezado_cache import clave_emisor, bloque_emisor, fila_encabezado
+from app.services.pdf_streaming import ColaFlowables, CanvasPaginado, PresupuestoMemoria
+from app.config import Config
 from dotenv import load_dotenv
 
 load_dotenv()
 
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-S3_REGION = os.getenv("S3_REGION")
 
-s3_client = boto3.client(
-    "s3",
-    region_name=S3_REGION
-)
+logger = logging.getLogger("fastapi_app")
+
+# Subir en cada cambio visible del PDF: invalida la cache de render de esta plantilla
+VERSION_PLANTILLA = "2"
+
 
 PAGE_PARAMS = {
     "LETTER": {
@@ -64,11 +67,40 @@ PAGE_PARAMS = {
     # añade más tamaños dependiendo de los definidos en el json
 }
 
+@lru_cache(maxsize=256)
 def hex_to_rgb_color(hex_string: str) -> Color:
     hex_string = hex_string.lstrip("#")
     r, g, b = tuple(int(hex_string[i:i+2], 16) for i in (0, 2, 4))
     return Color(r / 255.0, g / 255.0, b / 255.0)
 
+# Tabla de detalle: anchos y paddings compartidos por el planificador de páginas y la tabla
+DETALLE_COL_WIDTHS = [25, 180, 40, 40, 75, 50, 75, 75]
+DETALLE_PADDING_H = 6         # LEFT/RIGHTPADDING (valor por defecto de Table)
+DETALLE_PADDING_V = 2         # TOP/BOTTOMPADDING de la tabla
+DETALLE_LEADING_TEXTO = 12    # leading por defecto de las celdas de texto (la tabla solo fija FONTSIZE)
+
+class ParrafoMedido(Paragraph):
+    """
+    Paragraph que recuerda su último wrap: el planificador lo mide una vez y
+    la tabla reutiliza ese resultado al dibujar (mismo ancho disponible).
+    """
+    _medida = None
+
+    def wrap(self, availWidth, availHeight):
+        if self._medida is None or self._medida[0] != availWidth:
+            self._medida = (availWidth, super().wrap(availWidth, availHeight))
+        return self._medida[1]
+
+def alto_fila_detalle(parrafo):
+    """Alto de una fila de la tabla de detalle, calculado igual que Table."""
+    ancho_descripcion = DETALLE_COL_WIDTHS[1] - 2 * DETALLE_PADDING_H
+    alto_descripcion = parrafo.wrap(ancho_descripcion, 72000)[1]
+    return max(DETALLE_LEADING_TEXTO, alto_descripcion) + 2 * DETALLE_PADDING_V
+
+def alto_flowables(flowables, ancho):
+    """Alto que ocupan los flowables apilados en el frame (incluye espacios antes/después)."""
+    return sum(f.wrap(ancho, 72000)[1] + f.getSpaceBefore() + f.getSpaceAfter() for f in flowables)
+
 def agregar_marca_agua(canvas, factura):
     texto_marca = factura["documento"].get("marca_agua", "")
     if not texto_marca:
@@ -113,7 +145,7 @@ def agregar_autorretenedores(canvas, doc, factura):
                             "Autorretenedores: Información no disponible.")
 
     # 2) Estilo con leading reducido (menos espacio entre líneas)
-    estilo_auto = ParagraphStyle(
+    estilo_auto = estilo_parrafo(
         name="Autorretenedores",
         fontName="Helvetica",
         fontSize=7,
@@ -163,9 +195,7 @@ def agregar_pie_pagina(canvas, doc, factura):
 
     if logo_base64:
         try:
-            logo_data = base64.b64decode(logo_base64)
-            logo_buffer = BytesIO(logo_data)
-            logo_image = ImageReader(logo_buffer)
+            logo_image = cache_imagenes.lector(logo_base64, caja=(79, 20))
 
             logo_width = 79
             logo_height = 20
@@ -175,10 +205,28 @@ def agregar_pie_pagina(canvas, doc, factura):
             canvas.drawImage(logo_image, logo_x, logo_y, width=logo_width, height=logo_height, mask='auto')
 
         except Exception as e:
-            print(f"Error al cargar la imagen del logo: {e}")
+            logger.warning(f"⚠️ Error al cargar la imagen del logo: {e}")
+
+    canvas.restoreState()
 
+# **Fecha de validación DIAN en lateral izquierdo**
+def agregar_fecha_validacion(canvas, doc, factura):
+    canvas.saveState()
+    canvas.setFont("Helvetica-Bold", 7)
+    canvas.setFillColor(colors.grey)
+    canvas.translate(15, 500)  # Posición: X desde borde izq., Y desde abajo (ajustable)
+    canvas.rotate(90)  # Rota para que el texto vaya de abajo hacia arriba
+    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
     canvas.restoreState()
 
+# **Contenido fijo de página (igual en todas): se dibuja una vez como form XObject**
+def dibujar_contenido_fijo(canvas, doc, factura):
+    agregar_marca_agua(canvas, factura)
+    agregar_direccion_contacto(canvas, doc, factura)
+    agregar_autorretenedores(canvas, doc, factura)
+    agregar_pie_pagina(canvas, doc, factura)
+    agregar_fecha_validacion(canvas, doc, factura)
+
 # **Funciones para manejar encabezado y pie de página correctamente**
 def primera_pagina(canvas, doc, factura):
     
@@ -195,19 +243,7 @@ def primera_pagina(canvas, doc, factura):
     canvas.restoreState()
     # ————————————————————
 
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
-    
-
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    canvas.translate(15, 500)  # Posición: X desde borde izq., Y desde abajo (ajustable)
-    canvas.rotate(90)  # Rota para que el texto vaya de abajo hacia arriba
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
 def paginas_siguientes(canvas, doc, factura):
     
@@ -221,52 +257,15 @@ def paginas_siguientes(canvas, doc, factura):
     canvas.restoreState()
     # ————————————————————
     
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    canvas.translate(15, 500) # Posición: X desde borde izq., Y desde abajo (ajustable)
-    canvas.rotate(90)  # Rota para que el texto vaya de abajo hacia arriba
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+class NumberedCanvas(CanvasPaginado):
+    """"Página X de N" con el color del pie; N se escribe al final como form XObject compartido."""
 
-class NumberedCanvas(canvas_module.Canvas):
     def __init__(self, *args, factura=None, **kwargs):
-        super(NumberedCanvas, self).__init__(*args, **kwargs)
+        color_hex = factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
+        super().__init__(*args, color_texto=hex_to_rgb_color(color_hex), **kwargs)
         self.factura = factura
-        self._saved_page_states = []
-
-    def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))  # Guarda el estado
-        self._startPage()  # Prepara una nueva página sin dibujar aún
-
-    def save(self):
-        total_pages = len(self._saved_page_states)
-
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_page_number(total_pages)
-            super(NumberedCanvas, self).showPage()
-
-        super(NumberedCanvas, self).save()
-
-    def draw_page_number(self, total_pages):
-        page_width = self._pagesize[0]
-        text_y = 30
-
-        color_hex = self.factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
-        color_rgb = hex_to_rgb_color(color_hex)
-
-        self.setFont("Helvetica", 6)
-        self.setFillColor(color_rgb)
-
-        page_num_text = f"Página {self._pageNumber} de {total_pages}"
-        self.drawRightString(page_width - 28, text_y, page_num_text)
-
 
 
 def generar_pdf(factura):
@@ -283,8 +282,6 @@ def generar_pdf(factura):
 
     # Obtén los parámetros para este papel (o los de LETTER si no existe)
     params = PAGE_PARAMS.get(papel, PAGE_PARAMS["LETTER"])
-    header_height_first = params["header_height_first"]
-    header_height_later = params["header_height_later"]
     footer_height      = params["footer_height"]
     
     # Construye el SimpleDocTemplate
@@ -316,47 +313,17 @@ def generar_pdf(factura):
         == 1
     )
 
-    # Altura del bloque de totales (fija)
-    totales_height = 105
-
-    # Márgenes
-    top_margin    = pdf.topMargin
-    bottom_margin = pdf.bottomMargin
-
-    # Espacio disponible “crudo” antes de restar totales
-    base_available_first = (
-        page_height
-        - top_margin
-        - bottom_margin
-        - header_height_first
-        - footer_height
+    # Zona útil de cada página: el frame de SimpleDocTemplate (padding de 6pt)
+    # menos lo que ocupa el pie fijo (dirección, autorretenedores, logo)
+    padding_frame = 6
+    ancho_util = pdf.width - 2 * padding_frame
+    alto_util = (
+        pdf.height
+        - 2 * padding_frame
+        - max(0, footer_height - (pdf.bottomMargin + padding_frame))
     )
-    base_available_later = (
-        page_height
-        - top_margin
-        - bottom_margin
-        - header_height_later
-        - footer_height
-    )
-
-    INFO_CLIENTE_HEIGHT = 180
-    # ---------------------------------------------------
 
-    if show_totales_last_only:
-        # Totales SOLO en la última página,
-        available_height_first = base_available_first
-        available_height_later = base_available_later - totales_height
-    else:
-        # Totales en todas las páginas → restamos siempre
-        available_height_first = base_available_first - totales_height
-        available_height_later = base_available_later - totales_height
-
-    # ahora, si la sección INFO_CLIENTE **se pinta** en páginas >1, la restamos también
-    if not solo_primera:
-        available_height_later -= INFO_CLIENTE_HEIGHT
-
-
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
     elements = []
 
     color_hex = factura.get("caracteristicas", {}).get("color_fondo", "#808080")
@@ -369,7 +336,7 @@ def generar_pdf(factura):
 
     # **Encabezado Principal**
     def agregar_encabezado():
-        razon_social_style = ParagraphStyle(
+        razon_social_style = estilo_parrafo(
             name="RazonSocialTitle",
             fontName="Helvetica-Bold",
             fontSize=12,
@@ -378,14 +345,14 @@ def generar_pdf(factura):
             spaceAfter=6
         )
 
-        normal_color_style = ParagraphStyle(
+        normal_color_style = estilo_parrafo(
             name="EncabezadoColorTexto",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
             fontSize=7,
             textColor=color_texto_encabezado_rgb
         )
-        centered_bold_7 = ParagraphStyle(
+        centered_bold_7 = estilo_parrafo(
             name="CenteredBold7",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
@@ -394,75 +361,76 @@ def generar_pdf(factura):
             alignment=1  # center
         )
 
-        header_data = [
-            [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
-        ]
-        header_table = Table(header_data, colWidths=[500])
-        header_table.setStyle(TableStyle([
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ]))
-        elements.append(header_table)
+        # Lo que no cambia entre documentos del emisor se mide una vez por proceso y se dibuja como form
+        clave = clave_emisor(factura, "tpl1", color_texto_encabezado_rgb.hexval())
+
+        def construir_razon_social():
+            header_table = Table([
+                [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
+            ], colWidths=[500])
+            header_table.setStyle(estilo_tabla([
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ]))
+            return header_table
+
+        elements.append(bloque_emisor(clave, construir_razon_social))
         elements.append(Spacer(1, 20))
 
         # **Información Fija (Izquierda) + QR (Centro) + Factura Electrónica (Derecha)**
-        emisor = factura.get("emisor", {})
-        info_fija = [
-            f"NIT: {emisor.get('documento', 'N/A')}",
-            f"Actividad Económica: {emisor.get('actividad_economica', 'N/A')}",
-            f"Régimen: {emisor.get('regimen', 'N/A')}",
-            f"Responsable IVA: {emisor.get('responsable_iva', 'N/A')}",
-            f"Tarifa ICA: {emisor.get('tarifa_ica', 'N/A')}"
-        ]
-        info_paragraphs = [Paragraph(f"<b>{line}</b>", normal_color_style) for line in info_fija]
-
-        logo_ofe_b64 = factura.get("emisor", {}).get("logo")
-        logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
-        if logo_ofe_b64:
-            try:
-                logo_data = base64.b64decode(logo_ofe_b64)
-                # Validar que sea una imagen válida, no un PDF u otro formato
-                if logo_data.startswith(b'%PDF'):
-                    print(f"⚠️ Error: El logo del emisor es un PDF, no una imagen válida")
+        def construir_celdas_fijas():
+            emisor = factura.get("emisor", {})
+            info_fija = [
+                f"NIT: {emisor.get('documento', 'N/A')}",
+                f"Actividad Económica: {emisor.get('actividad_economica', 'N/A')}",
+                f"Régimen: {emisor.get('regimen', 'N/A')}",
+                f"Responsable IVA: {emisor.get('responsable_iva', 'N/A')}",
+                f"Tarifa ICA: {emisor.get('tarifa_ica', 'N/A')}"
+            ]
+            info_paragraphs = [Paragraph(f"<b>{line}</b>", normal_color_style) for line in info_fija]
+
+            logo_ofe_b64 = emisor.get("logo")
+            logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
+            if logo_ofe_b64:
+                try:
+                    # Decodificado y validado una sola vez por logo (cache por hash del base64)
+                    logo_ofe_img = ImagenLogo(cache_imagenes.lector(logo_ofe_b64, caja=(90, 60)), width=90, height=60)
+                except Exception as e:
+                    logger.warning(f"⚠️ Error al cargar logo_ofe: {e}")
                     logo_ofe_img = Spacer(1, 1)
-                else:
-                    logo_buffer = BytesIO(logo_data)
-                    logo_ofe_img = Image(logo_buffer, width=90, height=60)  # Ajusta el tamaño si lo deseas
-            except Exception as e:
-                print(f"⚠️ Error al cargar logo_ofe: {e}")
-                logo_ofe_img = Spacer(1, 1)
+            return {0: [logo_ofe_img], 1: info_paragraphs}
 
-        qr_code = generar_qr(factura['documento']['qr'])
-        qr_buffer = BytesIO(qr_code.getvalue())
-        qr_image  = Image(qr_buffer, width=80, height=80)
+        qr_image = CodigoQR(factura['documento']['qr'], width=80, height=80)
 
         factura_info = Table([
             [Paragraph(f"<b>{factura['documento']['titulo_tipo_documento']}</b>", centered_bold_7)],
             [Paragraph(f"<b>{factura['documento']['identificacion']}</b>", centered_bold_7)]
         ], colWidths=[110])
-        factura_info.setStyle(TableStyle([
+        factura_info.setStyle(estilo_tabla([
             ("GRID", (0, 0), (-1, -1), 1, colors.black),
             ("ALIGN", (0, 0), (-1, -1), "CENTER"),
         ]))
 
-        header_row = Table([
-            [[logo_ofe_img], info_paragraphs, qr_image, factura_info]
-        ], colWidths=[140, 210, 100, 140])
-
-        header_row.setStyle(TableStyle([
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ]))
+        header_row = fila_encabezado(
+            clave,
+            [None, None, qr_image, factura_info],
+            construir_celdas_fijas,
+            colWidths=[140, 210, 100, 140],
+            estilo=[
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ],
+        )
 
         elements.append(header_row)
         elements.append(Spacer(1, 8))
 
     # **Información del Cliente**
     def agregar_info_cliente():
-        styles = getSampleStyleSheet()
+        styles = hoja_estilos()
         normal = styles["Normal"]
 
         # estilo para las "etiquetas" (Nombre:, Correo:, etc.) — fuente normal
-        label_style = ParagraphStyle(
+        label_style = estilo_parrafo(
             name="LabelStyle",
             parent=normal,
             fontName="Helvetica",
@@ -472,7 +440,7 @@ def generar_pdf(factura):
         )
 
         # estilo para los "valores" — negrita
-        value_style = ParagraphStyle(
+        value_style = estilo_parrafo(
             name="ValueStyle",
             parent=normal,
             fontName="Helvetica-Bold",
@@ -481,7 +449,7 @@ def generar_pdf(factura):
             textColor=colors.black,
         )
 
-        negrita_titulos = ParagraphStyle(
+        negrita_titulos = estilo_parrafo(
             name="Negrita7",
             parent=normal,
             fontName="Helvetica-Bold",
@@ -496,7 +464,7 @@ def generar_pdf(factura):
         color_fondo_rgb = hex_to_rgb_color(color_fondo_hex)
 
         titulo = Table([[Paragraph("Información del Cliente o Adquirente", negrita_titulos)]], colWidths=[560])
-        titulo.setStyle(TableStyle([
+        titulo.setStyle(estilo_tabla([
             ("BACKGROUND",   (0, 0), (-1, -1), color_fondo_rgb),
             ("TEXTCOLOR",    (0, 0), (-1, -1), colors.whitesmoke),
             ("ALIGN",        (0, 0), (-1, -1), "CENTER"),
@@ -508,7 +476,7 @@ def generar_pdf(factura):
         elements.append(titulo)
 
         # estilo común de bordes y espaciado
-        common_table_style = TableStyle([
+        common_table_style = estilo_tabla([
             ("VALIGN",      (0, 0), (-1, -1), "MIDDLE"),
             ("BOX",         (0, 0), (-1, -1), 1, colors.black),
             ("LINEABOVE",   (0, 0), (-1, 0), 0.5, colors.black),
@@ -536,7 +504,7 @@ def generar_pdf(factura):
                     row[idx] = Paragraph(row[idx], value_style)
 
         common_cmds = common_table_style._cmds
-        style_s1 = TableStyle(common_cmds + [
+        style_s1 = estilo_tabla(common_cmds + [
             ('SPAN', (1, 0), (3, 0)),  # extiende la celda de nombre desde la columna 1 hasta la 3
             ('SPAN', (1, 2), (3, 2)), # extiende la celda de Correo Electrónico desde la columna 1 hasta la 3
         ])
@@ -577,8 +545,8 @@ def generar_pdf(factura):
 
     # **Tabla de Detalles de Facturación**
     def agregar_detalle_factura(detalles):
-        styles = getSampleStyleSheet()
-        descripcion_style = ParagraphStyle(
+        styles = hoja_estilos()
+        descripcion_style = estilo_parrafo(
             name="DescripcionDetalleFactura",
             parent=styles["Normal"],
             fontName="Helvetica",
@@ -604,7 +572,7 @@ def generar_pdf(factura):
             ])
 
         detalle_table = Table(factura_detalles, colWidths=[25, 180, 40, 40, 75, 50, 75, 75])
-        detalle_table.setStyle(TableStyle([
+        detalle_table.setStyle(estilo_tabla([
             # **Encabezado de la tabla con fondo gris y texto blanco**
             ('BACKGROUND', (0, 0), (-1, 0), color_rgb),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
@@ -635,10 +603,10 @@ def generar_pdf(factura):
 
     # **Subtotal, Descuento, IVA y Total**
     def agregar_totales():
-        styles = getSampleStyleSheet()
+        styles = hoja_estilos()
 
         # Reducimos el leading para apretar filas
-        estilo_resolucion = ParagraphStyle(
+        estilo_resolucion = estilo_parrafo(
             name="ResolucionTexto",
             parent=styles["Normal"],
             fontName="Helvetica",
@@ -646,7 +614,7 @@ def generar_pdf(factura):
             leading=6,     
             alignment=0,
         )
-        label_style = ParagraphStyle(
+        label_style = estilo_parrafo(
             name="Label7",
             parent=styles["Normal"],
             fontName="Helvetica",
@@ -655,7 +623,7 @@ def generar_pdf(factura):
             textColor=colors.black,
             alignment=2,
         )
-        value_style = ParagraphStyle(
+        value_style = estilo_parrafo(
             name="ValueBold7",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
@@ -684,7 +652,7 @@ def generar_pdf(factura):
         ]
 
         totales_table = Table(totales_data, colWidths=[420, 0, 70, 70])
-        style = TableStyle([
+        style = estilo_tabla([
             ('VALIGN',      (0, 0), (-1, -1), 'MIDDLE'),
             ('BOX',         (0, 0), (-1, -1),  1, colors.black),
             ('LINEABOVE',   (0, 0), (-1, 0),    0.5, colors.black),
@@ -705,7 +673,7 @@ def generar_pdf(factura):
         # Estilos base
         normal_style = styles["Normal"]
         # Label en normal
-        label_style = ParagraphStyle(
+        label_style = estilo_parrafo(
             name="SectorLabel",
             parent=normal_style,
             fontName="Helvetica",
@@ -714,7 +682,7 @@ def generar_pdf(factura):
             textColor=colors.black,
         )
         # Valor en negrita
-        value_style = ParagraphStyle(
+        value_style = estilo_parrafo(
             name="SectorValue",
             parent=normal_style,
             fontName="Helvetica-Bold",
@@ -744,7 +712,7 @@ def generar_pdf(factura):
                 text = cell or ""
                 if row_idx == 0:
                     # Título en negrita blanca
-                    new_row.append(Paragraph(text, ParagraphStyle(
+                    new_row.append(Paragraph(text, estilo_parrafo(
                         name="TitleSector",
                         parent=normal_style,
                         fontName="Helvetica-Bold",
@@ -759,7 +727,7 @@ def generar_pdf(factura):
 
         # Construcción y estilo de la tabla
         sector_table = Table(sector_data, colWidths=[150, 150, 160, 100])
-        sector_table.setStyle(TableStyle([
+        sector_table.setStyle(estilo_tabla([
             ('SPAN', (0, 0), (-1, 0)),  # **Fusionar el título en toda la fila**
             ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
             ('BACKGROUND', (0, 0), (-1, 0), color_rgb),  # **Fondo gris para el título**
@@ -778,7 +746,7 @@ def generar_pdf(factura):
     def agregar_obs_documento():
         normal_style = styles["Normal"]
 
-        negrita_titulos = ParagraphStyle(
+        negrita_titulos = estilo_parrafo(
             name="Negrita7",
             parent=normal_style,
             fontName="Helvetica-Bold",
@@ -789,7 +757,7 @@ def generar_pdf(factura):
         texto_obs = factura["otros"].get("informacion_adicional", "")
         
         # 👉 Estilo del contenido largo
-        estilo_contenido = ParagraphStyle(
+        estilo_contenido = estilo_parrafo(
             name="ContenidoObservaciones",
             parent=normal_style,
             fontName="Helvetica",
@@ -804,7 +772,7 @@ def generar_pdf(factura):
         ]
 
         obs_table = Table(obs_data, colWidths=[100, 180, 100, 180])
-        obs_table.setStyle(TableStyle([
+        obs_table.setStyle(estilo_tabla([
             ('SPAN', (0, 0), (-1, 0)),  # Encabezado
             ('SPAN', (0, 1), (-1, 1)),  # 👈 También fusionamos toda la fila del contenido
             ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
@@ -826,17 +794,17 @@ def generar_pdf(factura):
         notas_texto = factura["documento"].get("notas_adicionales", "")
         if not notas_texto or not notas_texto.strip():
             return
-        styles = getSampleStyleSheet()
+        styles = hoja_estilos()
         color_fondo = hex_to_rgb_color(factura.get("caracteristicas", {}).get("color_fondo","#808080"))
 
-        negrita_titulos = ParagraphStyle(
+        negrita_titulos = estilo_parrafo(
             name="Negrita7",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
             fontSize=8,
             textColor=colors.whitesmoke,            
         )
-        valor_style = ParagraphStyle(
+        valor_style = estilo_parrafo(
             name="ValorTextoAdicional",
             parent=styles["Normal"],
             fontName="Helvetica",
@@ -850,7 +818,7 @@ def generar_pdf(factura):
         ]
 
         notas_table = Table(notas_data, colWidths=[560])
-        notas_table.setStyle(TableStyle([
+        notas_table.setStyle(estilo_tabla([
             # — Título fila —
             ('SPAN',           (0, 0), (-1, 0)),
             ('BACKGROUND',     (0, 0), (-1, 0), color_fondo),
@@ -869,8 +837,8 @@ def generar_pdf(factura):
     agregar_encabezado()
     agregar_info_cliente()
     
-    styles = getSampleStyleSheet()
-    descripcion_style = ParagraphStyle(
+    styles = hoja_estilos()
+    descripcion_style = estilo_parrafo(
         name="DescripcionDetalleFactura",
         parent=styles["Normal"],
         fontName="Helvetica",
@@ -879,42 +847,46 @@ def generar_pdf(factura):
         alignment=0
     )
 
+    def banner_documento():
+        """Tipo y número de documento sobre la tabla en páginas > 1 cuando el encabezado va solo en la primera."""
+        # estilo para el encabezado
+        header_style = estilo_parrafo(
+            name="HeaderDetalle",
+            parent=styles["Normal"],
+            fontName="Helvetica-Bold",
+            fontSize=8,
+            alignment=1  # centrar
+        )
+        encabezado_data = [[
+            Paragraph(factura["documento"]["titulo_tipo_documento"], header_style),
+            Paragraph(factura["documento"]["identificacion"], header_style)
+        ]]
+        # ancho total de la tabla de detalle: 25+180+40+40+75+50+75+75 = 560
+        header_tbl = Table(encabezado_data, colWidths=[400, 160])
+        header_tbl.setStyle(estilo_tabla([
+            ("BOX",           (0, 0), (-1, -1), 1, colors.black),
+            ("BACKGROUND",    (0, 0), (-1, -1), colors.whitesmoke),
+            ("TEXTCOLOR",     (0, 0), (-1, -1), colors.black),
+            ("ALIGN",         (0, 0), (-1, -1), "LEFT"),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+            ("TOPPADDING",    (0, 0), (-1, -1), 4),
+        ]))
+        return header_tbl
+
     def agregar_tabla_detalle(buffer_filas):
         if not buffer_filas:
             return
 
         # solo si pedimos encabezado solo en primera y estamos en página >1
         if solo_primera and page_number > 1:
-            # estilo para el encabezado
-            header_style = ParagraphStyle(
-                name="HeaderDetalle",
-                parent=styles["Normal"],
-                fontName="Helvetica-Bold",
-                fontSize=8,
-                alignment=1  # centrar
-            )
-            encabezado_data = [[
-                Paragraph(factura["documento"]["titulo_tipo_documento"], header_style),
-                Paragraph(factura["documento"]["identificacion"], header_style)
-            ]]
-            # ancho total de la tabla de detalle: 25+180+40+40+75+50+75+75 = 560
-            header_tbl = Table(encabezado_data, colWidths=[400, 160])
-            header_tbl.setStyle(TableStyle([
-                ("BOX",           (0, 0), (-1, -1), 1, colors.black),
-                ("BACKGROUND",    (0, 0), (-1, -1), colors.whitesmoke),
-                ("TEXTCOLOR",     (0, 0), (-1, -1), colors.black),
-                ("ALIGN",         (0, 0), (-1, -1), "LEFT"),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
-                ("TOPPADDING",    (0, 0), (-1, -1), 4),
-            ]))
-            elements.append(header_tbl)
+            elements.append(banner_documento())
             elements.append(Spacer(1, 6))
 
         tabla = Table(
             [["#", "Descripción", "U. Med", "Cantidad", "Valor Unitario", "% Imp.", "Descuento", "Total"]] + buffer_filas,
-            colWidths=[25, 180, 40, 40, 75, 50, 75, 75]
+            colWidths=DETALLE_COL_WIDTHS
         )
-        tabla.setStyle(TableStyle([
+        tabla.setStyle(estilo_tabla([
             ('BACKGROUND', (0, 0), (-1, 0), color_rgb),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
             ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
@@ -925,93 +897,139 @@ def generar_pdf(factura):
             ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
             ('FONTSIZE', (0, 0), (-1, -1), 7),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
-            ('TOPPADDING', (0, 0), (-1, -1), 2),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), DETALLE_PADDING_V),
+            ('TOPPADDING', (0, 0), (-1, -1), DETALLE_PADDING_V),
         ]))
         elements.append(tabla)
         elements.append(Spacer(1, 8))
 
-    page_number = 1
-    altura_actual = header_height_first
-    buffer_filas = []
-
-    for detalle in factura["detalles"]:
-        parrafo = Paragraph(detalle["descripcion"], descripcion_style)
-        altura_parrafo = parrafo.wrap(180, 0)[1]
-        altura_fila = max(altura_parrafo, 10) + 4
-
-        # elegimos el espacio disponible según si es página 1 o siguientes
-        current_available = (
-            available_height_first
-            if page_number == 1
-            else available_height_later
-        )
-        if altura_actual + altura_fila > current_available:
-            # 1) pintamos lo acumulado
-            agregar_tabla_detalle(buffer_filas)
-
-            # 2) rellenamos hasta el footer
-            espacio_restante = current_available - altura_actual
-            if espacio_restante > 0:
-                elements.append(Spacer(1, espacio_restante))
-
-            # 3) reset buffer y avanzar página
-            if not show_totales_last_only:
-                # primero vaciamos la tabla de detalle
-                agregar_totales()
-                agregar_sector_salud()
-                agregar_notas_adicionales()
-            
-            buffer_filas = []
-            elements.append(PageBreak())
-            page_number += 1
-            altura_actual = header_height_later
-
-            # 4) si no es solo primera, reponemos encabezado
-            if not solo_primera:
-                agregar_encabezado()
-                agregar_info_cliente()
-
-        # 5) acumulamos la fila
-        buffer_filas.append([
-            detalle["numero_linea"],
-            parrafo,
-            detalle["unidad_de_cantidad"],
-            detalle["cantidad"],
-            f"${float(detalle['valor_unitario']):,.2f}",
-            f"{detalle['impuestos_detalle']['porcentaje_impuesto']}%",
-            f"${float(detalle['cargo_descuento']['valor_cargo_descuento']):,.2f}",
-            f"${float(detalle['valor_total_detalle']):,.2f}",
-        ])
-        altura_actual += altura_fila
-
-    # pintamos lo que quede antes de totales
-    agregar_tabla_detalle(buffer_filas)
-    if show_totales_last_only or not show_totales_last_only:
+    # ---------- Plan de páginas ----------
+    # Lo fijo de cada página se mide una sola vez con sus flowables reales;
+    # cada fila se mide con el ancho y padding reales de su celda.
+    alto_encabezado = alto_flowables(elements, ancho_util)  # encabezado + info del cliente
+    if solo_primera:
+        alto_fijo_siguientes = alto_flowables([banner_documento(), Spacer(1, 6)], ancho_util)
+    else:
+        alto_fijo_siguientes = alto_encabezado
+    # fila de títulos de la tabla + Spacer(1, 8) tras ella
+    alto_tabla_vacia = DETALLE_LEADING_TEXTO + 2 * DETALLE_PADDING_V + 8
+
+    alto_totales = 0
+    if not show_totales_last_only:
+        # Totales en todas las páginas → se reserva su alto real
+        inicio = len(elements)
         agregar_totales()
         agregar_sector_salud()
-
         agregar_notas_adicionales()
-    texto_obs = factura.get("otros", {}).get("informacion_adicional", "")
-    if texto_obs and texto_obs.strip():
-        agregar_obs_documento()
-        
+        alto_totales = alto_flowables(elements[inicio:], ancho_util)
+        del elements[inicio:]
 
-    def paginas_basico(canvas, doc):
+    espacio_filas = alto_util - alto_totales - 1  # 1pt de margen frente a redondeos
+
+    # Modo factura grande: los flowables se generan página a página mientras
+    # platypus dibuja, en vez de armar toda la lista antes de build()
+    total_detalles = len(factura["detalles"])
+    modo_grande = 0 < Config.LARGE_INVOICE_MIN_DETALLES <= total_detalles
+    presupuesto = PresupuestoMemoria(Config.RENDER_MEMORY_BUDGET_MB) if modo_grande else None
+
+    page_number = 1
+
+    def vaciar_elements():
+        lote = elements[:]
+        del elements[:]
+        return lote
+
+    def generar_flowables():
+        """Flowables del documento, entregados al cerrar cada página (los agregar_* escriben en `elements`)."""
+        nonlocal page_number
+        altura_actual = alto_encabezado + alto_tabla_vacia
+        buffer_filas = []
+
+        for detalle in factura["detalles"]:
+            parrafo = ParrafoMedido(detalle["descripcion"], descripcion_style)
+            altura_fila = alto_fila_detalle(parrafo)
+
+            # una fila que no cabe ni en una página vacía va sola, sin dejar páginas en blanco
+            if buffer_filas and altura_actual + altura_fila > espacio_filas:
+                # 1) pintamos lo acumulado
+                agregar_tabla_detalle(buffer_filas)
+
+                # 2) rellenamos hasta el footer
+                espacio_restante = espacio_filas - altura_actual
+                if espacio_restante > 0:
+                    elements.append(Spacer(1, espacio_restante))
+
+                # 3) reset buffer y avanzar página
+                if not show_totales_last_only:
+                    # primero vaciamos la tabla de detalle
+                    agregar_totales()
+                    agregar_sector_salud()
+                    agregar_notas_adicionales()
+
+                buffer_filas = []
+                elements.append(PageBreak())
+                yield from vaciar_elements()
+                if presupuesto:
+                    presupuesto.verificar()
+                page_number += 1
+                altura_actual = alto_fijo_siguientes + alto_tabla_vacia
+
+                # 4) si no es solo primera, reponemos encabezado
+                if not solo_primera:
+                    agregar_encabezado()
+                    agregar_info_cliente()
+
+            # 5) acumulamos la fila
+            buffer_filas.append([
+                detalle["numero_linea"],
+                parrafo,
+                detalle["unidad_de_cantidad"],
+                detalle["cantidad"],
+                f"${float(detalle['valor_unitario']):,.2f}",
+                f"{detalle['impuestos_detalle']['porcentaje_impuesto']}%",
+                f"${float(detalle['cargo_descuento']['valor_cargo_descuento']):,.2f}",
+                f"${float(detalle['valor_total_detalle']):,.2f}",
+            ])
+            altura_actual += altura_fila
+
+        # pintamos lo que quede antes de totales
+        agregar_tabla_detalle(buffer_filas)
+        if show_totales_last_only or not show_totales_last_only:
+            agregar_totales()
+            agregar_sector_salud()
+
+            agregar_notas_adicionales()
+        texto_obs = factura.get("otros", {}).get("informacion_adicional", "")
+        if texto_obs and texto_obs.strip():
+            agregar_obs_documento()
+        yield from vaciar_elements()
+
+    def contenido_basico(canvas, doc):
         agregar_marca_agua(canvas, factura)
         agregar_pie_pagina(canvas, doc, factura)
         agregar_autorretenedores(canvas, doc, factura)
 
-    pdf.build(
-        elements,
-        onFirstPage=lambda c, d: primera_pagina(c, d, factura),
-        onLaterPages=lambda c, d: (
-            paginas_basico(c, d)
-            if solo_primera
-            else paginas_siguientes(c, d, factura)
-        ),
-        canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs),
-    )
+    def paginas_basico(canvas, doc):
+        usar_form(canvas, "contenido_basico", lambda c: contenido_basico(c, doc))
+
+    if modo_grande:
+        flowables = ColaFlowables(generar_flowables())
+    else:
+        flowables = list(generar_flowables())
+
+    # Layout y dibujo de las páginas (la escritura del archivo la mide CanvasPaginado.save);
+    # en modo grande incluye también la generación de los flowables, que es perezosa
+    with medir_etapa("build"):
+        pdf.build(
+            flowables,
+            onFirstPage=lambda c, d: primera_pagina(c, d, factura),
+            onLaterPages=lambda c, d: (
+                paginas_basico(c, d)
+                if solo_primera
+                else paginas_siguientes(c, d, factura)
+            ),
+            canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs),
+        )
 
     buffer.seek(0)
     pdf_bytes = buffer.getvalue()
@@ -1037,30 +1055,3 @@ def generar_pdf(factura):
         "key": key,
         "filename": pdf_filename,
     }
-    
-def _sync_upload(pdf_bytes: bytes, bucket: str, key: str):
-    print(f"[sync_upload] subiendo {len(pdf_bytes)} bytes a s3://{bucket}/{key}")
-    try:
-        buf = BytesIO(pdf_bytes)
-        s3_client.upload_fileobj(
-            buf,
-            bucket,
-            key,
-            ExtraArgs={
-                "ContentType": "application/pdf",
-                "ContentDisposition": "inline",
-            },
-        )
-        print(f"[sync_upload] ¡Subida completada! s3://{bucket}/{key}")
-    except Exception as e:
-        print(f"[sync_upload] ERROR al subir: {e}")
-        raise
-
-async def upload_pdf_to_s3(pdf_bytes: bytes, bucket: str, key: str):
-    """
-    Versión async de upload_pdf_to_s3: delega el trabajo pesado
-    al thread-pool internamente, liberando el event-loop.
-    """
-    print(f"[upload_pdf_to_s3] llamada recibida para {bucket}/{key}")
-    await run_in_threadpool(_sync_upload, pdf_bytes, bucket, key)
-    print(f"[upload_pdf_to_s3] función async finalizada para {bucket}/{key}")
\ No newline at end of file
@@ -2,30 +2,31 @@ from datetime import datetime
 from urllib.parse import urlparse
 from fastapi import HTTPException
 from reportlab.lib import pagesizes
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, PageBreak
 from reportlab.lib import colors
 from reportlab.lib.colors import Color
+from functools import lru_cache
 from io import BytesIO
-from starlette.concurrency import run_in_threadpool
-from reportlab.lib.utils import ImageReader
-import boto3
-import base64
+import logging
 import os
-from app.services.qr_generator import generar_qr
-from reportlab.pdfgen import canvas as canvas_module
+from app.services.qr_generator import CodigoQR
+from app.services.pdf_styles import hoja_estilos, estilo_parrafo, estilo_tabla
+from app.services.image_cache import cache_imagenes, ImagenLogo
+from app.services.pdf_forms import usar_form
+from app.services.metrics import medir_etapa
+from app.services.encabezado_cache import clave_emisor, bloque_emisor, fila_encabezado
+from app.services.pdf_streaming import CanvasPaginado
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-S3_REGION = os.getenv("S3_REGION")
 
-# Cliente S3
-s3_client = boto3.client(
-    "s3",
-    region_name=S3_REGION
-)
+logger = logging.getLogger("fastapi_app")
+
+# Subir en cada cambio visible del PDF: invalida la cache de render de esta plantilla
+VERSION_PLANTILLA = "2"
+
 
 PAGE_PARAMS = {
     "LETTER": {
@@ -66,6 +67,7 @@ PAGE_PARAMS = {
 }
 
 # Conversión de color hexadecimal a RGB
+@lru_cache(maxsize=256)
 def hex_to_rgb_color(hex_string: str) -> Color:
     hex_string = hex_string.lstrip("#")
     r, g, b = tuple(int(hex_string[i:i+2], 16) for i in (0, 2, 4))
@@ -120,13 +122,31 @@ def agregar_pie_pagina(canvas, doc, factura):
     logo_b64 = factura.get("afacturar", {}).get("logo")
     if logo_b64:
         try:
-            data = base64.b64decode(logo_b64)
-            img = ImageReader(BytesIO(data))
+            img = cache_imagenes.lector(logo_b64, caja=(79, 20))
             canvas.drawImage(img, page_width/2+130, 24, width=79, height=20, mask='auto')
         except:
             pass
     canvas.restoreState()
 
+# **Fecha de validación DIAN en lateral izquierdo**
+def agregar_fecha_validacion(canvas, doc, factura):
+    canvas.saveState()
+    canvas.setFont("Helvetica-Bold", 7)
+    canvas.setFillColor(colors.grey)
+    _, page_height = doc.pagesize
+    canvas.translate(15, page_height/2)  # centrado vertical aprox.
+    canvas.rotate(90)
+    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
+    canvas.restoreState()
+
+# **Contenido fijo de página (igual en todas): se dibuja una vez como form XObject**
+def dibujar_contenido_fijo(canvas, doc, factura):
+    agregar_marca_agua(canvas, factura)
+    agregar_direccion_contacto(canvas, doc, factura)
+    agregar_autorretenedores(canvas, doc, factura)
+    agregar_pie_pagina(canvas, doc, factura)
+    agregar_fecha_validacion(canvas, doc, factura)
+
 # **Funciones para manejar encabezado y pie de página correctamente**
 def primera_pagina(canvas, doc, factura):
     
@@ -143,20 +163,7 @@ def primera_pagina(canvas, doc, factura):
     canvas.restoreState()
     # ————————————————————
 
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
-    
-
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    _, page_height = doc.pagesize
-    canvas.translate(15, page_height/2)  # centrado vertical aprox.
-    canvas.rotate(90)
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
 def paginas_siguientes(canvas, doc, factura):
     
@@ -170,44 +177,16 @@ def paginas_siguientes(canvas, doc, factura):
     canvas.restoreState()
     # ————————————————————
 
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
-
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    _, page_height = doc.pagesize
-    canvas.translate(15, page_height/2)
-    canvas.rotate(90)
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
 # Canvas numerado
-class NumberedCanvas(canvas_module.Canvas):
+class NumberedCanvas(CanvasPaginado):
+    """"Página X de N" con el color del pie; N se escribe al final como form XObject compartido."""
+
     def __init__(self, *args, factura=None, **kwargs):
-        super().__init__(*args, **kwargs)
+        color_hex = factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
+        super().__init__(*args, color_texto=hex_to_rgb_color(color_hex), **kwargs)
         self.factura = factura
-        self._saved_page_states = []
-        
-    def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
-        self._startPage()
-    def save(self):
-        total = len(self._saved_page_states)
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_page_number(total)
-            super().showPage()
-        super().save()
-    def draw_page_number(self, total):
-        color_hex = self.factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
-        color = hex_to_rgb_color(color_hex)
-        self.setFont("Helvetica", 6)
-        self.setFillColor(color)
-        page_width, _ = self._pagesize   # 👈 dinámico
-        self.drawRightString(page_width - 28, 30, f"Página {self._pageNumber} de {total}")
 
 # Generación de PDF con lógica de plantilla 1
 
@@ -252,13 +231,13 @@ def generar_pdf(factura):
         avail1 -= tot_h
         availN -= tot_h
 
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
     elements = []
     color_fondo = hex_to_rgb_color(factura.get("caracteristicas", {}).get("color_fondo","#808080"))
     color_enc = hex_to_rgb_color(factura.get("caracteristicas", {}).get("encabezado",{}).get("Color_texto","#000000"))
 
     def agregar_encabezado():
-        razon_social_style = ParagraphStyle(
+        razon_social_style = estilo_parrafo(
             name="RazonSocialTitle",
             fontName="Helvetica-Bold",
             fontSize=12,
@@ -267,7 +246,7 @@ def generar_pdf(factura):
             spaceAfter=6
         )
 
-        normal_color_style = ParagraphStyle(
+        normal_color_style = estilo_parrafo(
             name="EncabezadoColorTexto",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
@@ -275,7 +254,7 @@ def generar_pdf(factura):
             textColor=color_enc  # 👈 Nuevo
         )
 
-        centered_bold_7 = ParagraphStyle(
+        centered_bold_7 = estilo_parrafo(
             name="CenteredBold7",
             parent=styles["Normal"],
             fontName="Helvetica-Bold",
@@ -284,92 +263,95 @@ def generar_pdf(factura):
             alignment=1  # center
         )
 
-        header_data = [
-            [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
-        ]
-        header_table = Table(header_data, colWidths=[500])
-        header_table.setStyle(TableStyle([
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ]))
-        elements.append(header_table)
+        # Lo que no cambia entre documentos del emisor se mide una vez por proceso y se dibuja como form
+        clave = clave_emisor(factura, "tpl2", color_enc.hexval())
+
+        def construir_razon_social():
+            header_table = Table([
+                [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
+            ], colWidths=[500])
+            header_table.setStyle(estilo_tabla([
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ]))
+            return header_table
+
+        elements.append(bloque_emisor(clave, construir_razon_social))
         elements.append(Spacer(1, 20))
 
         # **Información Fija (Izquierda) + QR (Centro) + Factura Electrónica (Derecha)**
-        emisor = factura.get("emisor", {})
-        info_fija = [
-            f"NIT: {emisor.get('documento', 'N/A')}",
-            f"Actividad Económica: {emisor.get('actividad_economica', 'N/A')}",
-            f"Régimen: {emisor.get('regimen', 'N/A')}",
-            f"Responsable IVA: {emisor.get('responsable_iva', 'N/A')}",
-            f"Tarifa ICA: {emisor.get('tarifa_ica', 'N/A')}"
-        ]
-        info_paragraphs = [Paragraph(f"<b>{line}</b>", normal_color_style) for line in info_fija]
-
-        logo_ofe_b64 = factura.get("emisor", {}).get("logo")
-        logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
-        if logo_ofe_b64:
-            try:
-                logo_data = base64.b64decode(logo_ofe_b64)
-                # Validar que sea una imagen válida, no un PDF u otro formato
-                if logo_data.startswith(b'%PDF'):
-                    print(f"⚠️ Error: El logo del emisor es un PDF, no una imagen válida")
+        def construir_celdas_fijas():
+            emisor = factura.get("emisor", {})
+            info_fija = [
+                f"NIT: {emisor.get('documento', 'N/A')}",
+                f"Actividad Económica: {emisor.get('actividad_economica', 'N/A')}",
+                f"Régimen: {emisor.get('regimen', 'N/A')}",
+                f"Responsable IVA: {emisor.get('responsable_iva', 'N/A')}",
+                f"Tarifa ICA: {emisor.get('tarifa_ica', 'N/A')}"
+            ]
+            info_paragraphs = [Paragraph(f"<b>{line}</b>", normal_color_style) for line in info_fija]
+
+            logo_ofe_b64 = emisor.get("logo")
+            logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
+            if logo_ofe_b64:
+                try:
+                    # Decodificado y validado una sola vez por logo (cache por hash del base64)
+                    logo_ofe_img = ImagenLogo(cache_imagenes.lector(logo_ofe_b64, caja=(90, 60)), width=90, height=60)
+                except Exception as e:
+                    logger.warning(f"⚠️ Error al cargar logo_ofe: {e}")
                     logo_ofe_img = Spacer(1, 1)
-                else:
-                    logo_buffer = BytesIO(logo_data)
-                    logo_ofe_img = Image(logo_buffer, width=90, height=60)  # Ajusta el tamaño si lo deseas
-            except Exception as e:
-                print(f"⚠️ Error al cargar logo_ofe: {e}")
-                logo_ofe_img = Spacer(1, 1)
+            return {0: [logo_ofe_img], 1: info_paragraphs}
 
         factura_info = Table([
             [Paragraph(f"<b>{factura['documento']['titulo_tipo_documento']}</b>", centered_bold_7)],
             [Paragraph(f"<b>{factura['documento']['identificacion']}</b>", centered_bold_7)]
         ], colWidths=[110])
-        factura_info.setStyle(TableStyle([
+        factura_info.setStyle(estilo_tabla([
             ("GRID", (0, 0), (-1, -1), 1, colors.black),
             ("ALIGN", (0, 0), (-1, -1), "CENTER"),
         ]))
 
-        header_row = Table([
-            [[logo_ofe_img], info_paragraphs, "", factura_info]
-        ], colWidths=[140, 210, 100, 140])
-
-        header_row.setStyle(TableStyle([
-            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ]))
+        header_row = fila_encabezado(
+            clave,
+            [None, None, "", factura_info],
+            construir_celdas_fijas,
+            colWidths=[140, 210, 100, 140],
+            estilo=[
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+            ],
+        )
 
         elements.append(header_row)
         elements.append(Spacer(1, 8))
 
     # **Información del Cliente**
     def agregar_info_cliente():
-        styles = getSampleStyleSheet()
+        styles = hoja_estilos()
         normal = styles["Normal"]
 
         # — Estilos —
-        label_style = ParagraphStyle(
+        label_style = estilo_parrafo(
             name="LabelStyle", parent=normal,
             fontName="Helvetica",       # regular
             fontSize=7, leading=8,
             textColor=colors.black,
             alignment=0  # izq
         )
-        header7 = ParagraphStyle(
+        header7 = estilo_parrafo(
             name="Header7", parent=normal,
             fontName="Helvetica-Bold",
             fontSize=7, leading=8,
             textColor=colors.whitesmoke,
             alignment=1  # centrar
         )
-        value_left = ParagraphStyle(
+        value_left = estilo_parrafo(
             name="ValueLeft", parent=normal,
             fontName="Helvetica-Bold",  # negrita
             fontSize=7, leading=8,
             textColor=colors.black,
             alignment=0
         )
-        value_center = ParagraphStyle(
+        value_center = estilo_parrafo(
             name="ValueCenter", parent=normal,
             fontName="Helvetica-Bold",  # negrita
             fontSize=7, leading=8,
@@ -423,7 +405,7 @@ def generar_pdf(factura):
 
         colWidths = [100, 260, 98, 98]
         tbl = Table(data, colWidths=colWidths)
-        tbl.setStyle(TableStyle([
+        tbl.setStyle(estilo_tabla([
             # título sección izq.
             ("SPAN",       (0, 0), (1, 0)),
             ("BACKGROUND", (0, 0), (1, 0), bg_color),
@@ -471,8 +453,8 @@ def generar_pdf(factura):
 
     # **Tabla de Detalles de Facturación**
     def agregar_detalle_factura(detalles):
-        styles = getSampleStyleSheet()
-        descripcion_style = ParagraphStyle(
+        styles = hoja_estilos()
+        descripcion_style = estilo_parrafo(
             name="DescripcionDetalleFactura",
             parent=styles["Normal"],
             fontName="Helvetica",
@@ -498,7 +480,7 @@ def generar_pdf(factura):
             ])
 
         detalle_table = Table(factura_detalles, colWidths=[25, 180, 40, 40, 75, 50, 75, 75])
-        detalle_table.setStyle(TableStyle([
+        detalle_table.setStyle(estilo_tabla([
             # **Encabezado de la tabla con fondo gris y texto blanco**
             ('BACKGROUND', (0, 0), (-1, 0), color_fondo),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
@@ -529,11 +511,11 @@ def generar_pdf(factura):
     # **Subtotal, Descuento, IVA y Total**
     def agregar_totales():
         # — Estilos para celdas —
-        styles = getSampleStyleSheet()
+        styles = hoja_estilos()
         normal = styles["Normal"]
 
         # etiquetas en fuente normal
-        label_style = ParagraphStyle(
+        label_style = estilo_parrafo(
             name="LabelTotales",
             parent=normal,
             fontName="Helvetica",
@@ -542,7 +524,7 @@ def generar_pdf(factura):
             alignment=0,  # izquierda
         )
         # valores en negrita
-        value_style = ParagraphStyle(
+        value_style = estilo_parrafo(
             name="ValueTotales",
             parent=normal,
             fontName="Helvetica-Bold",
@@ -556,16 +538,12 @@ def generar_pdf(factura):
         bg_color = hex_to_rgb_color(bg_hex)
 
         # — Generar QR —
-        qr_code = generar_qr(factura['documento']['qr'])
-        qr_path = "temp_qr.png"
-        with open(qr_path, "wb") as f:
-            f.write(qr_code.getbuffer())
-        qr_image = Image(qr_path, width=70, height=70)
+        qr_image = CodigoQR(factura['documento']['qr'], width=70, height=70)
 
         # — Subtabla Orden de Compra —
         oc_num = factura["documento"].get("numero_orden", "")
         oc_tbl = Table([
-            [Paragraph("Orden de Compra", ParagraphStyle(
+            [Paragraph("Orden de Compra", estilo_parrafo(
                 name="HeaderOC",
                 parent=normal,
                 fontName="Helvetica-Bold",
@@ -574,7 +552,7 @@ def generar_pdf(factura):
                 textColor=colors.whitesmoke,
                 alignment=1
             ))],
-            [Paragraph(oc_num, ParagraphStyle(
+            [Paragraph(oc_num, estilo_parrafo(
                 name="ValueOC",
                 parent=normal,
                 fontName="Helvetica",
@@ -583,7 +561,7 @@ def generar_pdf(factura):
                 alignment=1
             ))]
         ], colWidths=[140])
-        oc_tbl.setStyle(TableStyle([
+        oc_tbl.setStyle(estilo_tabla([
             ("BACKGROUND",    (0, 0), (-1, 0), bg_color),
             ("BOX",           (0, 0), (-1, -1), 1, colors.black),
             ("TEXTCOLOR",     (0, 0), (-1, 0), colors.whitesmoke),
@@ -608,7 +586,7 @@ def generar_pdf(factura):
             [Paragraph("Total a Pagar:",   label_style), total],
         ]
         tot_tbl = Table(totales_data, colWidths=[100, 100])
-        tot_tbl.setStyle(TableStyle([
+        tot_tbl.setStyle(estilo_tabla([
             ("BOX",           (0, 0), (-1, -1), 1, colors.black),
             ("VALIGN",        (0, 0), (-1, -1), "MIDDLE"),
             ("LEFTPADDING",   (0, 0), (-1, -1), 2),
@@ -627,7 +605,7 @@ def generar_pdf(factura):
             [[qr_image, "", oc_tbl, tot_tbl]],
             colWidths=[qr_width, spacer_width, oc_width, tot_width]
         )
-        combo.setStyle(TableStyle([
+        combo.setStyle(estilo_tabla([
             ("VALIGN",       (0, 0), (-1, -1), "TOP"),
             ("ALIGN",        (0, 0), (0, 0),   "LEFT"),
             ("ALIGN",        (1, 0), (1, 0),   "CENTER"),
@@ -647,7 +625,7 @@ def generar_pdf(factura):
 
         # **Estilos**
         normal_style = styles["Normal"]
-        negrita_titulos = ParagraphStyle(
+        negrita_titulos = estilo_parrafo(
             name="Negrita7",
             parent=normal_style,
             fontName="Helvetica-Bold",
@@ -655,7 +633,7 @@ def generar_pdf(factura):
             textColor=colors.whitesmoke,
             alignment=1
         )
-        valor_style = ParagraphStyle(
+        valor_style = estilo_parrafo(
             name="ValorCUFE",
             parent=normal_style,
             fontName="Helvetica",
@@ -672,7 +650,7 @@ def generar_pdf(factura):
 
         # **Construcción de la tabla**
         sector_table = Table(sector_data, colWidths=[560])  # 1 sola columna de ancho completa
-        sector_table.setStyle(TableStyle([
+        sector_table.setStyle(estilo_tabla([
             # Cabecera con fondo dinámico y texto blanco
             ("BACKGROUND",    (0, 0), (-1, 0), color_fondo),
             ("TEXTCOLOR",     (0, 0), (-1, 0), colors.whitesmoke),
@@ -700,7 +678,7 @@ def generar_pdf(factura):
     def agregar_obs_documento():
         normal_style = styles["Normal"]
 
-        negrita_titulos = ParagraphStyle(
+        negrita_titulos = estilo_parrafo(
             name="Negrita7",
             parent=normal_style,
             fontName="Helvetica-Bold",
@@ -711,7 +689,7 @@ def generar_pdf(factura):
         texto_obs = factura["otros"].get("informacion_adicional", "")
         
         # 👉 Estilo del contenido largo
-        estilo_contenido = ParagraphStyle(
+        estilo_contenido = estilo_parrafo(
             name="ContenidoObservaciones",
             parent=normal_style,
             fontName="Helvetica",
@@ -726,7 +704,7 @@ def generar_pdf(factura):
         ]
 
         obs_table = Table(obs_data, colWidths=[100, 180, 100, 180])
-        obs_table.setStyle(TableStyle([
+        obs_table.setStyle(estilo_tabla([
             ('SPAN', (0, 0), (-1, 0)),  # Encabezado
             ('SPAN', (0, 1), (-1, 1)),  # 👈 También fusionamos toda la fila del contenido
             ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
@@ -746,8 +724,8 @@ def generar_pdf(factura):
     agregar_encabezado()
     agregar_info_cliente()
     
-    styles = getSampleStyleSheet()
-    descripcion_style = ParagraphStyle(
+    styles = hoja_estilos()
+    descripcion_style = estilo_parrafo(
         name="DescripcionDetalleFactura",
         parent=styles["Normal"],
         fontName="Helvetica",
@@ -763,7 +741,7 @@ def generar_pdf(factura):
         # solo si pedimos encabezado solo en primera y estamos en página >1
         if solo_primera and page_number > 1:
             # estilo para el encabezado
-            header_style = ParagraphStyle(
+            header_style = estilo_parrafo(
                 name="HeaderDetalle",
                 parent=styles["Normal"],
                 fontName="Helvetica-Bold",
@@ -776,7 +754,7 @@ def generar_pdf(factura):
             ]]
             # ancho total de la tabla de detalle: 25+180+40+40+75+50+75+75 = 560
             header_tbl = Table(encabezado_data, colWidths=[400, 160])
-            header_tbl.setStyle(TableStyle([
+            header_tbl.setStyle(estilo_tabla([
                 ("BOX",           (0, 0), (-1, -1), 1, colors.black),
                 ("BACKGROUND",    (0, 0), (-1, -1), colors.whitesmoke),
                 ("TEXTCOLOR",     (0, 0), (-1, -1), colors.black),
@@ -791,7 +769,7 @@ def generar_pdf(factura):
             [["#", "Descripción", "U. Med", "Cantidad", "Valor Unitario", "% Imp.", "Descuento", "Total"]] + buffer_filas,
             colWidths=[25, 180, 40, 40, 75, 50, 75, 75]
         )
-        tabla.setStyle(TableStyle([
+        tabla.setStyle(estilo_tabla([
             ('BACKGROUND', (0, 0), (-1, 0), color_fondo),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
             ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
@@ -871,21 +849,26 @@ def generar_pdf(factura):
     if texto_obs and texto_obs.strip():
         agregar_obs_documento()
         
-    def paginas_basico(canvas, doc):
+    def contenido_basico(canvas, doc):
         agregar_marca_agua(canvas, factura)
         agregar_pie_pagina(canvas, doc, factura)
         agregar_autorretenedores(canvas, doc, factura)
 
-    pdf.build(
-        elements,
-        onFirstPage=lambda canvas, doc: primera_pagina(canvas, doc, factura),
-        onLaterPages=lambda canvas, doc: (
-            paginas_basico(canvas, doc)
-            if solo_primera
-            else paginas_siguientes(canvas, doc, factura)
-        ),
-        canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs)
-    )
+    def paginas_basico(canvas, doc):
+        usar_form(canvas, "contenido_basico", lambda c: contenido_basico(c, doc))
+
+    # Layout y dibujo de las páginas (la escritura del archivo la mide CanvasPaginado.save)
+    with medir_etapa("build"):
+        pdf.build(
+            elements,
+            onFirstPage=lambda canvas, doc: primera_pagina(canvas, doc, factura),
+            onLaterPages=lambda canvas, doc: (
+                paginas_basico(canvas, doc)
+                if solo_primera
+                else paginas_siguientes(canvas, doc, factura)
+            ),
+            canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs)
+        )
     buffer.seek(0)
     pdf_bytes = buffer.getvalue()
     hoy = datetime.now()
@@ -910,30 +893,3 @@ def generar_pdf(factura):
         "key": key,
         "filename": pdf_filename,
     }
-    
-def _sync_upload(pdf_bytes: bytes, bucket: str, key: str):
-    print(f"[sync_upload] subiendo {len(pdf_bytes)} bytes a s3://{bucket}/{key}")
-    try:
-        buf = BytesIO(pdf_bytes)
-        s3_client.upload_fileobj(
-            buf,
-            bucket,
-            key,
-            ExtraArgs={
-                "ContentType": "application/pdf",
-                "ContentDisposition": "inline",
-            },
-        )
-        print(f"[sync_upload] ¡Subida completada! s3://{bucket}/{key}")
-    except Exception as e:
-        print(f"[sync_upload] ERROR al subir: {e}")
-        raise
-
-async def upload_pdf_to_s3(pdf_bytes: bytes, bucket: str, key: str):
-    """
-    Versión async de upload_pdf_to_s3: delega el trabajo pesado
-    al thread-pool internamente, liberando el event-loop.
-    """
-    print(f"[upload_pdf_to_s3] llamada recibida para {bucket}/{key}")
-    await run_in_threadpool(_sync_upload, pdf_bytes, bucket, key)
-    print(f"[upload_pdf_to_s3] función async finalizada para {bucket}/{key}")
\ No newline at end of file
@@ -1,26 +1,30 @@
 from datetime import datetime
 from urllib.parse import urlparse
 from reportlab.lib import pagesizes, colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Image
 from reportlab.lib.colors import Color
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas as canvas_module
+from functools import lru_cache
 from io import BytesIO
-from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from app.services.qr_generator import generar_qr
-import boto3
+from app.services.qr_generator import CodigoQR
+from app.services.pdf_styles import hoja_estilos, estilo_parrafo, estilo_tabla
+from app.services.image_cache import cache_imagenes, ImagenLogo
+from app.services.pdf_forms import usar_form
+from app.services.metrics import medir_etapa
+from app.services.encabezado_cache import clave_emisor, bloque_emisor, fila_encabezado
+from app.services.pdf_streaming import CanvasPaginado
+import logging
 import os
-import base64
 
 # Cargar variables de entorno
 load_dotenv()
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-S3_REGION = os.getenv("S3_REGION")
 
-# Cliente S3
-s3_client = boto3.client("s3", region_name=S3_REGION)
+logger = logging.getLogger("fastapi_app")
+
+# Subir en cada cambio visible del PDF: invalida la cache de render de esta plantilla
+VERSION_PLANTILLA = "3"
+
 
 PAGE_PARAMS = {
     "LETTER": {
@@ -60,6 +64,7 @@ PAGE_PARAMS = {
 # ----------------------------
 # Utilidades
 # ----------------------------
+@lru_cache(maxsize=256)
 def hex_to_rgb_color(hex_string: str) -> Color:
     if not hex_string:
         return colors.HexColor("#044b5b")
@@ -109,7 +114,7 @@ def agregar_autorretenedores(canvas, doc, factura):
                        .get("notas_pie_pagina",
                             "Autorretenedores: Información no disponible.")
 
-    estilo_auto = ParagraphStyle(
+    estilo_auto = estilo_parrafo(
         name="Autorretenedores",
         fontName="Helvetica",
         fontSize=7,
@@ -150,9 +155,7 @@ def agregar_pie_pagina(canvas, doc, factura):
 
     if logo_base64:
         try:
-            logo_data = base64.b64decode(logo_base64)
-            logo_buffer = BytesIO(logo_data)
-            logo_image = ImageReader(logo_buffer)
+            logo_image = cache_imagenes.lector(logo_base64, caja=(79, 20))
 
             logo_width = 79
             logo_height = 20
@@ -162,10 +165,29 @@ def agregar_pie_pagina(canvas, doc, factura):
             canvas.drawImage(logo_image, logo_x, logo_y, width=logo_width, height=logo_height, mask='auto')
 
         except Exception as e:
-            print(f"Error al cargar la imagen del logo: {e}")
+            logger.warning(f"⚠️ Error al cargar la imagen del logo: {e}")
 
     canvas.restoreState()
 
+# Fecha de validación DIAN en lateral izquierdo
+def agregar_fecha_validacion(canvas, doc, factura):
+    canvas.saveState()
+    canvas.setFont("Helvetica-Bold", 7)
+    canvas.setFillColor(colors.grey)
+    _, page_height = doc.pagesize
+    canvas.translate(15, page_height/2)  # centrado vertical aprox.
+    canvas.rotate(90)
+    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
+    canvas.restoreState()
+
+# Contenido fijo de página (igual en todas): se dibuja una vez como form XObject
+def dibujar_contenido_fijo(canvas, doc, factura):
+    agregar_marca_agua(canvas, factura)
+    agregar_direccion_contacto(canvas, doc, factura)
+    agregar_autorretenedores(canvas, doc, factura)
+    agregar_pie_pagina(canvas, doc, factura)
+    agregar_fecha_validacion(canvas, doc, factura)
+
 def primera_pagina(canvas, doc, factura):
 
     titulo_pdf = f"{factura['documento']['identificacion']}@afacturar.com"
@@ -181,20 +203,7 @@ def primera_pagina(canvas, doc, factura):
     canvas.drawRightString(x, y, "Representación gráfica del documento electrónico")
     canvas.restoreState()
 
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
-
-    # Fecha de validación DIAN en lateral izquierdo
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    _, page_height = doc.pagesize
-    canvas.translate(15, page_height/2)  # centrado vertical aprox.
-    canvas.rotate(90)
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
 def paginas_siguientes(canvas, doc, factura):
 
@@ -208,59 +217,25 @@ def paginas_siguientes(canvas, doc, factura):
     canvas.drawRightString(x, y, "Representación gráfica del documento electrónico")
     canvas.restoreState()
 
-    agregar_marca_agua(canvas, factura)
-    agregar_direccion_contacto(canvas, doc, factura)
-    agregar_autorretenedores(canvas, doc, factura)
-    agregar_pie_pagina(canvas, doc, factura)
+    usar_form(canvas, "contenido_fijo", lambda c: dibujar_contenido_fijo(c, doc, factura))
 
-    # Fecha de validación DIAN en lateral izquierdo
-    canvas.saveState()
-    canvas.setFont("Helvetica-Bold", 7)
-    canvas.setFillColor(colors.grey)
-    _, page_height = doc.pagesize
-    canvas.translate(15, page_height/2)  # centrado vertical aprox.
-    canvas.rotate(90)
-    canvas.drawString(0, 0, f"Fecha de validación DIAN: {factura['documento']['fecha_validacion_dian']}")
-    canvas.restoreState()
+class NumberedCanvas(CanvasPaginado):
+    """"Página X de N" con el color del pie; N se escribe al final como form XObject compartido."""
 
-class NumberedCanvas(canvas_module.Canvas):
     def __init__(self, *args, factura=None, **kwargs):
-        super().__init__(*args, **kwargs)
+        color_hex = factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
+        super().__init__(*args, color_texto=hex_to_rgb_color(color_hex), **kwargs)
         self.factura = factura
-        self._saved_page_states = []
-
-    def showPage(self):
-        self._saved_page_states.append(dict(self.__dict__))
-        self._startPage()
-
-    def save(self):
-        total = len(self._saved_page_states)
-        for state in self._saved_page_states:
-            self.__dict__.update(state)
-            self.draw_page_number(total)
-            super().showPage()
-        super().save()
-
-    def draw_page_number(self, total):
-        color_hex = self.factura.get("caracteristicas", {}).get("pie_de_pagina", {}).get("Color_texto", "#000000")
-        color_rgb = hex_to_rgb_color(color_hex)
-
-        self.setFont("Helvetica", 6)
-        self.setFillColor(color_rgb)
-
-        page_width, _ = self._pagesize
-        page_num_text = f"Página {self._pageNumber} de {total}"
-        self.drawRightString(page_width - 28, 30, page_num_text)
 
 # ----------------------------
 # Encabezado y Cliente
 # ----------------------------
 def agregar_encabezado(factura, elements, ancho_disponible):
     """Agrega el encabezado completo con logo grande izquierda, info emisor centro, caja documento derecha (SIN QR)"""
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
 
     # Razón social centrada arriba (negro, tamaño grande)
-    razon_social_style = ParagraphStyle(
+    razon_social_style = estilo_parrafo(
         name="RazonSocialTitle",
         fontName="Helvetica-Bold",
         fontSize=14,
@@ -269,86 +244,77 @@ def agregar_encabezado(factura, elements, ancho_disponible):
         spaceAfter=6
     )
 
-    header_data = [
-        [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
-    ]
-    header_table = Table(header_data, colWidths=[ancho_disponible])
-    header_table.setStyle(TableStyle([
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 12))
+    # Lo que no cambia entre documentos del emisor se mide una vez por proceso y se dibuja como form
+    clave = clave_emisor(factura, "tpl3", ancho_disponible)
 
-    # Información del emisor (centro, negro, labels bold)
-    emisor = factura.get("emisor", {})
+    def construir_razon_social():
+        header_table = Table([
+            [Paragraph(f"<b>{factura['emisor']['razon_social']}</b>", razon_social_style)]
+        ], colWidths=[ancho_disponible])
+        header_table.setStyle(estilo_tabla([
+            ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+        ]))
+        return header_table
 
-    label_style = ParagraphStyle(
-        name="LabelEmisor",
-        parent=styles["Normal"],
-        fontName="Helvetica-Bold",
-        fontSize=8,
-        textColor=colors.black,
-        alignment=0
-    )
-    value_style = ParagraphStyle(
-        name="ValueEmisor",
-        parent=styles["Normal"],
-        fontName="Helvetica",
-        fontSize=8,
-        textColor=colors.black,
-        alignment=0
-    )
+    elements.append(bloque_emisor(clave, construir_razon_social))
+    elements.append(Spacer(1, 12))
 
-    # Construir info_fija solo con campos que tengan datos
-    info_fija = []
+    def construir_celdas_fijas():
+        # Información del emisor (centro, negro, labels bold)
+        emisor = factura.get("emisor", {})
+
+        label_style = estilo_parrafo(
+            name="LabelEmisor",
+            parent=styles["Normal"],
+            fontName="Helvetica-Bold",
+            fontSize=8,
+            textColor=colors.black,
+            alignment=0
+        )
 
-    # NIT siempre se muestra
-    info_fija.append(Paragraph(f"<b>NIT:</b> {emisor.get('documento', 'N/A')}", label_style))
+        # Construir info_fija solo con campos que tengan datos
+        info_fija = []
 
-    # Solo agregar los siguientes campos si tienen valor
-    if emisor.get('actividad_economica'):
-        info_fija.append(Paragraph(f"<b>Actividad Económica:</b> {emisor.get('actividad_economica')}", label_style))
+        # NIT siempre se muestra
+        info_fija.append(Paragraph(f"<b>NIT:</b> {emisor.get('documento', 'N/A')}", label_style))
 
-    if emisor.get('regimen'):
-        info_fija.append(Paragraph(f"<b>Régimen:</b> {emisor.get('regimen')}", label_style))
+        # Solo agregar los siguientes campos si tienen valor
+        if emisor.get('actividad_economica'):
+            info_fija.append(Paragraph(f"<b>Actividad Económica:</b> {emisor.get('actividad_economica')}", label_style))
 
-    if emisor.get('responsable_iva'):
-        info_fija.append(Paragraph(f"<b>Responsable IVA:</b> {emisor.get('responsable_iva')}", label_style))
+        if emisor.get('regimen'):
+            info_fija.append(Paragraph(f"<b>Régimen:</b> {emisor.get('regimen')}", label_style))
 
-    if emisor.get('tarifa_ica'):
-        info_fija.append(Paragraph(f"<b>Tarifa ICA:</b> {emisor.get('tarifa_ica')}", label_style))
+        if emisor.get('responsable_iva'):
+            info_fija.append(Paragraph(f"<b>Responsable IVA:</b> {emisor.get('responsable_iva')}", label_style))
 
-    # Logo del emisor (grande, izquierda)
-    logo_ofe_b64 = factura.get("emisor", {}).get("logo")
-    logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
-    if logo_ofe_b64:
-        try:
-            # Soportar tanto base64 como URL
-            if logo_ofe_b64.startswith("http"):
-                import requests
-                response = requests.get(logo_ofe_b64)
-                logo_buffer = BytesIO(response.content)
-                logo_ofe_img = Image(logo_buffer, width=120, height=80)
-            else:
-                logo_data = base64.b64decode(logo_ofe_b64)
-                # Validar que sea una imagen válida, no un PDF u otro formato
-                if logo_data.startswith(b'%PDF'):
-                    print(f"⚠️ Error: El logo del emisor es un PDF, no una imagen válida")
-                    logo_ofe_img = Spacer(1, 1)
-                else:
-                    logo_buffer = BytesIO(logo_data)
+        if emisor.get('tarifa_ica'):
+            info_fija.append(Paragraph(f"<b>Tarifa ICA:</b> {emisor.get('tarifa_ica')}", label_style))
+
+        # Logo del emisor (grande, izquierda)
+        logo_ofe_b64 = factura.get("emisor", {}).get("logo")
+        logo_ofe_img = Spacer(1, 1)  # Spacer por defecto si no hay logo
+        if logo_ofe_b64:
+            try:
+                # Soportar tanto base64 como URL
+                if logo_ofe_b64.startswith("http"):
+                    import requests
+                    response = requests.get(logo_ofe_b64)
+                    logo_buffer = BytesIO(response.content)
                     logo_ofe_img = Image(logo_buffer, width=120, height=80)
-        except Exception as e:
-            print(f"⚠️ Error al cargar logo_ofe: {e}")
-            logo_ofe_img = Spacer(1, 1)
+                else:
+                    # Decodificado y validado una sola vez por logo (cache por hash del base64)
+                    logo_ofe_img = ImagenLogo(cache_imagenes.lector(logo_ofe_b64, caja=(120, 80)), width=120, height=80)
+            except Exception as e:
+                logger.warning(f"⚠️ Error al cargar logo_ofe: {e}")
+                logo_ofe_img = Spacer(1, 1)
+        return {0: [logo_ofe_img], 1: info_fija}
 
     # QR Code (centro)
-    qr_code = generar_qr(factura['documento']['qr'])
-    qr_buffer = BytesIO(qr_code.getvalue())
-    qr_image = Image(qr_buffer, width=80, height=80)
+    qr_image = CodigoQR(factura['documento']['qr'], width=80, height=80)
 
     # Caja de documento (derecha, 2 filas: título + identificación)
-    doc_title_style = ParagraphStyle(
+    doc_title_style = estilo_parrafo(
         name="DocTitle",
         parent=styles["Normal"],
         fontName="Helvetica-Bold",
@@ -356,7 +322,7 @@ def agregar_encabezado(factura, elements, ancho_disponible):
         textColor=colors.black,
         alignment=1
     )
-    doc_id_style = ParagraphStyle(
+    doc_id_style = estilo_parrafo(
         name="DocId",
         parent=styles["Normal"],
         fontName="Helvetica-Bold",
@@ -369,7 +335,7 @@ def agregar_encabezado(factura, elements, ancho_disponible):
         [Paragraph(f"<b>{factura['documento']['titulo_tipo_documento']}</b>", doc_title_style)],
         [Paragraph(f"<b>{factura['documento']['identificacion']}</b>", doc_id_style)]
     ], colWidths=[130])
-    factura_info.setStyle(TableStyle([
+    factura_info.setStyle(estilo_tabla([
         ("BOX", (0, 0), (-1, -1), 1, colors.black),
         ("ALIGN", (0, 0), (-1, -1), "CENTER"),
         ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
@@ -383,28 +349,30 @@ def agregar_encabezado(factura, elements, ancho_disponible):
     col_doc = 140
     col_info = ancho_disponible - col_logo - col_qr - col_doc
 
-    header_row = Table([
-        [[logo_ofe_img], info_fija, qr_image, factura_info]
-    ], colWidths=[col_logo, col_info, col_qr, col_doc])
-
-    header_row.setStyle(TableStyle([
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("ALIGN", (0, 0), (0, 0), "LEFT"),    # logo izquierda
-        ("ALIGN", (1, 0), (1, 0), "LEFT"),    # info izquierda
-        ("ALIGN", (2, 0), (2, 0), "CENTER"),  # QR centro
-        ("ALIGN", (3, 0), (3, 0), "RIGHT"),   # doc derecha
-    ]))
+    header_row = fila_encabezado(
+        clave,
+        [None, None, qr_image, factura_info],
+        construir_celdas_fijas,
+        colWidths=[col_logo, col_info, col_qr, col_doc],
+        estilo=[
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+            ("ALIGN", (0, 0), (0, 0), "LEFT"),    # logo izquierda
+            ("ALIGN", (1, 0), (1, 0), "LEFT"),    # info izquierda
+            ("ALIGN", (2, 0), (2, 0), "CENTER"),  # QR centro
+            ("ALIGN", (3, 0), (3, 0), "RIGHT"),   # doc derecha
+        ],
+    )
 
     elements.append(header_row)
     elements.append(Spacer(1, 12))
 
 def agregar_info_trabajador(factura, elements, ancho_disponible):
     """Agrega la información del trabajador con título negro y tabla 4 columnas"""
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
     normal = styles["Normal"]
 
     # Estilos
-    label_style = ParagraphStyle(
+    label_style = estilo_parrafo(
         name="LabelTrabajador",
         parent=normal,
         fontName="Helvetica",
@@ -414,7 +382,7 @@ def agregar_info_trabajador(factura, elements, ancho_disponible):
         alignment=0
     )
 
-    value_style = ParagraphStyle(
+    value_style = estilo_parrafo(
         name="ValueTrabajador",
         parent=normal,
         fontName="Helvetica-Bold",
@@ -424,7 +392,7 @@ def agregar_info_trabajador(factura, elements, ancho_disponible):
         alignment=0
     )
 
-    titulo_style = ParagraphStyle(
+    titulo_style = estilo_parrafo(
         name="TituloTrabajador",
         parent=normal,
         fontName="Helvetica-Bold",
@@ -435,7 +403,7 @@ def agregar_info_trabajador(factura, elements, ancho_disponible):
 
     # Título gris oscuro
     titulo = Table([[Paragraph("Información del trabajador", titulo_style)]], colWidths=[ancho_disponible])
-    titulo.setStyle(TableStyle([
+    titulo.setStyle(estilo_tabla([
         ("BACKGROUND",   (0, 0), (-1, -1), colors.HexColor("#333333")),
         ("TEXTCOLOR",    (0, 0), (-1, -1), colors.whitesmoke),
         ("ALIGN",        (0, 0), (-1, -1), "CENTER"),
@@ -484,7 +452,7 @@ def agregar_info_trabajador(factura, elements, ancho_disponible):
     ]
 
     tabla = Table(data, colWidths=[col1_label, col2_value, col3_label, col4_value])
-    tabla.setStyle(TableStyle([
+    tabla.setStyle(estilo_tabla([
         ("BOX",         (0, 0), (-1, -1), 1, colors.black),
         ("GRID",        (0, 0), (-1, -1), 0.5, colors.grey),
         ("VALIGN",      (0, 0), (-1, -1), "MIDDLE"),
@@ -502,10 +470,10 @@ def agregar_info_trabajador(factura, elements, ancho_disponible):
 
 def agregar_periodo_pago(factura, elements, ancho_disponible):
     """Agrega la sección Periodo de pago con título negro y tabla 2 columnas"""
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
     normal = styles["Normal"]
 
-    titulo_style = ParagraphStyle(
+    titulo_style = estilo_parrafo(
         name="TituloPeriodo",
         parent=normal,
         fontName="Helvetica-Bold",
@@ -514,7 +482,7 @@ def agregar_periodo_pago(factura, elements, ancho_disponible):
         alignment=1
     )
 
-    label_style = ParagraphStyle(
+    label_style = estilo_parrafo(
         name="LabelPeriodo",
         parent=normal,
         fontName="Helvetica",
@@ -523,7 +491,7 @@ def agregar_periodo_pago(factura, elements, ancho_disponible):
         alignment=0
     )
 
-    value_style = ParagraphStyle(
+    value_style = estilo_parrafo(
         name="ValuePeriodo",
         parent=normal,
         fontName="Helvetica-Bold",
@@ -534,7 +502,7 @@ def agregar_periodo_pago(factura, elements, ancho_disponible):
 
     # Título gris oscuro
     titulo = Table([[Paragraph("Periodo de pago", titulo_style)]], colWidths=[ancho_disponible])
-    titulo.setStyle(TableStyle([
+    titulo.setStyle(estilo_tabla([
         ("BACKGROUND",   (0, 0), (-1, -1), colors.HexColor("#333333")),
         ("TEXTCOLOR",    (0, 0), (-1, -1), colors.whitesmoke),
         ("ALIGN",        (0, 0), (-1, -1), "CENTER"),
@@ -567,7 +535,7 @@ def agregar_periodo_pago(factura, elements, ancho_disponible):
     col4_value = ancho_disponible - col1_label - col2_value - col3_label
 
     tabla = Table(data, colWidths=[col1_label, col2_value, col3_label, col4_value])
-    tabla.setStyle(TableStyle([
+    tabla.setStyle(estilo_tabla([
         ("BOX",         (0, 0), (-1, -1), 1, colors.black),
         ("GRID",        (0, 0), (-1, -1), 0.5, colors.grey),
         ("VALIGN",      (0, 0), (-1, -1), "MIDDLE"),
@@ -584,7 +552,7 @@ def agregar_periodo_pago(factura, elements, ancho_disponible):
 # Secciones
 # ----------------------------
 def seccion_datos_liquidacion(factura, elements, header_color):
-    titulo_style = ParagraphStyle(
+    titulo_style = estilo_parrafo(
         "titulo", fontSize=9, textColor=colors.whitesmoke, alignment=1, fontName="Helvetica-Bold"
     )
     data = [
@@ -595,7 +563,7 @@ def seccion_datos_liquidacion(factura, elements, header_color):
         [f"Fecha liquidación: {factura['documento'].get('fecha','')}"]
     ]
     tbl = Table(data, colWidths=[500])
-    tbl.setStyle(TableStyle([
+    tbl.setStyle(estilo_tabla([
         ("BACKGROUND", (0, 0), (-1, 0), header_color),
         ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
         ("BOX", (0, 0), (-1, -1), 1, colors.black),
@@ -617,7 +585,7 @@ def seccion_trabajador(factura, elements, header_color):
             break
     dias = factura["otros"].get("variable_3", "")
 
-    titulo_style = ParagraphStyle(
+    titulo_style = estilo_parrafo(
         "titulo", fontSize=9, textColor=colors.whitesmoke, alignment=1, fontName="Helvetica-Bold"
     )
     data = [
@@ -627,7 +595,7 @@ def seccion_trabajador(factura, elements, header_color):
         [f"{dias}"],
     ]
     tbl = Table(data, colWidths=[500])
-    tbl.setStyle(TableStyle([
+    tbl.setStyle(estilo_tabla([
         ("BACKGROUND", (0, 0), (-1, 0), header_color),
         ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
         ("BOX", (0, 0), (-1, -1), 1, colors.black),
@@ -642,14 +610,14 @@ def seccion_trabajador(factura, elements, header_color):
 
 def tabla_detalle(titulo, items, total, header_color, ancho_disponible):
     """Tabla de devengos o deducciones con 3 columnas: Tipo, Valor, Observación"""
-    styles = getSampleStyleSheet()
+    styles = hoja_estilos()
 
-    titulo_style = ParagraphStyle(
+    titulo_style = estilo_parrafo(
         "titulo", fontSize=9, textColor=colors.whitesmoke, alignment=1, fontName="Helvetica-Bold"
     )
 
     # Estilo para observación con wrap automático
-    observacion_style = ParagraphStyle(
+    observacion_style = estilo_parrafo(
         "observacion",
         parent=styles["Normal"],
         fontSize=8,
@@ -677,7 +645,7 @@ def tabla_detalle(titulo, items, total, header_color, ancho_disponible):
         ])
 
     # Fila total
-    total_style = ParagraphStyle(
+    total_style = estilo_parrafo(
         "total", fontSize=8, fontName="Helvetica-Bold", alignment=0
     )
     data.append([
@@ -692,7 +660,7 @@ def tabla_detalle(titulo, items, total, header_color, ancho_disponible):
     col_obs = ancho_disponible - col_tipo - col_valor
 
     tbl = Table(data, colWidths=[col_tipo, col_valor, col_obs])
-    tbl.setStyle(TableStyle([
+    tbl.setStyle(estilo_tabla([
         # Encabezado: color + SPAN y centrado
         ("BACKGROUND", (0, 0), (-1, 0), header_color),
         ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
@@ -719,10 +687,10 @@ def seccion_neto(factura, elements, header_color, ancho_disponible):
     neto = factura.get("valor_nomina", {}).get("valor_total_pago", "0")
     data = [[Paragraph(
         f"<b>Neto a pagar: ${float(neto):,.0f}</b>",
-        ParagraphStyle("titulo", fontSize=9, textColor=colors.whitesmoke, alignment=1, fontName="Helvetica-Bold")
+        estilo_parrafo("titulo", fontSize=9, textColor=colors.whitesmoke, alignment=1, fontName="Helvetica-Bold")
     )]]
     tbl = Table(data, colWidths=[ancho_disponible])
-    tbl.setStyle(TableStyle([
+    tbl.setStyle(estilo_tabla([
         ("BACKGROUND", (0, 0), (-1, 0), header_color),
         ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
         ("BOX", (0, 0), (-1, -1), 1, colors.black),
@@ -795,12 +763,14 @@ def generar_pdf(factura):
     # 6. Neto a pagar (barra azul/teal)
     seccion_neto(factura, elements, color_neto, ancho_disponible)
 
-    pdf.build(
-        elements,
-        onFirstPage=lambda c, d: primera_pagina(c, d, factura),
-        onLaterPages=lambda c, d: paginas_siguientes(c, d, factura),
-        canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs),
-    )
+    # Layout y dibujo de las páginas (la escritura del archivo la mide CanvasPaginado.save)
+    with medir_etapa("build"):
+        pdf.build(
+            elements,
+            onFirstPage=lambda c, d: primera_pagina(c, d, factura),
+            onLaterPages=lambda c, d: paginas_siguientes(c, d, factura),
+            canvasmaker=lambda *args, **kwargs: NumberedCanvas(*args, factura=factura, **kwargs),
+        )
 
     buffer.seek(0)
     pdf_bytes = buffer.getvalue()
@@ -821,24 +791,3 @@ def generar_pdf(factura):
         )
 
     return {"pdf_bytes": pdf_bytes, "bucket": bucket_name, "key": key, "filename": pdf_filename}
-
-# ----------------------------
-# Subida a S3
-# ----------------------------
-def _sync_upload(pdf_bytes: bytes, bucket: str, key: str):
-    print(f"[sync_upload] subiendo {len(pdf_bytes)} bytes a s3://{bucket}/{key}")
-    try:
-        buf = BytesIO(pdf_bytes)
-        s3_client.upload_fileobj(
-            buf, bucket, key,
-            ExtraArgs={"ContentType": "application/pdf", "ContentDisposition": "inline"},
-        )
-        print(f"[sync_upload] ¡Subida completada! s3://{bucket}/{key}")
-    except Exception as e:
-        print(f"[sync_upload] ERROR al subir: {e}")
-        raise
-
-async def upload_pdf_to_s3(pdf_bytes: bytes, bucket: str, key: str):
-    print(f"[upload_pdf_to_s3] llamada recibida para {bucket}/{key}")
-    await run_in_threadpool(_sync_upload, pdf_bytes, bucket, key)
-    print(f"[upload_pdf_to_s3] función async finalizada para {bucket}/{key}")
@@ -0,0 +1,138 @@
+# app/services/perfilado.py
+#
+# Perfilado bajo demanda de un render puntual (header X-Profile-Token o
+# query ?perfil=<token> en /generar_pdf/). Corre dentro del worker de render:
+# cProfile para el .pstats (snakeviz, pstats) y, a la vez, un hilo que
+# muestrea la pila del render para el .collapsed (flamegraph.pl, speedscope).
+# Las muestras ven los tiempos inflados por cProfile igual que el .pstats:
+# sirven para proporciones, no para latencias absolutas.
+#
+# Sin el header/query el render no pasa por aquí: costo cero.
+
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from app.config import Config
+
+
+def token_perfil(request):
+    """
+    True si la petición pide perfilado con el token correcto, False si no lo
+    pide; PermissionError si lo pide con un token inválido o el perfilado
+    está desactivado (PROFILE_TOKEN vacío).
+    """
+    token = request.headers.get("x-profile-token") or request.query_params.get("perfil")
+    if token is None:
+        return False
+    if not Config.PROFILE_TOKEN or not hmac.compare_digest(token, Config.PROFILE_TOKEN):
+        raise PermissionError("Token de perfilado inválido")
+    return True
+
+
+_prefijos = None
+
+
+def _etiqueta(code):
+    global _prefijos
+    if _prefijos is None:
+        _prefijos = sorted({os.path.join(p, "") for p in sys.path if p}, key=len, reverse=True)
+    archivo = code.co_filename
+    for prefijo in _prefijos:
+        if archivo.startswith(prefijo):
+            archivo = archivo[len(prefijo):]
+            break
+    return f"{code.co_name} ({archivo}:{code.co_firstlineno})".replace(";", ",")
+
+
+def pila_colapsada(frame):
+    """Pila de `frame` en formato colapsado ("raíz;...;hoja"), con rutas relativas a sys.path."""
+    marcos = []
+    while frame is not None:
+        marcos.append(_etiqueta(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(marcos))
+
+
+class Muestreador(threading.Thread):
+    """Cuenta las pilas de un hilo cada `intervalo` segundos."""
+
+    def __init__(self, id_hilo, intervalo):
+        super().__init__(name="muestreador-perfil", daemon=True)
+        self.id_hilo = id_hilo
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.wait(self.intervalo):
+            frame = sys._current_frames().get(self.id_hilo)
+            if frame is not None:
+                self.pilas[pila_colapsada(frame)] += 1
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+
+def perfilar_render(fn, factura, directorio, intervalo, max_perfiles, en_worker=False):
+    """
+    Ejecuta fn(factura) perfilado y deja <base>.pstats y <base>.collapsed en
+    `directorio`, conservando solo los `max_perfiles` más recientes; la base
+    lleva plantilla, cantidad de detalles y páginas. Devuelve el resultado de
+    fn con result["perfil"] = base.
+    """
+    # Con el intervalo de cambio de hilo por defecto (5 ms) el muestreador
+    # casi no consigue el GIL mientras el render corre. El intervalo es de
+    # todo el proceso: solo se toca en un worker del pool, donde no hay otras
+    # peticiones; en modo inline el .collapsed tiene menos muestras
+    intervalo_gil = sys.getswitchinterval()
+    if en_worker:
+        sys.setswitchinterval(min(intervalo_gil, intervalo))
+    muestreador = Muestreador(threading.get_ident(), intervalo)
+    perfil = cProfile.Profile()
+    muestreador.start()
+    try:
+        perfil.enable()
+        try:
+            result = fn(factura)
+        finally:
+            perfil.disable()
+    finally:
+        muestreador.detener()
+        if en_worker:
+            sys.setswitchinterval(intervalo_gil)
+
+    metricas = result.get("metricas") or {}
+    base = "_".join([
+        time.strftime("%Y%m%d_%H%M%S"),
+        f"tpl{metricas.get('plantilla', 'x')}",
+        f"{len(factura.get('detalles') or [])}det",
+        f"{metricas.get('paginas', 0)}pag",
+        uuid.uuid4().hex[:8],
+    ])
+    os.makedirs(directorio, exist_ok=True)
+    perfil.dump_stats(os.path.join(directorio, base + ".pstats"))
+    with open(os.path.join(directorio, base + ".collapsed"), "w", encoding="utf-8") as f:
+        for pila, muestras in muestreador.pilas.most_common():
+            f.write(f"{pila} {muestras}\n")
+    _recortar(directorio, max_perfiles)
+    result["perfil"] = base
+    return result
+
+
+def _recortar(directorio, max_perfiles):
+    """Borra los perfiles más viejos (sus dos archivos) más allá de `max_perfiles`."""
+    # Las bases empiezan por la fecha: el orden alfabético es el cronológico
+    bases = sorted({n.rsplit(".", 1)[0] for n in os.listdir(directorio) if n.endswith((".pstats", ".collapsed"))})
+    for base in bases[:max(0, len(bases) - max_perfiles)]:
+        for extension in (".pstats", ".collapsed"):
+            try:
+                os.remove(os.path.join(directorio, base + extension))
+            except FileNotFoundError:
+                pass  # otro worker lo borró primero
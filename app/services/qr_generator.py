@@ -1,9 +1,68 @@
+import hashlib
+from functools import lru_cache
+
 import qrcode
-from io import BytesIO
-
-def generar_qr(data: str):
-    qr = qrcode.make(data)
-    qr_bytes = BytesIO()
-    qr.save(qr_bytes, format="PNG")
-    qr_bytes.seek(0)
-    return qr_bytes
+from reportlab.lib import colors
+from reportlab.platypus import Flowable
+
+from app.services.pdf_forms import usar_form
+
+
+@lru_cache(maxsize=512)
+def matriz_qr(data: str):
+    """
+    Módulos del QR (mismos parámetros que qrcode.make: corrección M, borde de 4)
+    como (lado, corridas): cada corrida es (columna, fila, largo) de módulos
+    oscuros contiguos en una fila, con el borde incluido en el lado.
+    """
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matriz = qr.get_matrix()
+
+    corridas = []
+    for fila, modulos in enumerate(matriz):
+        inicio = None
+        for columna, oscuro in enumerate(modulos + [False]):
+            if oscuro and inicio is None:
+                inicio = columna
+            elif not oscuro and inicio is not None:
+                corridas.append((inicio, fila, columna - inicio))
+                inicio = None
+    return len(matriz), tuple(corridas)
+
+
+class CodigoQR(Flowable):
+    """
+    QR vectorial: rectángulos sobre fondo blanco, sin pasar por PNG. Se dibuja
+    como form XObject, así que si se repite en varias páginas se emite una vez.
+    """
+
+    def __init__(self, data: str, width=80, height=80):
+        super().__init__()
+        self.data = data
+        self.width = width
+        self.height = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        nombre = "qr_" + hashlib.md5(f"{self.data}|{self.width}|{self.height}".encode("utf-8")).hexdigest()
+        usar_form(self.canv, nombre, self._dibujar)
+
+    def _dibujar(self, canvas):
+        lado, corridas = matriz_qr(self.data)
+        mx = self.width / lado
+        my = self.height / lado
+
+        canvas.saveState()
+        canvas.setFillColor(colors.white)
+        canvas.rect(0, 0, self.width, self.height, stroke=0, fill=1)
+        canvas.setFillColor(colors.black)
+        path = canvas.beginPath()
+        for columna, fila, largo in corridas:
+            # La fila 0 de la matriz es la superior
+            path.rect(columna * mx, (lado - fila - 1) * my, largo * mx, my)
+        canvas.drawPath(path, stroke=0, fill=1)
+        canvas.restoreState()
@@ -0,0 +1,257 @@
+# app/services/render_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+from app.services.pdf_compresion import opciones_compresion
+from app.services.storage import get_s3_client, huella_pdf
+
+logger = logging.getLogger("fastapi_app")
+
+MB = 1024 * 1024
+
+# Campos que no cambian el PDF resultante y no deben partir la cache
+_CAMPOS_SIN_EFECTO = {("caracteristicas", "entrega")}
+
+
+def _ajustes_salida(factura):
+    """
+    Ajustes del despliegue que cambian los bytes del PDF. Van en la clave
+    porque la cache en disco y S3 sobreviven a un reinicio con otra Config.
+    """
+    return {
+        "compresion": opciones_compresion(factura),
+        "logo_dpi": Config.LOGO_DPI,
+        "modo_grande": 0 < Config.LARGE_INVOICE_MIN_DETALLES <= len(factura.get("detalles") or []),
+    }
+
+
+def clave_render(factura, version_plantilla):
+    """sha256 del payload validado en forma canónica + versión de la plantilla + ajustes de salida."""
+    datos = {
+        seccion: (
+            {k: v for k, v in valor.items() if (seccion, k) not in _CAMPOS_SIN_EFECTO}
+            if isinstance(valor, dict) else valor
+        )
+        for seccion, valor in factura.items()
+    }
+    canonico = json.dumps(
+        {"v": version_plantilla, "ajustes": _ajustes_salida(factura), "factura": datos},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class CacheRender:
+    """
+    Cache direccionada por contenido de PDFs ya renderizados.
+
+    - Nivel memoria: LRU acotado por bytes.
+    - Nivel disco: <clave>.pdf + <clave>.json (metadatos), con expulsión de
+      los menos usados recientemente cuando se supera el tamaño máximo.
+    Un acierto en disco se promueve a memoria.
+    """
+
+    def __init__(self, directorio, max_memoria_bytes, max_disco_bytes, ttl_subidos, max_subidos=10000):
+        self.directorio = directorio
+        self.max_memoria = max_memoria_bytes
+        self.max_disco = max_disco_bytes
+        self.max_subidos = max_subidos
+        self.ttl_subidos = ttl_subidos
+        self._memoria = OrderedDict()  # clave -> result
+        self._bytes_memoria = 0
+        self._disco = OrderedDict()  # clave -> tamaño en disco, del más antiguo al más reciente
+        self._bytes_disco = 0
+        self._subidos = OrderedDict()  # (bucket, key) -> (huella, vence) confirmados en S3
+        self._lock = threading.Lock()
+        self._indexado = False
+        self.contadores = {
+            "aciertos_memoria": 0,
+            "aciertos_disco": 0,
+            "fallos": 0,
+            "expulsiones_memoria": 0,
+            "expulsiones_disco": 0,
+            "subidas_omitidas": 0,
+            "coalescidos": 0,  # peticiones que esperaron un render idéntico ya en curso
+        }
+
+    # ---------- Nivel disco ----------
+
+    def _rutas(self, clave):
+        base = os.path.join(self.directorio, clave)
+        return base + ".pdf", base + ".json"
+
+    def _indexar_disco(self):
+        """Reconstruye el índice LRU del disco a partir de los archivos existentes (por fecha de uso)."""
+        if self._indexado:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(".pdf"):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            entradas.append((st.st_mtime, nombre[:-4], st.st_size))
+        with self._lock:
+            for _, clave, tamano in sorted(entradas):
+                if clave not in self._disco:
+                    self._disco[clave] = tamano
+                    self._bytes_disco += tamano
+            self._indexado = True
+
+    def _leer_disco(self, clave):
+        ruta_pdf, ruta_meta = self._rutas(clave)
+        try:
+            with open(ruta_meta, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(ruta_pdf, "rb") as f:
+                pdf_bytes = f.read()
+            os.utime(ruta_pdf)
+        except (FileNotFoundError, ValueError):
+            return None
+        with self._lock:
+            if clave in self._disco:
+                self._disco.move_to_end(clave)
+        return {**meta, "pdf_bytes": pdf_bytes}
+
+    def _escribir_disco(self, clave, result):
+        self._indexar_disco()
+        ruta_pdf, ruta_meta = self._rutas(clave)
+        meta = {k: v for k, v in result.items() if k != "pdf_bytes"}
+        # Primero el PDF y luego los metadatos: sin .json la entrada no existe
+        for ruta, contenido, modo in (
+            (ruta_pdf, result["pdf_bytes"], "wb"),
+            (ruta_meta, json.dumps(meta, ensure_ascii=False, default=str), "w"),
+        ):
+            temporal = f"{ruta}.{os.getpid()}.tmp"
+            with open(temporal, modo) as f:
+                f.write(contenido)
+            os.replace(temporal, ruta)
+
+        tamano = len(result["pdf_bytes"])
+        expulsadas = []
+        with self._lock:
+            self._bytes_disco += tamano - self._disco.pop(clave, 0)
+            self._disco[clave] = tamano
+            while self._bytes_disco > self.max_disco and len(self._disco) > 1:
+                vieja, tam_vieja = self._disco.popitem(last=False)
+                self._bytes_disco -= tam_vieja
+                expulsadas.append(vieja)
+            self.contadores["expulsiones_disco"] += len(expulsadas)
+        for vieja in expulsadas:
+            for ruta in self._rutas(vieja):
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+
+    # ---------- Nivel memoria ----------
+
+    def _guardar_memoria(self, clave, result):
+        tamano = len(result["pdf_bytes"])
+        if tamano > self.max_memoria:
+            return
+        with self._lock:
+            anterior = self._memoria.pop(clave, None)
+            if anterior is not None:
+                self._bytes_memoria -= len(anterior["pdf_bytes"])
+            self._memoria[clave] = result
+            self._bytes_memoria += tamano
+            while self._bytes_memoria > self.max_memoria:
+                _, viejo = self._memoria.popitem(last=False)
+                self._bytes_memoria -= len(viejo["pdf_bytes"])
+                self.contadores["expulsiones_memoria"] += 1
+
+    # ---------- API ----------
+
+    async def obtener(self, clave):
+        """Devuelve una copia del result cacheado (con "desde_cache": True) o None."""
+        with self._lock:
+            result = self._memoria.get(clave)
+            if result is not None:
+                self._memoria.move_to_end(clave)
+                self.contadores["aciertos_memoria"] += 1
+                return {**result, "desde_cache": True}
+
+        if self.max_disco and not self._indexado:
+            await run_in_threadpool(self._indexar_disco)
+        with self._lock:
+            en_disco = clave in self._disco
+
+        if self.max_disco and en_disco:
+            result = await run_in_threadpool(self._leer_disco, clave)
+            if result is not None:
+                self.contadores["aciertos_disco"] += 1
+                self._guardar_memoria(clave, result)
+                return {**result, "desde_cache": True}
+
+        self.contadores["fallos"] += 1
+        return None
+
+    async def guardar(self, clave, result):
+        self._guardar_memoria(clave, result)
+        if self.max_disco:
+            try:
+                await run_in_threadpool(self._escribir_disco, clave, result)
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo escribir la cache de render en disco: {e}")
+
+    async def ya_subido(self, bucket, key, pdf_bytes):
+        """
+        True si en S3 ya está este mismo PDF: el objeto existe y su metadato
+        sha256 coincide (otro payload puede haber escrito la misma key). La
+        confirmación se recuerda TTL segundos; pasado ese tiempo se vuelve a
+        consultar, por si el objeto se borró (lifecycle, a mano).
+        """
+        huella = huella_pdf(pdf_bytes)
+        with self._lock:
+            recordado = self._subidos.get((bucket, key))
+            if recordado is not None and recordado[0] == huella and recordado[1] > time.monotonic():
+                self._subidos.move_to_end((bucket, key))
+                self.contadores["subidas_omitidas"] += 1
+                return True
+        try:
+            cabecera = await run_in_threadpool(get_s3_client().head_object, Bucket=bucket, Key=key)
+        except ClientError:
+            return False
+        if cabecera.get("Metadata", {}).get("sha256") != huella:
+            return False
+        with self._lock:
+            self._subidos[(bucket, key)] = (huella, time.monotonic() + self.ttl_subidos)
+            self._subidos.move_to_end((bucket, key))
+            while len(self._subidos) > self.max_subidos:
+                self._subidos.popitem(last=False)
+            self.contadores["subidas_omitidas"] += 1
+        return True
+
+    def estado(self):
+        with self._lock:
+            return {
+                **self.contadores,
+                "memoria": {"entradas": len(self._memoria), "bytes": self._bytes_memoria, "max_bytes": self.max_memoria},
+                "disco": {"entradas": len(self._disco), "bytes": self._bytes_disco, "max_bytes": self.max_disco},
+            }
+
+
+cache_render = CacheRender(
+    directorio=Config.RENDER_CACHE_DIR,
+    max_memoria_bytes=Config.RENDER_CACHE_MEMORY_MB * MB,
+    max_disco_bytes=Config.RENDER_CACHE_DISK_MB * MB,
+    ttl_subidos=Config.RENDER_CACHE_UPLOADED_TTL_SECONDS,
+)
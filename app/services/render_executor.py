@@ -0,0 +1,185 @@
+# app/services/render_executor.py
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+
+# Mismo logger de la app, sin importar logging_config: los workers no deben abrir app.log
+logger = logging.getLogger("fastapi_app")
+
+
+class RenderTimeoutError(TimeoutError):
+    """El render superó el tiempo máximo permitido por job."""
+
+
+def _inicializar_worker(modulos):
+    """
+    Se ejecuta una vez al arrancar cada proceso: importa las plantillas
+    (ReportLab, fuentes, qrcode) para que el primer job no pague el import.
+    """
+    for modulo in modulos:
+        importlib.import_module(modulo)
+
+
+def _calentar():
+    return os.getpid()
+
+
+def _on_alarm(signum, frame):
+    raise RenderTimeoutError("El render excedió el tiempo máximo permitido")
+
+
+def _ejecutar_con_limite(timeout, fn, *args):
+    """
+    Corre dentro del worker. Usa SIGALRM para cortar el render en el propio
+    proceso y dejar el worker libre para el siguiente job.
+    """
+    if timeout:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class RenderExecutor:
+    """
+    Pool de procesos precalentados para renderizar PDFs fuera del event loop.
+
+    - modo "process": ProcessPoolExecutor (spawn) con reciclaje de workers
+      cada `max_jobs_por_worker` jobs y timeout por job.
+    - modo "inline": renderiza en el mismo proceso (thread-pool), pensado para tests.
+    """
+
+    def __init__(self, modo, workers, timeout, max_jobs_por_worker, precargar=(), timeout_cola=0):
+        self.modo = modo
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.timeout_cola = timeout_cola
+        self.max_jobs_por_worker = max_jobs_por_worker or None
+        self.precargar = tuple(precargar)
+        self._pool = None
+        self._lock_pool = threading.Lock()
+        self.en_curso = 0  # renders enviados y no terminados; por encima de `workers` esperan un worker libre
+        self._libres = None  # Semaphore de workers sin job asignado; se crea en iniciar(), dentro del event loop
+
+    def _crear_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_inicializar_worker,
+            initargs=(self.precargar,),
+            max_tasks_per_child=self.max_jobs_por_worker,
+        )
+
+    async def iniciar(self):
+        """Crea el pool y arranca todos los workers antes de recibir tráfico."""
+        if self.modo != "process" or self._pool is not None:
+            return
+        self._pool = self._crear_pool()
+        self._libres = asyncio.Semaphore(self.workers)
+        futuros = [self._pool.submit(_calentar) for _ in range(self.workers)]
+        await asyncio.gather(*(asyncio.wrap_future(f) for f in futuros))
+        logger.info(f"🔥 Pool de render listo: {self.workers} workers precalentados")
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def ejecutar(self, fn, *args):
+        """
+        Ejecuta `fn(*args)` en el pool. `fn` debe ser una función de módulo
+        (picklable). Lanza RenderTimeoutError si supera el timeout.
+        """
+        self.en_curso += 1
+        try:
+            return await self._ejecutar(fn, *args)
+        finally:
+            self.en_curso -= 1
+
+    async def _ejecutar(self, fn, *args):
+        if self._pool is None:
+            return await self._ejecutar_inline(fn, *args)
+
+        # La espera por un worker libre se hace aquí y no en la cola del pool:
+        # así el plazo del render corre desde que un worker lo toma, y un job
+        # que espera demasiado se descarta sin llegar a ocupar un worker.
+        try:
+            await asyncio.wait_for(self._libres.acquire(), timeout=self.timeout_cola or None)
+        except asyncio.TimeoutError:
+            raise RenderTimeoutError("El render esperó demasiado por un worker libre")
+        pool = self._pool
+        try:
+            futuro = pool.submit(_ejecutar_con_limite, self.timeout, fn, *args)
+        except BrokenProcessPool:
+            self._libres.release()
+            self._reiniciar_pool(pool)
+            raise
+        except BaseException:
+            self._libres.release()
+            raise
+        # El worker se libera cuando el job termina de verdad, aunque aquí ya se haya respondido timeout
+        loop = asyncio.get_running_loop()
+        futuro.add_done_callback(lambda _: loop.call_soon_threadsafe(self._libres.release))
+
+        # Margen sobre el timeout del worker: si SIGALRM no llega a cortar
+        # (p. ej. código C bloqueado), el cliente igual recibe respuesta.
+        margen = self.timeout + 5 if self.timeout else None
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout=margen)
+        except asyncio.TimeoutError:
+            futuro.cancel()
+            raise RenderTimeoutError("El render excedió el tiempo máximo permitido")
+        except BrokenProcessPool:
+            self._reiniciar_pool(pool)
+            raise
+
+    async def _ejecutar_inline(self, fn, *args):
+        tarea = run_in_threadpool(fn, *args)
+        try:
+            return await asyncio.wait_for(tarea, timeout=self.timeout or None)
+        except asyncio.TimeoutError:
+            raise RenderTimeoutError("El render excedió el tiempo máximo permitido")
+
+    def estado(self):
+        return {
+            "modo": self.modo if self._pool is not None else "inline",
+            "workers": self.workers,
+            "en_curso": self.en_curso,
+        }
+
+    def _reiniciar_pool(self, pool_roto):
+        """
+        Reemplaza `pool_roto` por uno nuevo. Todos los renders que estaban en
+        el pool roto llegan aquí: solo el primero lo recrea, los demás verían
+        el pool nuevo (quizás ya con jobs de otras peticiones) y no lo tocan.
+        """
+        with self._lock_pool:
+            if self._pool is not pool_roto:
+                return
+            logger.error("💥 Un worker de render murió; se recrea el pool")
+            self._pool = self._crear_pool()
+        pool_roto.shutdown(wait=False, cancel_futures=True)
+
+
+render_executor = RenderExecutor(
+    modo=Config.RENDER_BACKEND,
+    workers=Config.RENDER_WORKERS,
+    timeout=Config.RENDER_TIMEOUT_SECONDS,
+    max_jobs_por_worker=Config.RENDER_MAX_JOBS_PER_WORKER,
+    precargar=("app.services.pdf_generator",),
+    timeout_cola=Config.RENDER_QUEUE_TIMEOUT_SECONDS,
+)
@@ -0,0 +1,189 @@
+# app/services/render_jobs.py
+
+import asyncio
+import inspect
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict
+
+from app.config import Config
+from app.services.pdf_generator import generar_pdf_async
+from app.services.bucket_cache import cache_buckets, subir_pdf
+from app.services.render_cache import cache_render
+from app.services.render_executor import RenderTimeoutError
+from app.services.pdf_streaming import PresupuestoMemoriaExcedidoError
+
+logger = logging.getLogger("fastapi_app")
+
+QUEUED = "queued"
+RENDERING = "rendering"
+UPLOADING = "uploading"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+
+class ColaLlenaError(Exception):
+    """La cola de jobs está llena; el cliente debe reintentar más tarde."""
+
+    def __init__(self, retry_after):
+        super().__init__("Cola de render llena, reintente más tarde")
+        self.retry_after = retry_after
+
+
+class RenderJob:
+    def __init__(self, usuario):
+        self.id = uuid.uuid4().hex
+        self.usuario = usuario
+        self.estado = QUEUED
+        self.creado = time.time()
+        self.actualizado = self.creado
+        self.bucket = None
+        self.key = None
+        self.url = None
+        self.codigo = None
+        self.error = None
+
+    def cambiar_estado(self, estado):
+        self.estado = estado
+        self.actualizado = time.time()
+
+    @property
+    def terminado(self):
+        return self.estado in (UPLOADED, FAILED)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "estado": self.estado,
+            "creado": self.creado,
+            "actualizado": self.actualizado,
+            "url": self.url,
+            "key": self.key,
+            "error": self.error,
+        }
+
+
+class GestorJobs:
+    """
+    Cola acotada de renders asíncronos. `enviar` devuelve el job al instante;
+    N consumidores lo renderizan en el pool de procesos y suben el PDF a S3.
+    """
+
+    def __init__(self, max_cola, consumidores, max_historial):
+        self.max_cola = max_cola
+        self.consumidores = consumidores
+        self.max_historial = max_historial
+        self._cola = None
+        self._tareas = []
+        self._jobs = OrderedDict()
+        self._callbacks = []
+        self._duracion_media = 1.0  # EWMA en segundos, para estimar Retry-After
+
+    def registrar_callback(self, fn):
+        """Registra un hook (sync o async) que recibe el job al terminar."""
+        self._callbacks.append(fn)
+        return fn
+
+    async def iniciar(self):
+        if self._cola is not None:
+            return
+        self._cola = asyncio.Queue(maxsize=self.max_cola)
+        self._tareas = [asyncio.create_task(self._consumir()) for _ in range(self.consumidores)]
+
+    async def cerrar(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        self._cola = None
+
+    def enviar(self, factura, usuario=None):
+        if self._cola is None:
+            raise RuntimeError("El gestor de jobs no está iniciado")
+        job = RenderJob(usuario)
+        try:
+            self._cola.put_nowait((job, factura))
+        except asyncio.QueueFull:
+            raise ColaLlenaError(self._estimar_espera())
+        self._jobs[job.id] = job
+        self._purgar_historial()
+        return job
+
+    def obtener(self, job_id):
+        return self._jobs.get(job_id)
+
+    def en_cola(self):
+        """Jobs encolados que ningún consumidor tomó todavía."""
+        return self._cola.qsize() if self._cola else 0
+
+    def _estimar_espera(self):
+        return max(1, math.ceil(self.en_cola() * self._duracion_media / max(1, self.consumidores)))
+
+    def _purgar_historial(self):
+        # Solo se descartan jobs terminados, los más antiguos primero
+        exceso = len(self._jobs) - self.max_historial
+        if exceso <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.terminado][:exceso]:
+            del self._jobs[job_id]
+
+    async def _consumir(self):
+        while True:
+            job, factura = await self._cola.get()
+            inicio = time.monotonic()
+            try:
+                await self._procesar(job, factura)
+            finally:
+                self._cola.task_done()
+                duracion = time.monotonic() - inicio
+                self._duracion_media = 0.8 * self._duracion_media + 0.2 * duracion
+            await self._notificar(job)
+
+    async def _procesar(self, job, factura):
+        try:
+            job.cambiar_estado(RENDERING)
+            result = await generar_pdf_async(factura)
+            job.bucket, job.key = result["bucket"], result["key"]
+
+            msg = await cache_buckets.validar(job.bucket)
+            if msg:
+                raise ValueError(f"S3 bucket inválido o innaccesible: {msg}")
+
+            job.cambiar_estado(UPLOADING)
+            if not (result.get("desde_cache") and await cache_render.ya_subido(job.bucket, job.key, result["pdf_bytes"])):
+                await subir_pdf(result["pdf_bytes"], job.bucket, job.key)
+            job.url = f"https://{job.bucket}/{job.key}"
+            job.codigo = 200
+            job.cambiar_estado(UPLOADED)
+        except PresupuestoMemoriaExcedidoError as me:
+            self._fallar(job, 503, str(me))
+        except RenderTimeoutError as te:
+            self._fallar(job, 504, str(te))
+        except ValueError as ve:
+            self._fallar(job, 400, str(ve))
+        except Exception as e:
+            logger.error(f"💥 Job {job.id} falló: {e}", exc_info=True)
+            self._fallar(job, 500, f"Error interno al generar el pdf: {e}")
+
+    def _fallar(self, job, codigo, error):
+        job.codigo = codigo
+        job.error = error
+        job.cambiar_estado(FAILED)
+
+    async def _notificar(self, job):
+        for callback in self._callbacks:
+            try:
+                resultado = callback(job)
+                if inspect.isawaitable(resultado):
+                    await resultado
+            except Exception as e:
+                logger.error(f"⚠️ Callback de job {job.id} falló: {e}", exc_info=True)
+
+
+gestor_jobs = GestorJobs(
+    max_cola=Config.JOBS_MAX_QUEUE,
+    consumidores=Config.JOBS_CONSUMERS,
+    max_historial=Config.JOBS_MAX_HISTORY,
+)
@@ -0,0 +1,210 @@
+# app/services/renders_lentos.py
+#
+# Captura automática de renders lentos. En cada worker de render un hilo
+# muestrea a baja frecuencia la pila de los hilos que están renderizando;
+# si el render supera SLOW_RENDER_MS, las muestras vuelven en
+# result["metricas"]["pilas"] y el proceso principal guarda una captura
+# (forma anonimizada del payload, tiempos por etapa, pilas) en un buffer
+# circular en disco: SLOW_RENDER_DIR con a lo sumo SLOW_RENDER_MAX_CAPTURES
+# archivos. Los timeouts se capturan también, sin pilas.
+# Se consultan en GET /monitor/renders_lentos (solo desde localhost).
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+from app.config import Config
+from app.services.perfilado import pila_colapsada
+
+logger = logging.getLogger("fastapi_app")
+
+
+class MuestreadorRenders:
+    """
+    Un hilo por proceso que cada `intervalo` segundos cuenta la pila de los
+    hilos registrados con muestrear(); sin renders en curso solo despierta.
+    """
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._hilos = {}  # id de hilo -> Counter de pilas
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def _iniciar(self):
+        # Perezoso: en el proceso principal con el pool de procesos nunca arranca
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._muestrear, name="muestreador-renders", daemon=True)
+                self._hilo.start()
+
+    def _muestrear(self):
+        while True:
+            time.sleep(self.intervalo)
+            with self._lock:
+                hilos = list(self._hilos.items())
+            if not hilos:
+                continue
+            marcos = sys._current_frames()
+            for id_hilo, pilas in hilos:
+                frame = marcos.get(id_hilo)
+                if frame is not None:
+                    pilas[pila_colapsada(frame)] += 1
+            # No retener los frames del render hasta la próxima muestra
+            marcos = frame = None
+
+    @contextmanager
+    def muestrear(self):
+        """Muestrea el hilo actual mientras dura el bloque; entrega el Counter de pilas."""
+        if self._hilo is None:
+            self._iniciar()
+        pilas = Counter()
+        id_hilo = threading.get_ident()
+        with self._lock:
+            self._hilos[id_hilo] = pilas
+        try:
+            yield pilas
+        finally:
+            with self._lock:
+                self._hilos.pop(id_hilo, None)
+
+
+muestreador_renders = MuestreadorRenders(intervalo=Config.SLOW_RENDER_SAMPLE_MS / 1000)
+
+
+def muestrear_render():
+    """Contexto para generar_pdf: muestrea solo si la captura de renders lentos está activa."""
+    if not Config.SLOW_RENDER_MS:
+        return nullcontext(None)
+    return muestreador_renders.muestrear()
+
+
+# --- Forma anonimizada del payload ---
+
+def _forma(valor):
+    """Textos -> largo, números -> "num"; listas -> cantidad y la forma máxima de sus elementos."""
+    if isinstance(valor, dict):
+        return {k: _forma(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        elementos = None
+        for item in valor:
+            elementos = _combinar(elementos, _forma(item))
+        return {"cantidad": len(valor), "elementos": elementos}
+    if isinstance(valor, bool) or valor is None:
+        return valor
+    if isinstance(valor, (int, float)):
+        return "num"
+    return len(str(valor))
+
+
+def _combinar(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, dict) and isinstance(b, dict):
+        return {k: _combinar(a.get(k), b.get(k)) for k in {**a, **b}}
+    if isinstance(a, int) and isinstance(b, int) and not isinstance(a, bool) and not isinstance(b, bool):
+        return max(a, b)
+    return a
+
+
+def forma_payload(factura):
+    """
+    Lo necesario para reproducir el costo de un render sin datos del emisor
+    ni del receptor: las características tal cual (plantilla, papel, colores,
+    compresión) y del resto solo cantidades y largos máximos de los textos.
+    """
+    forma = {k: _forma(v) for k, v in factura.items() if k != "caracteristicas"}
+    forma["caracteristicas"] = factura.get("caracteristicas")
+    return forma
+
+
+# --- Buffer circular en disco ---
+
+class CapturasLentas:
+    def __init__(self, directorio, max_capturas):
+        self.directorio = directorio
+        self.max_capturas = max_capturas
+
+    def guardar(self, factura, resultado, latencia, metricas=None, pilas=None, pdf_bytes=None):
+        """Escribe una captura y descarta las más viejas; corre en el thread-pool."""
+        metricas = metricas or {}
+        ahora = datetime.now(timezone.utc)
+        captura_id = f"{ahora.strftime('%Y%m%dT%H%M%S%f')}_{uuid.uuid4().hex[:8]}"
+        captura = {
+            "id": captura_id,
+            "fecha": ahora.isoformat(),
+            "resultado": resultado,
+            "plantilla": metricas.get("plantilla", factura.get("caracteristicas", {}).get("plantilla")),
+            "latencia_ms": round(latencia * 1000, 1),
+            "render_ms": round(sum(metricas.get("etapas", {}).values()) * 1000, 1),
+            "etapas_ms": {k: round(v * 1000, 1) for k, v in metricas.get("etapas", {}).items()},
+            "cpu_ms": round(metricas.get("cpu_segundos", 0.0) * 1000, 1),
+            "paginas": metricas.get("paginas"),
+            "detalles": len(factura.get("detalles") or []),
+            "bytes": len(pdf_bytes) if pdf_bytes is not None else None,
+            "intervalo_muestreo_ms": Config.SLOW_RENDER_SAMPLE_MS,
+            "pilas": dict(sorted((pilas or {}).items(), key=lambda p: -p[1])),
+            "forma": forma_payload(factura),
+        }
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = os.path.join(self.directorio, captura_id + ".json")
+            with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(captura, f, ensure_ascii=False)
+            os.replace(ruta + ".tmp", ruta)
+            self._recortar()
+        except OSError as e:
+            logger.error(f"⚠️ No se pudo guardar la captura de render lento: {e}")
+            return
+        logger.warning(
+            f"🐢 Render {resultado} ({captura['latencia_ms']} ms, plantilla {captura['plantilla']}, "
+            f"{captura['detalles']} detalles): captura {captura_id}"
+        )
+
+    def _archivos(self):
+        try:
+            # Los ids empiezan por la fecha: el orden alfabético es el cronológico
+            return sorted(n for n in os.listdir(self.directorio) if n.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def _recortar(self):
+        archivos = self._archivos()
+        for nombre in archivos[:max(0, len(archivos) - self.max_capturas)]:
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except FileNotFoundError:
+                pass  # otro proceso la borró primero
+
+    def listar(self):
+        """Resumen de las capturas, la más reciente primero (sin pilas ni forma)."""
+        resumenes = []
+        for nombre in reversed(self._archivos()):
+            captura = self.obtener(nombre[:-len(".json")])
+            if captura is not None:
+                resumenes.append({k: v for k, v in captura.items() if k not in ("pilas", "forma")})
+        return resumenes
+
+    def obtener(self, captura_id):
+        if os.path.basename(captura_id) != captura_id:
+            return None
+        try:
+            with open(os.path.join(self.directorio, captura_id + ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+
+capturas_lentas = CapturasLentas(
+    directorio=Config.SLOW_RENDER_DIR,
+    max_capturas=Config.SLOW_RENDER_MAX_CAPTURES,
+)
@@ -0,0 +1,72 @@
+# app/services/server_timing.py
+#
+# Tiempos por etapa de una petición para el header Server-Timing. El handler
+# marca el fin de cada etapa (validacion, render, head_bucket, ...) y
+# LoggingMiddleware cierra con "respuesta" (serialización del cuerpo) y
+# escribe el header. Las etapas marcadas son consecutivas y suman el total;
+# las sub-etapas del render (render.build, ...) van aparte, ya incluidas en
+# "render".
+
+import time
+
+from fastapi import Request
+
+from app.config import Config
+
+
+class TiemposPeticion:
+    def __init__(self, inicio):
+        self.inicio = inicio
+        self._ultima = inicio
+        self.etapas = []  # [(nombre, segundos, descripción o None)]
+
+    def marcar(self, nombre, descripcion=None):
+        """Cierra la etapa `nombre`: va desde la marca anterior hasta ahora. Devuelve su duración."""
+        ahora = time.perf_counter()
+        segundos = ahora - self._ultima
+        self._ultima = ahora
+        self.etapas.append((nombre, segundos, descripcion))
+        return segundos
+
+    def agregar(self, nombre, segundos, descripcion=None):
+        """Sub-etapa medida en otro lado (p. ej. en el worker de render); no mueve la marca."""
+        self.etapas.append((nombre, segundos, descripcion))
+
+    def agregar_render(self, result):
+        """Sub-etapas que el worker dejó en result["metricas"]; en un acierto de cache no aplican."""
+        if result.get("desde_cache"):
+            self.agregar("render.cache", 0.0, "acierto")
+            return
+        for etapa, segundos in (result.get("metricas") or {}).get("etapas", {}).items():
+            self.agregar(f"render.{etapa}", segundos)
+
+    def milisegundos(self):
+        return {nombre: round(segundos * 1000, 1) for nombre, segundos, _ in self.etapas}
+
+    def header(self):
+        partes = []
+        for nombre, segundos, descripcion in self.etapas:
+            parte = f"{nombre};dur={segundos * 1000:.1f}"
+            if descripcion:
+                parte += f';desc="{descripcion}"'
+            partes.append(parte)
+        partes.append(f"total;dur={(time.perf_counter() - self.inicio) * 1000:.1f}")
+        return ", ".join(partes)
+
+
+def tiempos_peticion(request: Request):
+    """Tiempos de la petición en curso; se crean la primera vez, contando desde que entró al middleware."""
+    tiempos = getattr(request.state, "tiempos", None)
+    if tiempos is None:
+        inicio = getattr(request.state, "inicio", time.perf_counter())
+        tiempos = request.state.tiempos = TiemposPeticion(inicio)
+    return tiempos
+
+
+def escribir_header(request: Request, response):
+    """Lo llama LoggingMiddleware: solo las rutas que crearon tiempos llevan Server-Timing."""
+    tiempos = getattr(request.state, "tiempos", None)
+    if tiempos is None or not Config.SERVER_TIMING:
+        return
+    tiempos.marcar("respuesta")
+    response.headers["Server-Timing"] = tiempos.header()
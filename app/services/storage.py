@@ -0,0 +1,116 @@
+# app/services/storage.py
+
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+
+logger = logging.getLogger("fastapi_app")
+
+MB = 1024 * 1024
+
+_s3_client = None
+_lock = threading.Lock()
+
+# Por encima del umbral, upload_fileobj sube en partes y en paralelo
+transfer_config = TransferConfig(
+    multipart_threshold=Config.S3_MULTIPART_THRESHOLD_MB * MB,
+    multipart_chunksize=Config.S3_MULTIPART_CHUNKSIZE_MB * MB,
+    max_concurrency=Config.S3_MULTIPART_CONCURRENCY,
+    use_threads=True,
+)
+
+
+def _crear_cliente():
+    config = BotoConfig(
+        max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=Config.S3_CONNECT_TIMEOUT,
+        read_timeout=Config.S3_READ_TIMEOUT,
+        retries={"mode": Config.S3_RETRY_MODE, "max_attempts": Config.S3_MAX_ATTEMPTS},
+        # Los S3 locales (MinIO, moto, localstack) no resuelven buckets como subdominio
+        s3={"addressing_style": "path"} if Config.S3_ENDPOINT_URL else None,
+    )
+    return boto3.client(
+        "s3",
+        region_name=Config.S3_REGION,
+        endpoint_url=Config.S3_ENDPOINT_URL,
+        config=config,
+    )
+
+
+def get_s3_client():
+    """
+    Cliente S3 único del proceso (boto3 clients son thread-safe). Se crea en el
+    primer uso: los workers de render nunca lo necesitan y no lo instancian.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _lock:
+            if _s3_client is None:
+                _s3_client = _crear_cliente()
+    return _s3_client
+
+
+def huella_pdf(pdf_bytes: bytes):
+    """sha256 del contenido; viaja como metadato del objeto para saber qué PDF hay en S3."""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _huella_archivo(ruta: str):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(MB), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _extra_args(huella: str):
+    return {
+        "ContentType": "application/pdf",
+        "ContentDisposition": "inline",
+        "Metadata": {"sha256": huella},
+    }
+
+
+def _sync_upload(pdf_bytes: bytes, bucket: str, key: str):
+    logger.info(f"📤 Subiendo {len(pdf_bytes)} bytes a s3://{bucket}/{key}")
+    try:
+        buf = BytesIO(pdf_bytes)
+        get_s3_client().upload_fileobj(
+            buf,
+            bucket,
+            key,
+            ExtraArgs=_extra_args(huella_pdf(pdf_bytes)),
+            Config=transfer_config,
+        )
+        logger.info(f"✅ Subida completada: s3://{bucket}/{key}")
+    except Exception as e:
+        logger.error(f"❌ Error subiendo s3://{bucket}/{key}: {e}")
+        raise
+
+
+def subir_archivo(ruta: str, bucket: str, key: str):
+    """Sube un PDF desde disco; boto3 lo lee por partes, sin cargarlo entero en memoria."""
+    get_s3_client().upload_file(
+        ruta,
+        bucket,
+        key,
+        ExtraArgs=_extra_args(_huella_archivo(ruta)),
+        Config=transfer_config,
+    )
+
+
+async def upload_pdf_to_s3(pdf_bytes: bytes, bucket: str, key: str):
+    """
+    Versión async de upload_pdf_to_s3: delega el trabajo pesado
+    al thread-pool internamente, liberando el event-loop.
+    """
+    await run_in_threadpool(_sync_upload, pdf_bytes, bucket, key)
@@ -0,0 +1,271 @@
+# app/services/upload_outbox.py
+
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+
+from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
+
+from app.config import Config
+from app.database import SessionLocal, engine
+from app.models import UploadOutbox
+from app.services import metrics
+from app.services.bucket_cache import cache_buckets
+from app.services.storage import subir_archivo
+
+logger = logging.getLogger("fastapi_app")
+
+PENDIENTE = "pendiente"
+SUBIENDO = "subiendo"
+MUERTO = "muerto"
+
+MAX_CANDIDATOS_RECLAMO = 5  # filas a intentar por reclamo si otros procesos ganan las primeras
+
+
+def _escribir_spool(directorio, pdf_bytes):
+    """Escritura atómica: archivo temporal + fsync + rename, para no dejar PDFs a medias."""
+    ruta = os.path.join(directorio, f"{uuid.uuid4().hex}.pdf")
+    temporal = ruta + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(pdf_bytes)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+class OutboxUploads:
+    """
+    Outbox persistente de subidas a S3. Cada PDF se escribe en el spool local
+    y se registra en SQLite antes de responder al cliente; N workers lo suben
+    desde disco con backoff exponencial y lo pasan a "muerto" tras
+    `max_intentos`. Sobrevive a reinicios y la memoria no crece con el atraso.
+    """
+
+    def __init__(self, directorio, workers, max_intentos, backoff_base, backoff_max, intervalo, duracion_reclamo):
+        self.directorio = directorio
+        self.workers = max(1, workers)
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.intervalo = intervalo
+        self.duracion_reclamo = duracion_reclamo
+        self._tareas = []
+        self._despertar = None
+        self._lock_reclamo = None
+
+    async def iniciar(self):
+        if self._tareas:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        await run_in_threadpool(self._preparar)
+        self._despertar = asyncio.Event()
+        self._lock_reclamo = asyncio.Lock()
+        self._tareas = [asyncio.create_task(self._trabajar()) for _ in range(self.workers)]
+
+    async def cerrar(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+
+    def _preparar(self):
+        # Las subidas que quedaron a medias en un reinicio no se tocan aquí: otros
+        # procesos pueden seguir subiendo las suyas. Vuelven a la cola cuando
+        # vence su reclamo (ver _reclamar).
+        UploadOutbox.__table__.create(bind=engine, checkfirst=True)
+
+    async def encolar(self, pdf_bytes: bytes, bucket: str, key: str):
+        """Persiste el PDF en el spool y en el índice; la subida la hacen los workers."""
+        registro_id = await run_in_threadpool(self._registrar, pdf_bytes, bucket, key)
+        if self._despertar is not None:
+            self._despertar.set()
+        return registro_id
+
+    def _registrar(self, pdf_bytes, bucket, key):
+        ruta = _escribir_spool(self.directorio, pdf_bytes)
+        ahora = time.time()
+        db = SessionLocal()
+        try:
+            registro = UploadOutbox(
+                bucket=bucket,
+                key=key,
+                ruta=ruta,
+                tamano=len(pdf_bytes),
+                estado=PENDIENTE,
+                intentos=0,
+                proximo_intento=ahora,
+                creado=ahora,
+            )
+            db.add(registro)
+            db.commit()
+            return registro.id
+        except Exception:
+            _borrar_archivo(ruta)
+            raise
+        finally:
+            db.close()
+
+    def _reclamar(self):
+        """
+        Marca como "subiendo" la subida pendiente más antigua que ya toca. El
+        reclamo es un UPDATE condicionado al estado: con varios procesos sobre
+        el mismo outbox solo uno gana cada fila. Mientras está "subiendo",
+        proximo_intento es el vencimiento del reclamo; si el proceso muere,
+        al vencer la fila vuelve a la cola.
+        """
+        db = SessionLocal()
+        try:
+            ahora = time.time()
+            vencidas = (
+                db.query(UploadOutbox)
+                .filter(UploadOutbox.estado == SUBIENDO, UploadOutbox.proximo_intento <= ahora)
+                .update({UploadOutbox.estado: PENDIENTE}, synchronize_session=False)
+            )
+            db.commit()
+            if vencidas:
+                logger.info(f"📦 Outbox: {vencidas} subidas interrumpidas vuelven a la cola")
+
+            candidatos = (
+                db.query(UploadOutbox.id)
+                .filter(UploadOutbox.estado == PENDIENTE, UploadOutbox.proximo_intento <= ahora)
+                .order_by(UploadOutbox.proximo_intento)
+                .limit(MAX_CANDIDATOS_RECLAMO)
+                .all()
+            )
+            for (registro_id,) in candidatos:
+                ganado = (
+                    db.query(UploadOutbox)
+                    .filter(UploadOutbox.id == registro_id, UploadOutbox.estado == PENDIENTE)
+                    .update(
+                        {UploadOutbox.estado: SUBIENDO, UploadOutbox.proximo_intento: ahora + self.duracion_reclamo},
+                        synchronize_session=False,
+                    )
+                )
+                db.commit()
+                if ganado:
+                    registro = db.get(UploadOutbox, registro_id)
+                    return registro.id, registro.ruta, registro.bucket, registro.key, registro.intentos
+            return None
+        finally:
+            db.close()
+
+    def _completar(self, registro_id, ruta):
+        db = SessionLocal()
+        try:
+            db.query(UploadOutbox).filter(UploadOutbox.id == registro_id).delete()
+            db.commit()
+        finally:
+            db.close()
+        _borrar_archivo(ruta)
+
+    def _reprogramar(self, registro_id, intentos, error):
+        db = SessionLocal()
+        try:
+            registro = db.get(UploadOutbox, registro_id)
+            registro.intentos = intentos
+            registro.ultimo_error = error[:1000]
+            if intentos >= self.max_intentos:
+                # Dead-letter: el archivo se conserva en el spool para revisarlo o reintentarlo a mano
+                registro.estado = MUERTO
+            else:
+                espera = min(self.backoff_max, self.backoff_base * 2 ** (intentos - 1))
+                registro.estado = PENDIENTE
+                registro.proximo_intento = time.time() + espera * random.uniform(0.8, 1.2)
+            db.commit()
+            return registro.estado
+        finally:
+            db.close()
+
+    async def _trabajar(self):
+        while True:
+            try:
+                await self._procesar_siguiente()
+            except Exception:
+                # Un error de la base (p. ej. "database is locked" con varios procesos)
+                # no debe matar al worker: el outbox dejaría de vaciarse en silencio.
+                # Un registro a medio procesar se vuelve a reclamar cuando vence su reclamo
+                logger.exception("💥 Outbox: error en el worker, se reintenta en el próximo sondeo")
+                await asyncio.sleep(self.intervalo)
+
+    async def _procesar_siguiente(self):
+        """Reclama y sube un registro; sin pendientes espera a un encolar o al intervalo de sondeo."""
+        async with self._lock_reclamo:
+            # Se limpia antes de consultar: un encolar posterior siempre despierta
+            self._despertar.clear()
+            reclamo = await run_in_threadpool(self._reclamar)
+        if reclamo is None:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            return
+        await self._subir(*reclamo)
+
+    async def _subir(self, registro_id, ruta, bucket, key, intentos):
+        inicio = time.perf_counter()
+        try:
+            await run_in_threadpool(subir_archivo, ruta, bucket, key)
+        except Exception as e:
+            metrics.subidas_s3.observe(time.perf_counter() - inicio, origen="outbox", resultado="error")
+            metrics.fallos_subida_s3.inc(origen="outbox")
+            cache_buckets.registrar_error_subida(bucket, e)
+            estado = await run_in_threadpool(self._reprogramar, registro_id, intentos + 1, str(e))
+            if estado == MUERTO:
+                logger.error(f"☠️ Outbox: s3://{bucket}/{key} descartado tras {intentos + 1} intentos: {e}")
+            else:
+                logger.warning(f"⚠️ Outbox: fallo subiendo s3://{bucket}/{key} (intento {intentos + 1}): {e}")
+            return
+        metrics.subidas_s3.observe(time.perf_counter() - inicio, origen="outbox", resultado="ok")
+        await run_in_threadpool(self._completar, registro_id, ruta)
+        logger.info(f"📤 Outbox: subido s3://{bucket}/{key}")
+
+    def _resumen(self):
+        db = SessionLocal()
+        try:
+            filas = (
+                db.query(
+                    UploadOutbox.estado,
+                    func.count(UploadOutbox.id),
+                    func.coalesce(func.sum(UploadOutbox.tamano), 0),
+                    func.min(UploadOutbox.creado),
+                )
+                .group_by(UploadOutbox.estado)
+                .all()
+            )
+        finally:
+            db.close()
+        ahora = time.time()
+        return {
+            estado: {
+                "cantidad": cantidad,
+                "bytes": int(total),
+                "antiguedad_segundos": round(ahora - mas_antiguo, 1) if mas_antiguo else 0,
+            }
+            for estado, cantidad, total, mas_antiguo in filas
+        }
+
+    async def estado(self):
+        return {"workers": len(self._tareas), "por_estado": await run_in_threadpool(self._resumen)}
+
+
+outbox_uploads = OutboxUploads(
+    directorio=Config.OUTBOX_SPOOL_PATH,
+    workers=Config.OUTBOX_WORKERS,
+    max_intentos=Config.OUTBOX_MAX_ATTEMPTS,
+    backoff_base=Config.OUTBOX_BACKOFF_BASE_SECONDS,
+    backoff_max=Config.OUTBOX_BACKOFF_MAX_SECONDS,
+    intervalo=Config.OUTBOX_POLL_SECONDS,
+    duracion_reclamo=Config.OUTBOX_CLAIM_TIMEOUT_SECONDS,
+)
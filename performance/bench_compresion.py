@@ -0,0 +1,69 @@
+# performance/bench_compresion.py
+#
+# Tamaño del PDF y tiempo de render (incluida la compactación) para cada
+# combinación de caracteristicas.compresion sobre performance/payload.json.
+# "ascii85 sin object streams, nivel 6" es la salida de ReportLab por defecto.
+#
+# Uso (desde la raíz del repo):
+#   python performance/bench_compresion.py --repeticiones 10 --plantillas 1,2
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from app.models import FacturaRequest  # noqa: E402
+from app.services.pdf_generator import generar_pdf  # noqa: E402
+
+CONFIGURACIONES = [
+    # (nombre, nivel, ascii85, flujos_objetos)
+    ("reportlab (A85, xref clásica)", 6, True, False),
+    ("nivel 6", 6, False, False),
+    ("nivel 6 + object streams", 6, False, True),
+    ("nivel 9 + object streams", 9, False, True),
+    ("nivel 1 + object streams", 1, False, True),
+    ("sin compresión", 0, False, False),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamaño y tiempo de render por configuración de compresión")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--plantillas", default="1,2")
+    parser.add_argument("--payload", default=os.path.join(RAIZ, "performance", "payload.json"))
+    args = parser.parse_args()
+
+    with open(args.payload, encoding="utf-8") as f:
+        base = FacturaRequest(**json.load(f)).model_dump()
+
+    for plantilla in args.plantillas.split(","):
+        print(f"\nPlantilla {plantilla} ({len(base['detalles'])} detalles)")
+        print(f"{'configuración':32s} {'bytes':>9s} {'vs RL':>7s} {'p50 ms':>8s}")
+        referencia = None
+        for nombre, nivel, ascii85, flujos in CONFIGURACIONES:
+            factura = copy.deepcopy(base)
+            factura["caracteristicas"]["plantilla"] = plantilla
+            factura["caracteristicas"]["compresion"] = {"nivel": nivel, "ascii85": ascii85, "flujos_objetos": flujos}
+            generar_pdf(factura)  # calentamiento (caches de estilos, logos, QR)
+
+            tiempos = []
+            for _ in range(args.repeticiones):
+                inicio = time.perf_counter()
+                result = generar_pdf(factura)
+                tiempos.append(time.perf_counter() - inicio)
+            tamano = len(result["pdf_bytes"])
+            referencia = referencia or tamano
+            print(
+                f"{nombre:32s} {tamano:9d} {100 * (tamano / referencia - 1):+6.1f}% "
+                f"{statistics.median(tiempos) * 1000:8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# performance/bench_factura_grande.py
+#
+# Memoria y tiempo de render de la plantilla 1 con miles de detalles. Cada
+# tamaño corre en un subproceso limpio para medir su pico de memoria sin
+# arrastrar el de corridas anteriores. "grande" usa el modo streaming
+# (LARGE_INVOICE_MIN_DETALLES=1) y "normal" lo desactiva (=0).
+#
+# Uso (desde la raíz del repo):
+#   python performance/bench_factura_grande.py --detalles 1000,5000,10000,20000,50000 --modos grande,normal
+
+import argparse
+import copy
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def una_corrida(payload, n_detalles):
+    """Se ejecuta en el subproceso: imprime una línea JSON con las mediciones."""
+    sys.path.insert(0, RAIZ)
+    from app.models import FacturaRequest  # noqa: E402
+    from app.services.pdf_generator import generar_pdf  # noqa: E402
+
+    with open(payload, encoding="utf-8") as f:
+        base = FacturaRequest(**json.load(f)).model_dump()
+    base["caracteristicas"]["plantilla"] = "1"
+    modelos = base["detalles"]
+    detalles = []
+    for i in range(n_detalles):
+        detalle = copy.deepcopy(modelos[i % len(modelos)])
+        detalle["numero_linea"] = i + 1
+        detalles.append(detalle)
+    base["detalles"] = detalles
+
+    rss_payload = rss_mb()
+    pico_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    inicio = time.perf_counter()
+    result = generar_pdf(base)
+    duracion = time.perf_counter() - inicio
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(json.dumps({
+        "detalles": n_detalles,
+        "segundos": duracion,
+        "rss_payload_mb": rss_payload,
+        "pico_mb": pico,
+        "pico_render_mb": pico - max(rss_payload, pico_antes),
+        "paginas": result["metricas"]["paginas"],
+        "pdf_kb": len(result["pdf_bytes"]) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de memoria de la plantilla 1 según cantidad de detalles")
+    parser.add_argument("--detalles", default="1000,5000,10000,20000,50000")
+    parser.add_argument("--modos", default="grande,normal", help="grande, normal o ambos separados por coma")
+    parser.add_argument("--payload", default=os.path.join(RAIZ, "performance", "payload.json"))
+    parser.add_argument("--_corrida", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._corrida is not None:
+        una_corrida(args.payload, args._corrida)
+        return
+
+    umbral = {"grande": "1", "normal": "0"}
+    print(f"{'modo':8s} {'detalles':>9s} {'páginas':>8s} {'PDF KB':>8s} {'tiempo':>8s} {'payload':>9s} {'pico render':>12s}")
+    for modo in args.modos.split(","):
+        for n in (int(x) for x in args.detalles.split(",")):
+            env = dict(os.environ, LARGE_INVOICE_MIN_DETALLES=umbral[modo], RENDER_MEMORY_BUDGET_MB="0")
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--payload", args.payload, "--_corrida", str(n)],
+                env=env, capture_output=True, text=True, cwd=RAIZ,
+            )
+            if salida.returncode != 0:
+                print(f"{modo:8s} {n:9d}  ❌ {salida.stderr.strip().splitlines()[-1]}")
+                continue
+            r = json.loads(salida.stdout.strip().splitlines()[-1])
+            print(
+                f"{modo:8s} {n:9d} {r['paginas']:8d} {r['pdf_kb']:8.0f} {r['segundos']:7.1f}s "
+                f"{r['rss_payload_mb']:7.0f}MB {r['pico_render_mb']:10.0f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# performance/stress_qr_concurrente.py
+#
+# Renderiza muchas facturas distintas en paralelo (hilos del mismo proceso,
+# como el backend "inline") y verifica que cada PDF lleve el QR de SU payload:
+# se leen los módulos dibujados con pdfplumber y se comparan con la matriz
+# esperada. Detecta renders que se pisan estado compartido (p. ej. archivos
+# temporales con nombre fijo).
+#
+# Uso (desde la raíz del repo):
+#   python performance/stress_qr_concurrente.py --facturas 200 --hilos 16
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pdfplumber
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from app.models import FacturaRequest  # noqa: E402
+from app.services.pdf_generator import generar_pdf  # noqa: E402
+from app.services.qr_generator import matriz_qr  # noqa: E402
+
+BLANCO = (1, 1, 1)
+
+
+def _color(rect):
+    color = rect.get("non_stroking_color")
+    if color is None:
+        return None
+    color = tuple(float(c) for c in color)
+    return color * 3 if len(color) == 1 else color
+
+
+def qrs_en_pdf(pdf_bytes, lado_qr):
+    """
+    Reconstruye las corridas (columna, fila, largo) de cada QR del PDF: el
+    fondo blanco cuadrado de `lado_qr` puntos delimita el QR y los rectángulos
+    negros dentro de él son los módulos.
+    """
+    encontrados = []
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        for pagina in pdf.pages:
+            rects = pagina.rects
+            fondos = [
+                r for r in rects
+                if _color(r) == BLANCO and abs(r["width"] - lado_qr) < 0.01 and abs(r["height"] - lado_qr) < 0.01
+            ]
+            for fondo in fondos:
+                encontrados.append([
+                    r for r in rects
+                    if r is not fondo and _color(r) != BLANCO
+                    and r["x0"] >= fondo["x0"] - 0.01 and r["x1"] <= fondo["x1"] + 0.01
+                    and r["top"] >= fondo["top"] - 0.01 and r["bottom"] <= fondo["bottom"] + 0.01
+                ] + [fondo])
+    return encontrados
+
+
+def verificar(pdf_bytes, payload_qr, lado_qr):
+    modulos, esperadas = matriz_qr(payload_qr)
+    qrs = qrs_en_pdf(pdf_bytes, lado_qr)
+    if not qrs:
+        return "no se encontró ningún QR"
+    m = lado_qr / modulos
+    for rects in qrs:
+        fondo = rects.pop()
+        corridas = {
+            (round((r["x0"] - fondo["x0"]) / m), round((r["top"] - fondo["top"]) / m), round(r["width"] / m))
+            for r in rects
+        }
+        if corridas != set(esperadas):
+            return f"QR distinto al esperado ({len(corridas ^ set(esperadas))} corridas difieren)"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render concurrente con verificación del QR de cada PDF")
+    parser.add_argument("--facturas", type=int, default=100)
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--plantillas", default="1,2", help="plantillas a alternar, p. ej. 1,2")
+    parser.add_argument("--payload", default=os.path.join(RAIZ, "performance", "payload.json"))
+    args = parser.parse_args()
+
+    with open(args.payload, encoding="utf-8") as f:
+        base = FacturaRequest(**json.load(f)).model_dump()
+    plantillas = args.plantillas.split(",")
+    lado_por_plantilla = {"1": 80, "2": 70, "3": 80}
+
+    def una(i):
+        factura = copy.deepcopy(base)
+        plantilla = plantillas[i % len(plantillas)]
+        cufe = hashlib.sha384(f"stress-{i}".encode()).hexdigest()
+        factura["caracteristicas"]["plantilla"] = plantilla
+        factura["documento"]["identificacion"] = f"STRESS-{i}"
+        factura["documento"]["qr"] = f"https://catalogo-vpfe.dian.gov.co/document/searchqr?documentkey={cufe}"
+        inicio = time.perf_counter()
+        result = generar_pdf(factura)
+        duracion = time.perf_counter() - inicio
+        error = verificar(result["pdf_bytes"], factura["documento"]["qr"], lado_por_plantilla[plantilla])
+        return i, plantilla, duracion, error
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as pool:
+        resultados = list(pool.map(una, range(args.facturas)))
+    total = time.perf_counter() - inicio
+
+    fallos = [(i, p, e) for i, p, _, e in resultados if e]
+    duraciones = sorted(d for _, _, d, _ in resultados)
+    print(
+        f"{len(resultados)} facturas con {args.hilos} hilos en {total:.1f}s | "
+        f"p50 {duraciones[len(duraciones) // 2] * 1000:.0f} ms, "
+        f"p95 {duraciones[int(len(duraciones) * 0.95) - 1] * 1000:.0f} ms"
+    )
+    for i, plantilla, error in fallos:
+        print(f"❌ factura {i} (plantilla {plantilla}): {error}")
+    if fallos:
+        sys.exit(1)
+    print("✅ Cada PDF contiene el QR de su propio payload")
+
+
+if __name__ == "__main__":
+    main()